@@ -1,13 +1,20 @@
 import os
-import logging
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from utils.admission import create_gates
+from utils.artifact_cache import ArtifactCache
+from utils.assets import AssetManifest
+from utils.fragment_cache import FragmentCache
+from utils.log_config import configure_logging
+from utils.profiling import ProfilingMiddleware
+from utils.server_session import DatabaseSessionStore, FileSessionStore, ServerSessionInterface
+
+# Configure logging: LOG_LEVEL (default INFO), LOG_FORMAT 'json' or 'text'
+configure_logging(os.environ.get("LOG_LEVEL", "INFO"), os.environ.get("LOG_FORMAT", "json"))
 
 class Base(DeclarativeBase):
     pass
@@ -28,13 +35,163 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Upper bound for the number of printed copies in a single PDF download
+app.config["PDF_MAX_COPIES"] = int(os.environ.get("PDF_MAX_COPIES", "200"))
+
+# Rendered PDFs of immutable test versions are cached on disk
+app.config["ARTIFACT_CACHE_DIR"] = os.environ.get("ARTIFACT_CACHE_DIR", os.path.join(app.instance_path, "artifacts"))
+
+# Rendered page fragments: entries kept in memory per process, and an optional
+# directory that shares them between the worker processes of a host
+app.config["FRAGMENT_CACHE_SIZE"] = int(os.environ.get("FRAGMENT_CACHE_SIZE", "1024"))
+app.config["FRAGMENT_CACHE_DIR"] = os.environ.get("FRAGMENT_CACHE_DIR")
+
+# Fingerprinted, precompressed static files written by `flask build-assets`
+app.config["ASSET_DIR"] = os.environ.get("ASSET_DIR", os.path.join(app.static_folder, "dist"))
+
+# Compress text responses of at least this many bytes for clients that accept it
+app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+app.config["COMPRESS_MIMETYPES"] = {"text/html", "text/plain", "application/json", "image/svg+xml"}
+
+# Number of processes used for parallel PDF rendering (defaults to the CPU count)
+app.config["RENDER_WORKERS"] = int(os.environ.get("RENDER_WORKERS", "0")) or None
+
+# Largest class roster accepted for printing named tests
+app.config["ROSTER_MAX_BYTES"] = int(os.environ.get("ROSTER_MAX_BYTES", str(1024 * 1024)))
+
+# Background jobs: worker threads started in each process that queues a job,
+# for the development server. Under gunicorn this is 0 (see gunicorn.conf.py)
+# and jobs run only in `flask worker` processes, so the number of jobs running
+# at once is the number of those processes, and no job competes with requests
+# for a web worker's CPU.
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", "2"))
+app.config["JOB_POLL_INTERVAL"] = float(os.environ.get("JOB_POLL_INTERVAL", "5"))
+
+# Minimum seconds between job progress updates written to the database
+app.config["JOB_PROGRESS_INTERVAL"] = 0.5
+
+# Running jobs renew a lease; a job whose worker died is run again once its
+# lease expires, up to JOB_MAX_ATTEMPTS times before it is marked failed
+app.config["JOB_LEASE_SECONDS"] = int(os.environ.get("JOB_LEASE_SECONDS", "60"))
+app.config["JOB_MAX_ATTEMPTS"] = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+# How often and for how long a job progress stream polls before the client
+# reconnects; streams end well within the gunicorn worker timeout
+app.config["JOB_EVENTS_INTERVAL"] = 0.5
+app.config["JOB_EVENTS_TIMEOUT"] = 10
+app.config["JOB_EVENTS_RETRY_MS"] = 500
+
+# Sessions: 'cookie' (the default) keeps Flask's signed-cookie sessions, which
+# answer-key grants keep small (one per template). 'filesystem' or 'database'
+# keep the data server-side and put only a session id in the cookie: the file
+# store is the fastest on a single host, the database store is shared between
+# hosts but costs a query on every request that carries a session cookie.
+app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND", "cookie")
+app.config["SESSION_DIR"] = os.environ.get("SESSION_DIR", os.path.join(app.instance_path, "sessions"))
+app.config["SESSION_TTL"] = int(os.environ.get("SESSION_TTL", str(7 * 24 * 3600)))
+app.config["SESSION_COMPACT_INTERVAL"] = int(os.environ.get("SESSION_COMPACT_INTERVAL", "3600"))
+
+# Answer-key unlocks: lifetime of a template-wide grant, password hashes
+# checked at once per process, and failed attempts allowed per template and
+# window before a lockout
+app.config["ANSWER_KEY_GRANT_TTL"] = int(os.environ.get("ANSWER_KEY_GRANT_TTL", str(8 * 3600)))
+app.config["PASSWORD_CHECK_WORKERS"] = int(os.environ.get("PASSWORD_CHECK_WORKERS", "2"))
+app.config["UNLOCK_MAX_FAILURES"] = int(os.environ.get("UNLOCK_MAX_FAILURES", "5"))
+app.config["UNLOCK_FAILURE_WINDOW"] = int(os.environ.get("UNLOCK_FAILURE_WINDOW", "300"))
+app.config["UNLOCK_LOCKOUT"] = int(os.environ.get("UNLOCK_LOCKOUT", "300"))
+
+# Student submissions are buffered and written in batches of up to this
+# many, at least every flush interval seconds
+app.config["SUBMISSION_BATCH_SIZE"] = int(os.environ.get("SUBMISSION_BATCH_SIZE", "200"))
+app.config["SUBMISSION_FLUSH_INTERVAL"] = float(os.environ.get("SUBMISSION_FLUSH_INTERVAL", "0.25"))
+app.config["SUBMISSION_MAX_ANSWER_LENGTH"] = 200
+
+# Failed writes of a submission before it is set aside in the dead-letter file
+app.config["SUBMISSION_MAX_ATTEMPTS"] = int(os.environ.get("SUBMISSION_MAX_ATTEMPTS", "10"))
+app.config["SUBMISSION_DEAD_LETTER"] = os.environ.get(
+    "SUBMISSION_DEAD_LETTER", os.path.join(app.instance_path, "failed_submissions.jsonl")
+)
+
+# Bulk test creation API: tests per request and tests per database transaction
+app.config["BULK_MAX_TESTS"] = int(os.environ.get("BULK_MAX_TESTS", "1000"))
+app.config["BULK_CHUNK_SIZE"] = 50
+
+# New tests have questions redrawn in versions whose difficulty is further
+# than this many robust standard deviations from the others (0 disables)
+app.config["FAIRNESS_THRESHOLD"] = float(os.environ.get("FAIRNESS_THRESHOLD", "3.0"))
+
+# Admission control for CPU-heavy endpoints: concurrent requests per class,
+# requests allowed to wait for a slot, and how long they wait before a 503
+_render_limit = int(os.environ.get("ADMISSION_RENDER_LIMIT", "0")) or os.cpu_count() or 1
+app.config["ADMISSION_DIR"] = os.environ.get("ADMISSION_DIR", os.path.join(app.instance_path, "admission"))
+app.config["ADMISSION_GATES"] = {
+    # Synchronous PDF renders (cache misses only)
+    "render": {
+        "limit": _render_limit,
+        "queue_size": int(os.environ.get("ADMISSION_RENDER_QUEUE", str(2 * _render_limit))),
+        "timeout": float(os.environ.get("ADMISSION_RENDER_TIMEOUT", "10")),
+    },
+    # ZIP exports that have to render versions
+    "export": {
+        "limit": int(os.environ.get("ADMISSION_EXPORT_LIMIT", "1")),
+        "queue_size": int(os.environ.get("ADMISSION_EXPORT_QUEUE", "1")),
+        "timeout": float(os.environ.get("ADMISSION_EXPORT_TIMEOUT", "5")),
+    },
+    # Bulk test creation API
+    "bulk": {
+        "limit": int(os.environ.get("ADMISSION_BULK_LIMIT", "1")),
+        "queue_size": int(os.environ.get("ADMISSION_BULK_QUEUE", "1")),
+        "timeout": float(os.environ.get("ADMISSION_BULK_TIMEOUT", "5")),
+    },
+}
+
+# Record timings and counters and expose them to operators on /metrics
+app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+# Operator token: requests carrying it (X-Profile header or _profile query
+# parameter) are profiled and may read /metrics and the /_ops pages; unset
+# disables all of them
+app.config["PROFILING_TOKEN"] = os.environ.get("PROFILING_TOKEN")
+app.config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR", os.path.join(app.instance_path, "profiles"))
+app.config["PROFILE_KEEP"] = int(os.environ.get("PROFILE_KEEP", "50"))
+if app.config["PROFILING_TOKEN"]:
+    app.wsgi_app = ProfilingMiddleware(
+        app.wsgi_app, app.config["PROFILING_TOKEN"], app.config["PROFILE_DIR"], app.config["PROFILE_KEEP"]
+    )
+
 # Initialize the app with the database extension
 db.init_app(app)
 
-with app.app_context():
-    # Import models to ensure tables are created
-    import models  # noqa: F401
-    db.create_all()
+# Cache of rendered PDFs for immutable test versions
+artifact_cache = ArtifactCache(app.config["ARTIFACT_CACHE_DIR"])
+
+# Names of the built static files
+asset_manifest = AssetManifest(app.config["ASSET_DIR"])
+
+# Cache of rendered HTML fragments for the version and template pages
+fragment_cache = FragmentCache(app.config["FRAGMENT_CACHE_SIZE"], app.config["FRAGMENT_CACHE_DIR"])
+
+# Slots are locks on files in ADMISSION_DIR, so the limits hold across the
+# workers of a host
+admission_gates = create_gates(app.config["ADMISSION_GATES"], app.config["ADMISSION_DIR"])
+
+# Register the models; the schema itself is created with `flask init-db`
+import models  # noqa: F401, E402
+
+# Server-side sessions; static files never need one
+if app.config["SESSION_BACKEND"] != "cookie":
+    if app.config["SESSION_BACKEND"] == "filesystem":
+        session_store = FileSessionStore(app.config["SESSION_DIR"])
+    else:
+        session_store = DatabaseSessionStore(db, models.SessionRecord)
+    app.session_interface = ServerSessionInterface(
+        session_store,
+        app.config["SESSION_TTL"],
+        compact_interval=app.config["SESSION_COMPACT_INTERVAL"],
+        skip_paths=(app.static_url_path + "/", "/assets/"),
+    )
 
 # Import routes after the app is created to avoid circular imports
 from routes import *  # noqa: F401, E402
+import commands  # noqa: F401, E402
+import instrumentation  # noqa: F401, E402
@@ -0,0 +1,1057 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import as_completed
+
+import click
+from flask import url_for
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import app, db, artifact_cache
+from models import TestTemplate, TestVersion, QuestionTemplate, Question
+from utils.math_generator import generate_question_templates, generate_test_version_questions
+from jobs import run_worker
+from services import (
+    validate_test_spec, hash_passwords, test_spec_from_data, create_test_template, create_test_templates_bulk
+)
+from utils.pdf_version import PDF_RENDERER_VERSION
+from utils.render_pool import get_render_pool
+
+# Namespace for the template uuids derived from manifest entry keys
+MANIFEST_NAMESPACE = uuid.UUID('6f1e3c52-8d0b-4a51-9a7e-2b4f0c9d7e13')
+
+def build_sample_test(num_versions, num_questions, difficulty='medium', topics=None):
+    """
+    Build an unsaved test template with generated versions and questions.
+
+    Used by the maintenance commands and tests to exercise the renderers
+    without a database.
+
+    Returns:
+        tuple: (TestTemplate, list of TestVersion)
+    """
+    topics = topics or ['addition', 'fractions', 'decimals', 'percentages', 'algebra', 'geometry', 'statistics']
+
+    template = TestTemplate(
+        id=1,
+        uuid='00000000-0000-0000-0000-000000000000',
+        title='Sample Test',
+        description='Generated sample test',
+        difficulty=difficulty,
+        topics=','.join(topics),
+        num_questions=num_questions,
+        num_versions=num_versions
+    )
+
+    question_templates = []
+    for i, (topic, question_difficulty, order) in enumerate(
+        generate_question_templates(topics, difficulty, num_questions), start=1
+    ):
+        question_templates.append(QuestionTemplate(
+            id=i, question_type=topic, difficulty=question_difficulty, order=order
+        ))
+
+    versions = []
+    for version_number in range(1, num_versions + 1):
+        version = TestVersion(
+            id=version_number,
+            uuid=f"00000000-0000-0000-0000-{version_number:012d}",
+            test_template_id=template.id,
+            version_number=version_number
+        )
+        version.template = template
+        version.questions = [
+            Question(
+                question_template_id=q_data['question_template_id'],
+                question_text=q_data['question_text'],
+                answer=q_data['answer'],
+                solution_steps=q_data['solution_steps'],
+                order=q_data['order']
+            )
+            for q_data in generate_test_version_questions(question_templates, version_number)
+        ]
+        versions.append(version)
+
+    return template, versions
+
+def warm_up():
+    """
+    Import the heavy libraries and prime the generator and renderer caches.
+
+    Called in the gunicorn master before workers are forked (see
+    gunicorn.conf.py), so every worker starts warm and shares the memory.
+    """
+    from utils.pdf_generator import generate_batch_test_pdf
+
+    topics = ['addition', 'subtraction', 'multiplication', 'division', 'fractions',
+              'decimals', 'percentages', 'algebra', 'geometry', 'statistics']
+    for difficulty in ('easy', 'medium'):
+        template, versions = build_sample_test(2, len(topics), difficulty, topics)
+        generate_batch_test_pdf(template, versions)
+
+def add_missing_columns():
+    """
+    Add columns that the models have but existing tables lack.
+
+    New columns are nullable or have a server default, so adding them
+    in place is enough; nothing is ever dropped or changed.
+
+    Returns:
+        list: "table.column" of each column added
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.schema import CreateColumn
+
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    definition = CreateColumn(column).compile(dialect=db.engine.dialect)
+                    connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}")
+                    added.append(f"{table.name}.{column.name}")
+    return added
+
+@app.cli.command('init-db')
+def init_db():
+    """Create any missing database tables and columns."""
+    db.create_all()
+    for name in add_missing_columns():
+        click.echo(f"Added column {name}")
+    click.echo(f"Database ready: {', '.join(sorted(db.metadata.tables))}")
+
+@app.cli.command('bench-pages')
+@click.option('--versions', default=20, show_default=True, help='Number of test versions.')
+@click.option('--questions', default=20, show_default=True, help='Questions per version.')
+@click.option('--rounds', default=5, show_default=True, help='Warm requests per page.')
+def bench_pages(versions, questions, rounds):
+    """Measure version and template page latency with a cold and a warm fragment cache."""
+    from app import fragment_cache
+
+    # Fragment and HTTP caching are keyed by UUID, so measure on a fresh test
+    spec = {
+        'title': 'Page Benchmark',
+        'difficulty': 'medium',
+        'topics': ['addition', 'fractions', 'decimals', 'percentages', 'geometry'],
+        'num_questions': questions,
+        'num_versions': versions,
+    }
+    with app.test_request_context():
+        template = create_test_template(test_spec_from_data(spec, hash_passwords(['benchmark'])['benchmark']))
+        urls = [url_for('view_test_template', template_uuid=template.uuid)]
+        urls += [url_for('view_test_version', test_uuid=version.uuid) for version in template.test_versions]
+
+    client = app.test_client()
+    try:
+        fragment_cache.clear()
+        cold = _time_requests(client, urls)
+        warm = []
+        for _ in range(rounds):
+            warm.extend(_time_requests(client, urls))
+    finally:
+        db.session.delete(template)
+        db.session.commit()
+
+    for label, timings in (('cold', cold), ('warm', warm)):
+        timings.sort()
+        click.echo(
+            f"{label}: {len(timings)} requests, p50 {timings[len(timings) // 2] * 1000:.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms"
+        )
+
+def _time_requests(client, urls):
+    """GET every URL once and return the latencies in seconds."""
+    timings = []
+    for url in urls:
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise click.ClickException(f"GET {url} returned {response.status_code}")
+    return timings
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress the static files for far-future caching."""
+    from utils.assets import build_assets
+
+    report = build_assets(app.static_folder, app.config['ASSET_DIR'])
+    for name, fingerprinted, sizes in report:
+        variants = ', '.join(f"{encoding} {size}" for encoding, size in sizes.items() if encoding != 'identity')
+        click.echo(f"{name} -> {fingerprinted}: {sizes['identity']} bytes" + (f" ({variants})" if variants else ""))
+    click.echo(f"Built {len(report)} assets into {app.config['ASSET_DIR']}; restart the app to serve them")
+
+@app.cli.command('load-test-submissions')
+@click.option('--clients', default=50, show_default=True, help='Concurrent simulated students.')
+@click.option('--submissions', default=2000, show_default=True, help='Distinct submissions to send.')
+@click.option('--duplicates', default=0.2, show_default=True, help='Share of submissions sent twice (double clicks).')
+@click.option('--questions', default=20, show_default=True, help='Questions in the test.')
+def load_test_submissions(clients, submissions, duplicates, questions):
+    """Send a burst of student submissions through the API and check they are all stored once."""
+    import random
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from models import Submission
+    from submissions import submission_buffer
+
+    spec = {
+        'title': 'Submission Load Test',
+        'difficulty': 'easy',
+        'topics': ['addition', 'fractions'],
+        'num_questions': questions,
+        'num_versions': 4,
+    }
+    with app.test_request_context():
+        template = create_test_template(test_spec_from_data(spec, hash_passwords(['load-test'])['load-test']))
+        urls = [url_for('api_submit_answers', test_uuid=version.uuid) for version in template.test_versions]
+
+    requests_to_send = []
+    for i in range(submissions):
+        body = {
+            'key': f"load-{uuid.uuid4()}",
+            'student_name': f"Student {i + 1}",
+            'answers': {str(order): str(random.randint(1, 100)) for order in range(1, questions + 1)},
+        }
+        requests_to_send.append((urls[i % len(urls)], body))
+        if random.random() < duplicates:
+            requests_to_send.append((urls[i % len(urls)], body))
+    random.shuffle(requests_to_send)
+
+    local = threading.local()
+    def send(item):
+        client = getattr(local, 'client', None) or app.test_client()
+        local.client = client
+        url, body = item
+        return client.post(url, json=body).status_code
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            statuses = list(executor.map(send, requests_to_send))
+        accepted = time.perf_counter() - started
+        submission_buffer.flush()
+        stored_after = time.perf_counter() - started
+
+        failed = sum(1 for status in statuses if status != 202)
+        stored = Submission.query.filter(Submission.test_version_id.in_(
+            [version.id for version in template.test_versions]
+        )).count()
+        click.echo(
+            f"{len(requests_to_send)} requests ({len(requests_to_send) - submissions} duplicates) from {clients} clients: "
+            f"accepted in {accepted:.2f}s ({len(requests_to_send) / accepted:.0f} requests/s), "
+            f"all stored after {stored_after:.2f}s ({submissions / stored_after:.0f} submissions/s)"
+        )
+        click.echo(f"{stored} submissions stored for {submissions} distinct keys, {failed} failed requests")
+    finally:
+        db.session.delete(template)
+        db.session.commit()
+
+    if failed or stored != submissions:
+        raise click.ClickException("Submissions were lost or stored more than once")
+
+@app.cli.command('bench-grading')
+@click.option('--students', default=500, show_default=True, help='Students per test version.')
+@click.option('--versions', default=4, show_default=True, help='Number of test versions.')
+@click.option('--questions', default=30, show_default=True, help='Questions per version.')
+def bench_grading(students, versions, questions):
+    """Measure answer grading throughput, in memory and through the batch grading of stored submissions."""
+    import random
+    from datetime import datetime
+    from grading import grade_template
+    from submissions import write_submissions
+    from utils.answer_equivalence import canonicalize, grade, is_correct, normalize_response
+
+    random.seed(0)
+    template, sample_versions = build_sample_test(versions, questions, 'hard')
+
+    started = time.perf_counter()
+    expected = [
+        {question.order: canonicalize(question.answer) for question in version.questions}
+        for version in sample_versions
+    ]
+    canonicalize_seconds = time.perf_counter() - started
+
+    # Students answer correctly in a variety of spellings, or give one of a few common wrong answers
+    classes = []
+    spelled_correctly = []
+    for version in sample_versions:
+        wrong = {question.order: [f"{random.randint(-20, 60)}" for _ in range(3)] for question in version.questions}
+        responses = []
+        for _ in range(students):
+            response = {}
+            for question in version.questions:
+                if random.random() < 0.7:
+                    response[question.order] = _spell_answer(question.answer, random)
+                    spelled_correctly.append((len(classes), len(responses), question.order))
+                else:
+                    response[question.order] = random.choice(wrong[question.order])
+            responses.append(response)
+        classes.append(responses)
+    answers = sum(len(responses) * questions for responses in classes)
+
+    normalize_response.cache_clear()
+    timings = {}
+    for label in ('cold', 'warm'):
+        started = time.perf_counter()
+        results = [grade(answer_forms, responses) for answer_forms, responses in zip(expected, classes)]
+        timings[label] = time.perf_counter() - started
+    cache = normalize_response.cache_info()
+
+    # Baseline: every response parsed again, as without the memo
+    parse_response = normalize_response.__wrapped__
+    started = time.perf_counter()
+    for answer_forms, responses in zip(expected, classes):
+        for response in responses:
+            for order, form in answer_forms.items():
+                is_correct(form, parse_response(response[order]))
+    timings['unmemoized'] = time.perf_counter() - started
+
+    click.echo(f"Canonicalized {versions * questions} stored answers in {canonicalize_seconds * 1000:.1f} ms")
+    for label, seconds in timings.items():
+        click.echo(f"{label}: graded {answers} answers in {seconds:.3f}s ({answers / seconds:.0f} answers/s)")
+    click.echo(f"{cache.currsize} distinct responses normalized, {cache.hits} memo hits")
+
+    mismatched = sum(1 for version, student, order in spelled_correctly if not results[version][student][order])
+
+    # The same class through the batch API: stored submissions graded in one call
+    spec = {
+        'title': 'Grading Benchmark',
+        'difficulty': 'hard',
+        'topics': ['fractions', 'decimals', 'percentages', 'algebra', 'geometry', 'statistics'],
+        'num_questions': questions,
+        'num_versions': versions,
+    }
+    with app.test_request_context():
+        stored = create_test_template(test_spec_from_data(spec, hash_passwords(['benchmark'])['benchmark']))
+    try:
+        records = []
+        for version, responses in zip(stored.test_versions, classes):
+            question_ids = {question.order: question.id for question in version.questions}
+            for i, response in enumerate(responses):
+                records.append({
+                    'uuid': str(uuid.uuid4()),
+                    'key': f"bench-{uuid.uuid4()}",
+                    'test_version_id': version.id,
+                    'student_name': f"Student {i + 1}",
+                    'submitted_at': datetime.utcnow(),
+                    'answers': [(question_ids[order], answer) for order, answer in response.items()],
+                })
+        for start in range(0, len(records), app.config['SUBMISSION_BATCH_SIZE']):
+            write_submissions(records[start:start + app.config['SUBMISSION_BATCH_SIZE']])
+
+        for label in ('first', 'repeat'):
+            started = time.perf_counter()
+            report = grade_template(stored)
+            seconds = time.perf_counter() - started
+            graded = sum(result['total'] for result in report)
+            click.echo(
+                f"batch API ({label}): graded {len(report)} submissions, {graded} answers in {seconds:.3f}s "
+                f"({graded / seconds:.0f} answers/s)"
+            )
+    finally:
+        db.session.delete(stored)
+        db.session.commit()
+
+    if mismatched:
+        raise click.ClickException(f"{mismatched} correctly spelled answers were graded incorrect")
+
+def _spell_answer(answer, rng):
+    """Respell a correct answer the way a student might."""
+    spellings = [answer, answer.replace(' ', '')]
+    if ', ' in answer and not answer.startswith('('):
+        spellings.append(', '.join(reversed(answer.split(', '))))
+    if '/' in answer and 'sqrt' not in answer and ',' not in answer:
+        numerator, denominator = answer.split('/')
+        spellings.append(f"{int(numerator) * 2}/{int(denominator) * 2}")
+    if answer.endswith('.0'):
+        spellings.append(answer[:-2])
+    return rng.choice(spellings)
+
+@app.cli.command('bench-results')
+@click.option('--submissions', default=8000, show_default=True, help='Submissions written in total.')
+@click.option('--steps', default=4, show_default=True, help='Measure after this many equal batches of submissions.')
+@click.option('--questions', default=30, show_default=True, help='Questions per version.')
+def bench_results(submissions, steps, questions):
+    """Measure the results dashboard and an answer correction as submissions accumulate."""
+    import random
+    from datetime import datetime
+    from grading import correct_answer, grade_template, template_results
+    from submissions import write_submissions
+
+    random.seed(0)
+    spec = {
+        'title': 'Results Benchmark',
+        'difficulty': 'medium',
+        'topics': ['addition', 'fractions', 'decimals', 'algebra', 'statistics'],
+        'num_questions': questions,
+        'num_versions': 4,
+    }
+    with app.test_request_context():
+        template = create_test_template(test_spec_from_data(spec, hash_passwords(['benchmark'])['benchmark']))
+    versions = [
+        {question.order: (question.id, question.answer) for question in version.questions}
+        for version in template.test_versions
+    ]
+
+    try:
+        written = 0
+        per_step = submissions // steps
+        for _ in range(steps):
+            records = []
+            for i in range(per_step):
+                version = template.test_versions[(written + i) % len(versions)]
+                answers = []
+                for question_id, answer in versions[(written + i) % len(versions)].values():
+                    if random.random() < 0.9:
+                        answers.append((question_id, answer if random.random() < 0.7 else str(random.randint(-20, 60))))
+                records.append({
+                    'uuid': str(uuid.uuid4()),
+                    'key': f"bench-{uuid.uuid4()}",
+                    'test_version_id': version.id,
+                    'student_name': f"Student {written + i + 1}",
+                    'submitted_at': datetime.utcnow(),
+                    'answers': answers,
+                })
+            started = time.perf_counter()
+            for start in range(0, len(records), app.config['SUBMISSION_BATCH_SIZE']):
+                write_submissions(records[start:start + app.config['SUBMISSION_BATCH_SIZE']])
+            write_seconds = time.perf_counter() - started
+            written += per_step
+
+            started = time.perf_counter()
+            results = template_results(template)
+            dashboard_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            grade_template(template)
+            regrade_seconds = time.perf_counter() - started
+            click.echo(
+                f"{written} submissions (written at {per_step / write_seconds:.0f}/s): "
+                f"dashboard from totals {dashboard_seconds * 1000:.1f} ms, "
+                f"grading every submission {regrade_seconds * 1000:.0f} ms"
+            )
+
+        question = template.test_versions[0].questions[0]
+        started = time.perf_counter()
+        report = correct_answer(question, str(random.randint(-20, 60)))
+        click.echo(
+            f"Corrected question {question.order} of version 1: regraded {report['answered']} answers in "
+            f"{(time.perf_counter() - started) * 1000:.1f} ms "
+            f"({report['correct_before']} -> {report['correct_after']} correct)"
+        )
+    finally:
+        db.session.delete(template)
+        db.session.commit()
+
+    if results['submissions'] != written:
+        raise click.ClickException(f"The totals count {results['submissions']} of {written} submissions")
+
+@app.cli.command('correct-answer')
+@click.argument('version_uuid')
+@click.argument('question_number', type=int)
+@click.argument('answer')
+def correct_answer_command(version_uuid, question_number, answer):
+    """Grade a question against a corrected answer and regrade its submitted answers."""
+    from grading import correct_answer
+
+    version = TestVersion.query.filter_by(uuid=version_uuid).first()
+    if version is None:
+        raise click.ClickException(f"No test version {version_uuid}")
+    question = Question.query.filter_by(test_version_id=version.id, order=question_number).first()
+    if question is None:
+        raise click.ClickException(f"Version {version.version_number} has no question {question_number}")
+
+    report = correct_answer(question, answer)
+    click.echo(
+        f"Question {question_number} of version {version.version_number} is now graded as {answer!r}: "
+        f"{report['correct_before']} -> {report['correct_after']} of {report['answered']} answers correct"
+    )
+
+@app.cli.command('rebuild-stats')
+@click.argument('template_uuids', nargs=-1)
+def rebuild_stats_command(template_uuids):
+    """Recompute the results totals from the stored submissions (all templates by default)."""
+    from grading import rebuild_stats
+
+    query = TestTemplate.query
+    if template_uuids:
+        query = query.filter(TestTemplate.uuid.in_(template_uuids))
+    templates = query.all()
+    for template in templates:
+        started = time.perf_counter()
+        rebuild_stats(template)
+        click.echo(f"{template.title} ({template.uuid}): rebuilt in {(time.perf_counter() - started) * 1000:.0f} ms")
+    click.echo(f"Rebuilt the totals of {len(templates)} templates")
+
+@app.cli.command('retry-failed-submissions')
+def retry_failed_submissions():
+    """Write the submissions set aside in the dead-letter file again; the ones that still fail stay in it."""
+    from submissions import read_dead_letters, dead_letter_line, write_submissions
+
+    path = app.config['SUBMISSION_DEAD_LETTER']
+    if not os.path.exists(path):
+        click.echo("No submissions were set aside")
+        return
+    # Take the file over, so submissions the app sets aside meanwhile go to a new one
+    retrying = f'{path}.retrying'
+    os.replace(path, retrying)
+    written = 0
+    failed = 0
+    for record in read_dead_letters(retrying):
+        try:
+            written += write_submissions([record])
+        except Exception as e:
+            db.session.rollback()
+            failed += 1
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(dead_letter_line(record, str(e) or e.__class__.__name__))
+    os.unlink(retrying)
+    click.echo(f"Wrote {written} submissions; {failed} still fail and stay in {path}")
+
+@app.cli.command('fairness-report')
+@click.argument('template_uuid')
+@click.option('--threshold', default=None, type=float, help='Outlier threshold (defaults to FAIRNESS_THRESHOLD).')
+def fairness_report(template_uuid, threshold):
+    """Compare the difficulty of the versions of a test and flag the outliers."""
+    from utils.fairness import DEFAULT_THRESHOLD, FEATURES, analyze, feature_array
+
+    template = TestTemplate.query.filter_by(uuid=template_uuid).first()
+    if template is None:
+        raise click.ClickException(f"No test template {template_uuid}")
+    threshold = threshold or app.config['FAIRNESS_THRESHOLD'] or DEFAULT_THRESHOLD
+
+    versions = defaultdict(list)
+    for version_number, question_text, answer, solution_steps in db.session.execute(
+        select(TestVersion.version_number, Question.question_text, Question.answer, Question.solution_steps)
+        .join(Question, Question.test_version_id == TestVersion.id)
+        .where(TestVersion.test_template_id == template.id)
+        .order_by(TestVersion.version_number, Question.order)
+    ):
+        versions[version_number].append(
+            {'question_text': question_text, 'answer': answer, 'solution_steps': solution_steps}
+        )
+
+    started = time.perf_counter()
+    features = feature_array(list(versions.values()))
+    analysis = analyze(features, threshold)
+    elapsed = time.perf_counter() - started
+
+    click.echo(f"{'version':>7} {'score':>7} {'deviation':>9}  hardest question")
+    for index, version_number in enumerate(versions):
+        hardest = int(analysis['difficulty'][index].argmax())
+        click.echo(
+            f"{version_number:>7} {analysis['scores'][index]:>7.3f} {analysis['deviation'][index]:>9.2f}  "
+            f"{hardest + 1}: " + ', '.join(
+                f"{name}={value:g}" for name, value in zip(FEATURES, features[index, hardest])
+            ) + ('  <- outlier' if index in analysis['flagged'] else '')
+        )
+    click.echo(
+        f"{len(analysis['flagged'])} of {len(versions)} versions beyond {threshold:g}; "
+        f"analyzed {features.shape[0] * features.shape[1]} questions in {elapsed * 1000:.1f} ms"
+    )
+
+@app.cli.command('bench-fairness')
+@click.option('--versions', default=100, show_default=True, help='Number of test versions.')
+@click.option('--questions', default=50, show_default=True, help='Questions per version.')
+@click.option('--difficulty', default='hard', show_default=True, type=click.Choice(['easy', 'medium', 'hard']))
+def bench_fairness(versions, questions, difficulty):
+    """Measure the fairness analysis and rebalancing of a generated test."""
+    from types import SimpleNamespace
+    from utils.fairness import DEFAULT_THRESHOLD, analyze, feature_array, rebalance
+    from utils.math_generator import generate_version_question
+
+    topics = ['addition', 'subtraction', 'fractions', 'decimals', 'percentages', 'algebra', 'geometry', 'statistics']
+    question_templates = [
+        SimpleNamespace(id=i, question_type=topic, difficulty=question_difficulty, order=order)
+        for i, (topic, question_difficulty, order) in enumerate(
+            generate_question_templates(topics, difficulty, questions), start=1
+        )
+    ]
+    threshold = app.config['FAIRNESS_THRESHOLD'] or DEFAULT_THRESHOLD
+    drawn = [
+        generate_test_version_questions(question_templates, version_number)
+        for version_number in range(1, versions + 1)
+    ]
+
+    # Load NumPy before timing
+    analyze(feature_array(drawn[:3]))
+
+    started = time.perf_counter()
+    analysis = analyze(feature_array(drawn), threshold)
+    analyze_seconds = time.perf_counter() - started
+    click.echo(
+        f"Analyzed {versions} versions x {questions} questions in {analyze_seconds * 1000:.1f} ms: "
+        f"{len(analysis['flagged'])} outliers, score spread {analysis['scores'].std():.3f}"
+    )
+
+    started = time.perf_counter()
+    replaced = rebalance(drawn, lambda version, question, draw: generate_version_question(
+        question_templates[question], version + 1, draw=draw
+    ), threshold)
+    rebalance_seconds = time.perf_counter() - started
+    analysis = analyze(feature_array(drawn), threshold)
+    click.echo(
+        f"Rebalanced in {rebalance_seconds * 1000:.1f} ms, redrawing {len(replaced)} questions: "
+        f"{len(analysis['flagged'])} outliers, score spread {analysis['scores'].std():.3f}"
+    )
+
+@app.cli.command('assign-seats')
+@click.argument('template_uuid')
+@click.argument('room', type=click.Path(exists=True, dir_okay=False))
+@click.option('--roster', type=click.Path(exists=True, dir_okay=False), help='Class roster: names, or CSV with name and seat columns.')
+@click.option('--output', type=click.Path(file_okay=False), help='Folder for the seating plan and the students\' PDFs.')
+@click.option('--base-url', envvar='BASE_URL', help='Public URL of the site, used for the answer key QR codes.')
+@click.option('--diagonal/--no-diagonal', default=True, show_default=True, help='Whether diagonal seats are neighbours.')
+def assign_seats(template_uuid, room, roster, output, base_url, diagonal):
+    """
+    Hand out the versions of a test so that neighbouring seats get different ones.
+
+    ROOM is drawn as text (one line per row, '.' for gaps) or given as a
+    JSON adjacency list. With --output, the seating plan (seating.csv and
+    chart.txt) is written there, and with a roster a test PDF per student.
+    """
+    from seating import plan_seating, render_header_pdfs, seating_csv, write_student_pdfs
+
+    template = TestTemplate.query.filter_by(uuid=template_uuid).first()
+    if template is None:
+        raise click.ClickException(f"No test template {template_uuid}")
+    with open(room) as f:
+        room_text = f.read()
+    roster_text = None
+    if roster:
+        with open(roster, newline='') as f:
+            roster_text = f.read()
+
+    started = time.perf_counter()
+    try:
+        plan = plan_seating(template, room_text, roster_text, diagonal)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - started
+
+    if plan['chart'] is not None:
+        click.echo(plan['chart'])
+    click.echo(
+        f"Seated {sum(row['student'] is not None for row in plan['seats'])} students in {len(plan['seats'])} seats "
+        f"with {template.num_versions} versions in {elapsed * 1000:.1f} ms: "
+        f"{len(plan['clashes'])} neighbours share a version, {len(plan['shared'])} share questions"
+    )
+    for first, second in plan['clashes']:
+        click.echo(f"  {first} and {second} have the same version", err=True)
+
+    if output:
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, 'seating.csv'), 'w', newline='') as f:
+            f.write(seating_csv(plan))
+        if plan['chart'] is not None:
+            with open(os.path.join(output, 'chart.txt'), 'w') as f:
+                f.write(plan['chart'] + '\n')
+
+        if roster:
+            if not base_url:
+                raise click.ClickException("Printing the tests needs --base-url (or BASE_URL) for the answer key QR codes")
+            with app.test_request_context(base_url=base_url):
+                rendered = render_header_pdfs(
+                    template, (row['version_uuid'] for row in plan['seats'] if row['student'] is not None)
+                )
+            written = write_student_pdfs(plan, os.path.join(output, 'students'), rendered)
+            click.echo(f"Wrote {written} student PDFs to {os.path.join(output, 'students')}")
+
+@app.cli.command('print-roster')
+@click.argument('template_uuid')
+@click.argument('roster', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--room', type=click.Path(exists=True, dir_okay=False), help='Room to seat the students in (see assign-seats).')
+@click.option('--diagonal/--no-diagonal', default=True, show_default=True, help='Whether diagonal seats are neighbours.')
+@click.option('--base-url', envvar='BASE_URL', required=True,
+              help='Public URL of the site, used for the answer key QR codes.')
+@click.option('--workers', type=int, default=None, help='Processes rendering versions (defaults to the CPU count).')
+@click.option('--duplex', is_flag=True, help='Pad each test to an even page count for two-sided printing.')
+def print_roster(template_uuid, roster, output, room, diagonal, base_url, workers, duplex):
+    """
+    Print a test for every student on a ROSTER, with their name on it.
+
+    OUTPUT ending in .zip gets one PDF per student; otherwise OUTPUT is a
+    single print file. Each version handed out is rendered once.
+    """
+    from seating import plan_roster, write_roster
+
+    template = TestTemplate.query.filter_by(uuid=template_uuid).first()
+    if template is None:
+        raise click.ClickException(f"No test template {template_uuid}")
+    with open(roster, newline='') as f:
+        roster_text = f.read()
+    room_text = None
+    if room:
+        with open(room) as f:
+            room_text = f.read()
+
+    started = time.perf_counter()
+    try:
+        plan = plan_roster(template, roster_text, room_text, diagonal)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    total = len(plan['seats'])
+
+    def report(done):
+        if done % 500 == 0 or done == total:
+            elapsed = time.perf_counter() - started
+            click.echo(f"  printed {done}/{total} tests ({done / elapsed:.0f}/s)")
+
+    try:
+        with app.test_request_context(base_url=base_url), open(output, 'wb') as f:
+            write_roster(
+                template, plan, f, as_zip=output.lower().endswith('.zip'), duplex=duplex,
+                pool=get_render_pool(workers or app.config['RENDER_WORKERS']), progress=report
+            )
+    except BaseException:
+        # Leave no half-written file behind
+        if os.path.exists(output):
+            os.remove(output)
+        raise
+    click.echo(f"Wrote the tests of {total} students to {output} in {time.perf_counter() - started:.1f}s")
+
+@app.cli.command('make-scan-fixture')
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('--students', default=300, show_default=True, help='Answer sheets to scan.')
+@click.option('--versions', default=4, show_default=True, help='Number of test versions.')
+@click.option('--questions', default=20, show_default=True, help='Questions per version.')
+@click.option('--dpi', default=150, show_default=True, help='Scan resolution.')
+@click.option('--multiple-choice', is_flag=True, help='Make a multiple-choice test; choices are gridded by number.')
+def make_scan_fixture(output_dir, students, versions, questions, dpi, multiple_choice):
+    """
+    Create a test and a folder of synthetic scans of its filled-in answer sheets.
+
+    The sheets are drawn from the same primitives as the printed PDF, filled
+    in with right and wrong answers, then skewed, shifted and speckled like
+    a scan. expected.json records what each page says, for grade-scans.
+    """
+    import random
+    import numpy as np
+    from PIL import Image
+    from utils.bubble_sheet import (
+        QUESTIONS_PER_PAGE, answer_fills, fill_bubbles, grid_answer, render_sheet_image, sheet_pages, sheet_shapes
+    )
+    from utils.multiple_choice import NUM_CHOICES
+
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    spec = {
+        'title': 'Scan Fixture',
+        'difficulty': 'medium',
+        'topics': ['addition', 'fractions', 'decimals', 'percentages', 'algebra', 'statistics'],
+        'num_questions': questions,
+        'num_versions': versions,
+        'answer_format': 'multiple_choice' if multiple_choice else 'free_response',
+    }
+    with app.test_request_context():
+        template = create_test_template(test_spec_from_data(spec, hash_passwords(['fixture'])['fixture']))
+
+    os.makedirs(output_dir, exist_ok=True)
+    expected = {'template_uuid': template.uuid, 'pages': {}}
+    blank_sheets = {}
+    started = time.perf_counter()
+    for student in range(students):
+        version = template.test_versions[student % len(template.test_versions)]
+        access_code = version.get_access_code()
+        answers = {}
+        for question in version.questions:
+            roll = random.random()
+            if roll < 0.05:
+                continue
+            if question.choices is not None:
+                position = question.choices.answer_position if roll <= 0.8 else random.randrange(NUM_CHOICES)
+                gridded = str(position + 1)
+            else:
+                gridded = grid_answer(question.answer)
+                if gridded is None or roll > 0.8:
+                    gridded = str(random.randint(-99, 999))
+            answers[question.order] = gridded
+
+        for page in range(sheet_pages(len(version.questions))):
+            first = page * QUESTIONS_PER_PAGE
+            fills = [
+                fill
+                for number, gridded in answers.items() if first < number <= first + QUESTIONS_PER_PAGE
+                for fill in answer_fills(number - first - 1, gridded)
+            ]
+            if (access_code, page) not in blank_sheets:
+                blank_sheets[access_code, page] = render_sheet_image(
+                    sheet_shapes(
+                        template.title, access_code, len(version.questions), page, multiple_choice=multiple_choice
+                    ),
+                    dpi=dpi
+                )
+            image = fill_bubbles(blank_sheets[access_code, page], fills, fill_gray=random.randint(20, 110))
+            # Skew and shift the page, then add sensor noise and dust
+            image = image.rotate(
+                random.uniform(-2, 2), resample=Image.BILINEAR, fillcolor=255,
+                translate=(random.randint(-15, 15), random.randint(-15, 15))
+            )
+            pixels = np.asarray(image, dtype=np.float64) + rng.normal(0, 12, (image.height, image.width))
+            dust = rng.random(pixels.shape) < 0.002
+            pixels[dust] = 0
+            name = f"scan{student:04d}-{page + 1}.png"
+            Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(os.path.join(output_dir, name), compress_level=1)
+            expected['pages'][name] = {
+                'access_code': access_code,
+                'page': page,
+                'answers': {
+                    str(number): gridded for number, gridded in answers.items()
+                    if first < number <= first + QUESTIONS_PER_PAGE
+                },
+            }
+
+    with open(os.path.join(output_dir, 'expected.json'), 'w') as f:
+        json.dump(expected, f, indent=1)
+    click.echo(
+        f"Wrote {len(expected['pages'])} pages of {students} answer sheets to {output_dir} "
+        f"in {time.perf_counter() - started:.1f}s (template {template.uuid})"
+    )
+
+@app.cli.command('grade-scans')
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=int, default=None, help='Processes reading the scans (defaults to the CPU count).')
+@click.option('--no-store', is_flag=True, help='Grade without storing the sheets as submissions.')
+@click.option('--report', type=click.Path(dir_okay=False), default=None, help='Write the graded sheets as CSV.')
+def grade_scans_command(folder, workers, no_store, report):
+    """
+    Read and grade a FOLDER of scanned answer sheet pages.
+
+    Pages are read in parallel and grouped into sheets in file name order.
+    When the folder has an expected.json (see make-scan-fixture), the
+    readings are checked against it.
+    """
+    from scans import find_scans, grade_scans
+    from utils.bubble_sheet import read_scan
+
+    paths = find_scans(folder)
+    if not paths:
+        raise click.ClickException(f"No scanned pages in {folder}")
+
+    workers = workers or app.config['RENDER_WORKERS'] or os.cpu_count()
+    started = time.perf_counter()
+    readings = list(get_render_pool(workers).map(read_scan, paths, chunksize=max(1, len(paths) // (workers * 4))))
+    read_seconds = time.perf_counter() - started
+    click.echo(f"Read {len(paths)} pages in {read_seconds:.1f}s ({len(paths) / read_seconds:.1f} pages/s, {workers} workers)")
+
+    started = time.perf_counter()
+    sheets = grade_scans(readings, store=not no_store)
+    grade_seconds = time.perf_counter() - started
+
+    for sheet in sheets:
+        if sheet['error'] is not None:
+            click.echo(f"{', '.join(sheet['paths'])}: {sheet['error']}", err=True)
+        elif sheet['ambiguous']:
+            click.echo(f"{sheet['paths'][0]}: two bubbles filled in a column of {sheet['ambiguous']}", err=True)
+    graded = [sheet for sheet in sheets if sheet['version_uuid'] is not None]
+    click.echo(
+        f"Graded {len(graded)} of {len(sheets)} sheets in {grade_seconds * 1000:.0f} ms"
+        + ("" if no_store else " and stored them as submissions")
+    )
+
+    if report:
+        with open(report, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'version_uuid', 'score', 'total', 'error'])
+            for sheet in sheets:
+                writer.writerow([sheet['paths'][0], sheet['version_uuid'], sheet['score'], sheet['total'], sheet['error'] or ''])
+
+    expected_path = os.path.join(folder, 'expected.json')
+    if os.path.exists(expected_path):
+        with open(expected_path) as f:
+            expected = json.load(f)['pages']
+        misread = [
+            os.path.basename(reading['path']) for reading in readings
+            if os.path.basename(reading['path']) in expected and (
+                reading['access_code'], reading['page'], {str(k): v for k, v in reading['answers'].items()}
+            ) != tuple(expected[os.path.basename(reading['path'])][field] for field in ('access_code', 'page', 'answers'))
+        ]
+        click.echo(f"{len(expected) - len(misread)} of {len(expected)} pages read as filled in")
+        if misread:
+            raise click.ClickException(f"Misread pages: {', '.join(misread[:10])}")
+
+@app.cli.command('worker')
+@click.option('--poll-interval', default=1.0, show_default=True, help='Seconds between polls of an empty queue.')
+@click.option('--burst', is_flag=True, help='Exit once the job queue is empty.')
+def worker(poll_interval, burst):
+    """Run queued background jobs (test creation, PDF renders)."""
+    click.echo(f"Worker started (poll interval {poll_interval}s)")
+    run_worker(poll_interval=poll_interval, burst=burst)
+
+def read_manifest(path):
+    """
+    Read test specifications from a CSV or JSONL manifest.
+
+    CSV manifests have a header row with the spec fields; topics are
+    separated by semicolons, pipes or commas. Each entry gets a stable key
+    (its own ``key`` field, or the file name plus a hash of its contents),
+    which makes reruns skip entries that were already created.
+
+    Yields:
+        tuple: (line number, key, entry dict or None, parse error or None)
+    """
+    name = os.path.basename(path)
+    seen = {}
+
+    def entry_key(entry):
+        if entry.get('key'):
+            return str(entry['key'])
+        digest = hashlib.sha1(json.dumps(entry, sort_keys=True).encode()).hexdigest()[:16]
+        seen[digest] = seen.get(digest, 0) + 1
+        return f"{name}:{digest}#{seen[digest]}"
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                entry = {k.strip(): v.strip() for k, v in row.items() if k and v is not None and v.strip()}
+                entry['topics'] = [t.strip() for t in re.split(r'[;|,]', entry.get('topics', '')) if t.strip()]
+                for field in ('num_questions', 'num_versions'):
+                    if entry.get(field, '').isdigit():
+                        entry[field] = int(entry[field])
+                yield line_number, entry_key(entry), entry, None
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    yield line_number, None, None, f"Invalid JSON: {e}"
+                    continue
+                if not isinstance(entry, dict):
+                    yield line_number, None, None, 'Expected a JSON object'
+                    continue
+                yield line_number, entry_key(entry), entry, None
+
+def prerender_templates(template_uuids, pool):
+    """Render the test and answer key PDF of every version into the artifact cache."""
+    from utils.pdf_generator import render_version_pdf, version_data
+
+    started = time.perf_counter()
+    rendered = skipped = 0
+    pending = {}
+
+    for template_uuid in template_uuids:
+        versions = TestVersion.query.options(
+            joinedload(TestVersion.template),
+            selectinload(TestVersion.questions).selectinload(Question.choices),
+            selectinload(TestVersion.qr_code)
+        ).join(TestTemplate).filter(TestTemplate.uuid == template_uuid).all()
+
+        for version in versions:
+            answer_key_url = url_for('answer_key', test_uuid=version.uuid, _external=True)
+            for kind, url, answers in (('test', answer_key_url, False), ('answers', None, True)):
+                path = artifact_cache.path(kind, version.uuid, PDF_RENDERER_VERSION)
+                if os.path.exists(path):
+                    skipped += 1
+                else:
+                    pending[pool.submit(render_version_pdf, version_data(version, url), url, answers)] = path
+
+    total = len(pending)
+    for done, future in enumerate(as_completed(pending), start=1):
+        artifact_cache.put(pending[future], future.result())
+        rendered += 1
+        if done % 100 == 0 or done == total:
+            elapsed = time.perf_counter() - started
+            click.echo(f"  pre-rendered {done}/{total} PDFs ({done / elapsed:.1f} PDFs/s)")
+
+    return rendered, skipped
+
+@app.cli.command('generate-tests')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--base-url', envvar='BASE_URL', required=True,
+              help='Public URL of the site, used for the answer key QR codes.')
+@click.option('--workers', type=int, default=None, help='Processes in the generation pool (defaults to the CPU count).')
+@click.option('--prerender', is_flag=True, help='Also render every test and answer key PDF into the artifact cache.')
+def generate_tests(manifest, base_url, workers, prerender):
+    """
+    Generate tests offline from a CSV or JSONL MANIFEST.
+
+    Entries that were already created by an earlier run are skipped, so an
+    interrupted run can simply be started again.
+    """
+    started = time.perf_counter()
+    entries = list(read_manifest(manifest))
+    pool = get_render_pool(workers or app.config['RENDER_WORKERS'])
+    chunk_size = app.config['BULK_CHUNK_SIZE']
+
+    created = skipped = failed = 0
+    template_uuids = []
+
+    with app.test_request_context(base_url=base_url):
+        # Validate everything and work out what is left to do
+        todo = []
+        for line_number, key, entry, error in entries:
+            if error is None:
+                errors = validate_test_spec(entry)
+                if errors:
+                    error = '; '.join(f"{field}: {', '.join(messages)}" for field, messages in errors.items())
+            if error is not None:
+                click.echo(f"line {line_number}: {error}", err=True)
+                failed += 1
+                continue
+            todo.append((line_number, str(uuid.uuid5(MANIFEST_NAMESPACE, key)), entry))
+
+        existing = set()
+        all_uuids = [template_uuid for _, template_uuid, _ in todo]
+        for start in range(0, len(all_uuids), 500):
+            existing.update(
+                row.uuid for row in TestTemplate.query.with_entities(TestTemplate.uuid).filter(
+                    TestTemplate.uuid.in_(all_uuids[start:start + 500])
+                )
+            )
+        template_uuids = all_uuids
+        skipped = sum(1 for template_uuid in all_uuids if template_uuid in existing)
+        todo = [item for item in todo if item[1] not in existing]
+        click.echo(
+            f"{len(entries)} manifest entries: {len(todo)} to generate, "
+            f"{skipped} already done, {failed} invalid"
+        )
+
+        password_hashes = hash_passwords(entry['password'] for _, _, entry in todo)
+        generation_started = time.perf_counter()
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            specs = [
+                dict(test_spec_from_data(entry, password_hashes[entry['password']]), uuid=template_uuid)
+                for _, template_uuid, entry in chunk
+            ]
+            for (line_number, template_uuid, _), (report, error) in zip(
+                chunk, create_test_templates_bulk(specs, pool=pool, chunk_size=chunk_size)
+            ):
+                if error is None:
+                    created += 1
+                else:
+                    failed += 1
+                    template_uuids.remove(template_uuid)
+                    click.echo(f"line {line_number}: {error}", err=True)
+
+            elapsed = time.perf_counter() - generation_started
+            done = start + len(chunk)
+            rate = done / elapsed
+            click.echo(
+                f"  generated {done}/{len(todo)} tests ({rate:.1f} tests/s, "
+                f"ETA {(len(todo) - done) / rate:.0f}s)"
+            )
+
+        if prerender:
+            rendered, cached = prerender_templates(template_uuids, pool)
+            click.echo(f"Pre-rendered {rendered} PDFs ({cached} already cached)")
+
+    click.echo(
+        f"Done in {time.perf_counter() - started:.1f}s: {created} created, "
+        f"{skipped} skipped, {failed} failed"
+    )
+    if failed:
+        raise click.ClickException(f"{failed} manifest entries failed; fix them and run again")
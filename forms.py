@@ -1,7 +1,10 @@
+import uuid
+
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import (
     StringField, TextAreaField, IntegerField, SelectField, 
-    SelectMultipleField, widgets, SubmitField, PasswordField
+    SelectMultipleField, widgets, SubmitField, PasswordField, HiddenField, BooleanField
 )
 from wtforms.validators import DataRequired, NumberRange, Length, EqualTo
 
@@ -42,6 +45,15 @@ class TestTemplateForm(FlaskForm):
         validators=[Length(min=1, message="Please select at least one topic")]
     )
     
+    answer_format = SelectField(
+        'Answer Format',
+        choices=[
+            ('free_response', 'Free Response'),
+            ('multiple_choice', 'Multiple Choice')
+        ],
+        default='free_response'
+    )
+    
     num_questions = IntegerField(
         'Number of Questions', 
         validators=[
@@ -75,9 +87,36 @@ class TestTemplateForm(FlaskForm):
         ]
     )
     
+    # Unique per rendered form, so a resubmitted form reuses the same job
+    request_key = HiddenField(default=lambda: str(uuid.uuid4()))
+    
     submit = SubmitField('Generate Tests')
 
 class AnswerKeyAccessForm(FlaskForm):
     """Form for accessing a test's answer key."""
     password = PasswordField('Password', validators=[DataRequired()])
     submit = SubmitField('Access Answer Key')
+
+class SubmissionForm(FlaskForm):
+    """Form for submitting answers to a test version; answer fields are added per question."""
+    student_name = StringField('Your Name', validators=[DataRequired(), Length(min=1, max=100)])
+    
+    # Unique per rendered form, so a double-clicked submit is stored once
+    submission_key = HiddenField(default=lambda: str(uuid.uuid4()))
+    
+    submit = SubmitField('Submit Answers')
+
+class RosterForm(FlaskForm):
+    """Form for printing a test for every student on a class roster."""
+    roster = FileField('Roster (one name per line, or CSV with name and seat columns)', validators=[FileRequired()])
+    room = TextAreaField('Room Layout (Optional)', validators=[Length(max=20000)])
+    output = SelectField(
+        'Output',
+        choices=[
+            ('zip', 'One PDF per student (ZIP)'),
+            ('pdf', 'Single print file (PDF)')
+        ],
+        default='zip'
+    )
+    duplex = BooleanField('Duplex (pad each test to an even page count)')
+    submit = SubmitField('Print Tests')
@@ -0,0 +1,452 @@
+from collections import Counter, defaultdict
+
+from sqlalchemy import bindparam, delete, func, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import (
+    TestVersion, QuestionTemplate, Question, QuestionChoices, CanonicalAnswer, Submission, SubmittedAnswer,
+    VersionStats, QuestionStats, WrongAnswerStats
+)
+from utils.answer_equivalence import canonicalize, dumps, loads, grade, is_correct, normalize_response
+from utils.metrics import ANSWERS_GRADED
+from utils.multiple_choice import answer_letter
+
+# Most common wrong answers shown per question on the results dashboard
+TOP_WRONG_ANSWERS = 3
+
+# Longest wrong answer text counted (answers are at most SUBMISSION_MAX_ANSWER_LENGTH)
+WRONG_ANSWER_LENGTH = 200
+
+def get_answer_forms(question_ids):
+    """
+    Return the canonical answers of questions.
+
+    Every stored answer is parsed once: its canonical form is saved next to
+    the question the first time it is graded. Loading a saved form is
+    memoized, and a corrected answer (see correct_answer) is picked up on
+    the next call. A multiple-choice question is answered with the letter
+    of its answer, so its canonical answer is that letter.
+
+    Args:
+        question_ids (iterable): Question IDs
+
+    Returns:
+        dict: Question ID to canonical Answer
+    """
+    question_ids = set(question_ids)
+    if not question_ids:
+        return {}
+
+    forms = {
+        question_id: loads(form)
+        for question_id, form in db.session.execute(
+            select(CanonicalAnswer.question_id, CanonicalAnswer.form).where(CanonicalAnswer.question_id.in_(question_ids))
+        )
+    }
+    missing = question_ids - forms.keys()
+
+    if missing:
+        rows = []
+        for question_id, answer, position in db.session.execute(
+            select(Question.id, Question.answer, QuestionChoices.answer_position)
+            .outerjoin(QuestionChoices, QuestionChoices.question_id == Question.id)
+            .where(Question.id.in_(missing))
+        ):
+            forms[question_id] = canonicalize(answer if position is None else answer_letter(position))
+            rows.append({'question_id': question_id, 'form': dumps(forms[question_id])})
+        if rows:
+            try:
+                db.session.execute(insert(CanonicalAnswer), rows)
+                db.session.commit()
+            except IntegrityError:
+                # Another process saved them first; the forms are the same
+                db.session.rollback()
+    return forms
+
+def grade_submissions(submission_ids):
+    """
+    Grade stored submissions in one batch.
+
+    Loads the answers of all submissions and the canonical answers of all
+    their questions with a few queries, then grades each version's
+    submissions together.
+
+    Args:
+        submission_ids (iterable): Submission IDs
+
+    Returns:
+        dict: Submission ID to {question ID: correct}; unanswered questions
+            are incorrect
+    """
+    submission_ids = list(submission_ids)
+    if not submission_ids:
+        return {}
+
+    version_ids = dict(db.session.execute(
+        select(Submission.id, Submission.test_version_id).where(Submission.id.in_(submission_ids))
+    ).all())
+    version_questions = defaultdict(list)
+    for question_id, version_id in db.session.execute(
+        select(Question.id, Question.test_version_id).where(Question.test_version_id.in_(set(version_ids.values())))
+    ):
+        version_questions[version_id].append(question_id)
+
+    responses = defaultdict(dict)
+    for submission_id, question_id, answer in db.session.execute(
+        select(SubmittedAnswer.submission_id, SubmittedAnswer.question_id, SubmittedAnswer.answer)
+        .where(SubmittedAnswer.submission_id.in_(version_ids.keys()))
+    ):
+        responses[submission_id][question_id] = answer
+
+    forms = get_answer_forms(question_id for ids in version_questions.values() for question_id in ids)
+
+    by_version = defaultdict(list)
+    for submission_id, version_id in version_ids.items():
+        by_version[version_id].append(submission_id)
+
+    results = {}
+    correct = 0
+    for version_id, ids in by_version.items():
+        expected = {question_id: forms[question_id] for question_id in version_questions[version_id]}
+        for submission_id, graded in zip(ids, grade(expected, [responses[submission_id] for submission_id in ids])):
+            results[submission_id] = graded
+            correct += sum(graded.values())
+
+    graded_total = sum(len(graded) for graded in results.values())
+    ANSWERS_GRADED.inc(correct, result='correct')
+    ANSWERS_GRADED.inc(graded_total - correct, result='incorrect')
+    return results
+
+def grade_template(template):
+    """
+    Grade every stored submission to the versions of a test template.
+
+    Returns:
+        list: One dict per submission, oldest first, with key, student_name,
+            version_number, submitted_at, score, total and correct
+            (question number to bool)
+    """
+    submissions = db.session.execute(
+        select(Submission.id, Submission.key, Submission.student_name, Submission.submitted_at, TestVersion.version_number)
+        .join(TestVersion, Submission.test_version_id == TestVersion.id)
+        .where(TestVersion.test_template_id == template.id)
+        .order_by(Submission.submitted_at, Submission.id)
+    ).all()
+    question_orders = dict(db.session.execute(
+        select(Question.id, Question.order)
+        .join(TestVersion, Question.test_version_id == TestVersion.id)
+        .where(TestVersion.test_template_id == template.id)
+    ).all())
+
+    results = grade_submissions(submission.id for submission in submissions)
+    report = []
+    for submission in submissions:
+        graded = results.get(submission.id, {})
+        report.append({
+            'key': submission.key,
+            'student_name': submission.student_name,
+            'version_number': submission.version_number,
+            'submitted_at': submission.submitted_at,
+            'score': sum(graded.values()),
+            'total': len(graded),
+            'correct': {question_orders[question_id]: ok for question_id, ok in sorted(
+                graded.items(), key=lambda item: question_orders[item[0]]
+            )},
+        })
+    return report
+
+def record_stats(records, forms):
+    """
+    Add a batch of written submissions to the running totals.
+
+    Called in the transaction that writes the submissions, so the totals
+    always agree with the stored submissions.
+
+    Args:
+        records (list): Submission records as written by submissions.write_submissions
+        forms (dict): Canonical answers of the questions answered (see get_answer_forms)
+    """
+    submissions = Counter(record['test_version_id'] for record in records)
+    answered = Counter()
+    correct = Counter()
+    wrong = Counter()
+    for record in records:
+        for question_id, answer in record['answers']:
+            response = normalize_response(answer)
+            answered[question_id] += 1
+            if is_correct(forms[question_id], response):
+                correct[question_id] += 1
+            else:
+                wrong[question_id, response.text[:WRONG_ANSWER_LENGTH]] += 1
+
+    ANSWERS_GRADED.inc(sum(correct.values()), result='correct')
+    ANSWERS_GRADED.inc(sum(wrong.values()), result='incorrect')
+
+    _increment(VersionStats.__table__, ('test_version_id',), [
+        {'test_version_id': version_id, 'submissions': count} for version_id, count in submissions.items()
+    ])
+    _increment(QuestionStats.__table__, ('question_id',), [
+        {'question_id': question_id, 'answered': count, 'correct': correct[question_id]}
+        for question_id, count in answered.items()
+    ])
+    _increment(WrongAnswerStats.__table__, ('question_id', 'answer'), [
+        {'question_id': question_id, 'answer': answer, 'count': count}
+        for (question_id, answer), count in wrong.items()
+    ])
+
+def _increment(table, keys, rows):
+    """
+    Add the counts in rows to a stats table, inserting the rows that do not exist yet.
+
+    On PostgreSQL and SQLite this is one upsert, so concurrent writers (other
+    gunicorn workers) cannot both insert the same key. Rows are written in
+    key order, so two writers never wait on each other's locks in a cycle.
+    """
+    if not rows:
+        return
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    key_columns = [table.c[key] for key in keys]
+    counts = [name for name in rows[0] if name not in keys]
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        statement = upsert(table)
+        db.session.execute(
+            statement.on_conflict_do_update(
+                index_elements=key_columns,
+                set_={name: table.c[name] + statement.excluded[name] for name in counts}
+            ),
+            rows
+        )
+        return
+
+    if len(keys) == 1:
+        condition = key_columns[0].in_([row[keys[0]] for row in rows])
+    else:
+        condition = tuple_(*key_columns).in_([tuple(row[key] for key in keys) for row in rows])
+    existing = {tuple(key) for key in db.session.execute(select(*key_columns).where(condition))}
+
+    updates = [row for row in rows if tuple(row[key] for key in keys) in existing]
+    inserts = [row for row in rows if tuple(row[key] for key in keys) not in existing]
+    if updates:
+        db.session.execute(
+            update(table)
+            .where(*[table.c[key] == bindparam(f"key_{key}") for key in keys])
+            .values({name: table.c[name] + bindparam(f"add_{name}") for name in counts}),
+            [
+                {**{f"key_{key}": row[key] for key in keys}, **{f"add_{name}": row[name] for name in counts}}
+                for row in updates
+            ]
+        )
+    if inserts:
+        db.session.execute(insert(table), inserts)
+
+def correct_answer(question, answer):
+    """
+    Grade a question against a corrected answer from now on, and regrade it.
+
+    The correction replaces the question's canonical answer, which grading
+    uses; the question text and printed answer keys stay as they are, like
+    everything else keyed by a version's UUID. Multiple-choice questions
+    are corrected with a letter.
+
+    Returns:
+        dict: answered, and correct before and after the correction
+    """
+    before = db.session.scalar(select(QuestionStats.correct).where(QuestionStats.question_id == question.id)) or 0
+    form = dumps(canonicalize(answer))
+    updated = db.session.execute(
+        update(CanonicalAnswer).where(CanonicalAnswer.question_id == question.id).values(form=form)
+    ).rowcount
+    if not updated:
+        db.session.add(CanonicalAnswer(question_id=question.id, form=form))
+    db.session.flush()
+
+    rebuild_question_stats([question.id])
+    db.session.commit()
+    stats = QuestionStats.query.filter_by(question_id=question.id).first()
+    return {
+        'answered': stats.answered if stats else 0,
+        'correct_before': before,
+        'correct_after': stats.correct if stats else 0,
+    }
+
+def rebuild_question_stats(question_ids):
+    """
+    Recompute the running totals of questions from all their stored answers.
+
+    Each distinct (question, answer) pair is graded once; the answers are
+    deduplicated and the totals summed with NumPy, so regrading a question
+    answered by thousands of students costs about as much as grading its
+    distinct answers. The caller commits.
+    """
+    import numpy as np  # loads on first regrade, keeping app startup fast
+
+    question_ids = list(question_ids)
+    rows = db.session.execute(
+        select(SubmittedAnswer.question_id, SubmittedAnswer.answer).where(SubmittedAnswer.question_id.in_(question_ids))
+    ).all()
+    forms = get_answer_forms(question_ids)
+
+    db.session.execute(delete(WrongAnswerStats).where(WrongAnswerStats.question_id.in_(question_ids)))
+    db.session.execute(delete(QuestionStats).where(QuestionStats.question_id.in_(question_ids)))
+    if not rows:
+        return
+
+    questions = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    answer_texts, answer_codes = np.unique(np.array([row[1] for row in rows], dtype=object), return_inverse=True)
+    pair_codes, pair_counts = np.unique(questions * len(answer_texts) + answer_codes, return_counts=True)
+    pair_questions = pair_codes // len(answer_texts)
+    pair_answers = pair_codes % len(answer_texts)
+
+    pair_correct = np.fromiter(
+        (
+            is_correct(forms[question_id], normalize_response(answer_texts[answer_code]))
+            for question_id, answer_code in zip(pair_questions.tolist(), pair_answers.tolist())
+        ),
+        dtype=bool, count=len(pair_codes)
+    )
+
+    question_values, pair_question_index = np.unique(pair_questions, return_inverse=True)
+    answered = np.bincount(pair_question_index, weights=pair_counts)
+    correct = np.bincount(pair_question_index, weights=pair_counts * pair_correct, minlength=len(question_values))
+
+    wrong = Counter()
+    for question_id, answer_code, count in zip(
+        pair_questions[~pair_correct].tolist(), pair_answers[~pair_correct].tolist(), pair_counts[~pair_correct].tolist()
+    ):
+        wrong[question_id, normalize_response(answer_texts[answer_code]).text[:WRONG_ANSWER_LENGTH]] += count
+
+    db.session.execute(insert(QuestionStats), [
+        {'question_id': question_id, 'answered': int(count), 'correct': int(right)}
+        for question_id, count, right in zip(question_values.tolist(), answered, correct)
+    ])
+    if wrong:
+        db.session.execute(insert(WrongAnswerStats), [
+            {'question_id': question_id, 'answer': answer, 'count': count}
+            for (question_id, answer), count in wrong.items()
+        ])
+
+def rebuild_stats(template):
+    """
+    Recompute the running totals of a template's versions from the stored submissions.
+
+    For submissions stored before the totals were kept, or to repair them.
+    """
+    version_ids = db.session.scalars(select(TestVersion.id).where(TestVersion.test_template_id == template.id)).all()
+    question_ids = db.session.scalars(select(Question.id).where(Question.test_version_id.in_(version_ids))).all()
+
+    counts = dict(db.session.execute(
+        select(Submission.test_version_id, func.count())
+        .where(Submission.test_version_id.in_(version_ids))
+        .group_by(Submission.test_version_id)
+    ).all())
+    db.session.execute(delete(VersionStats).where(VersionStats.test_version_id.in_(version_ids)))
+    if counts:
+        db.session.execute(insert(VersionStats), [
+            {'test_version_id': version_id, 'submissions': count} for version_id, count in counts.items()
+        ])
+    rebuild_question_stats(question_ids)
+    db.session.commit()
+
+def template_results(template):
+    """
+    Summarize the graded submissions to a template from the running totals.
+
+    Reads only the stats tables (no submissions), so the cost depends on
+    the size of the test, not on how many students took it.
+
+    Returns:
+        dict: versions (number, submissions, average score, percent
+            correct), questions by version (text, answer, percent correct
+            and answered, most common wrong answers) and topics (percent
+            correct by topic and difficulty, hardest first)
+    """
+    versions = db.session.execute(
+        select(TestVersion.id, TestVersion.uuid, TestVersion.version_number, VersionStats.submissions)
+        .outerjoin(VersionStats, VersionStats.test_version_id == TestVersion.id)
+        .where(TestVersion.test_template_id == template.id)
+        .order_by(TestVersion.version_number)
+    ).all()
+    questions = db.session.execute(
+        select(
+            Question.id, Question.test_version_id, Question.order, Question.question_text, Question.answer,
+            QuestionTemplate.question_type, QuestionTemplate.difficulty, QuestionStats.answered, QuestionStats.correct,
+            QuestionChoices.answer_position
+        )
+        .join(QuestionTemplate, Question.question_template_id == QuestionTemplate.id)
+        .outerjoin(QuestionChoices, QuestionChoices.question_id == Question.id)
+        .outerjoin(QuestionStats, QuestionStats.question_id == Question.id)
+        .where(QuestionTemplate.test_template_id == template.id)
+        .order_by(Question.order)
+    ).all()
+
+    ranked = (
+        select(
+            WrongAnswerStats.question_id, WrongAnswerStats.answer, WrongAnswerStats.count,
+            func.row_number().over(
+                partition_by=WrongAnswerStats.question_id,
+                order_by=(WrongAnswerStats.count.desc(), WrongAnswerStats.answer)
+            ).label('rank')
+        )
+        .join(Question, WrongAnswerStats.question_id == Question.id)
+        .join(TestVersion, Question.test_version_id == TestVersion.id)
+        .where(TestVersion.test_template_id == template.id)
+        .subquery()
+    )
+    wrong_answers = defaultdict(list)
+    for question_id, answer, count, _ in db.session.execute(
+        select(ranked).where(ranked.c.rank <= TOP_WRONG_ANSWERS).order_by(ranked.c.question_id, ranked.c.rank)
+    ):
+        wrong_answers[question_id].append((answer, count))
+
+    submissions = {version.id: version.submissions or 0 for version in versions}
+    by_version = defaultdict(list)
+    topics = defaultdict(lambda: [0, 0])
+    correct_by_version = Counter()
+    for question in questions:
+        attempts = submissions[question.test_version_id]
+        correct = question.correct or 0
+        correct_by_version[question.test_version_id] += correct
+        topic = topics[question.question_type, question.difficulty]
+        topic[0] += correct
+        topic[1] += attempts
+        by_version[question.test_version_id].append({
+            'order': question.order,
+            'question_text': question.question_text,
+            'answer': question.answer if question.answer_position is None else f"{answer_letter(question.answer_position)}. {question.answer}",
+            'percent_correct': _percent(correct, attempts),
+            'percent_answered': _percent(question.answered or 0, attempts),
+            'wrong_answers': wrong_answers.get(question.id, []),
+        })
+
+    return {
+        'submissions': sum(submissions.values()),
+        'versions': [
+            {
+                'uuid': version.uuid,
+                'version_number': version.version_number,
+                'submissions': submissions[version.id],
+                'average_score': correct_by_version[version.id] / submissions[version.id] if submissions[version.id] else None,
+                'num_questions': len(by_version[version.id]),
+                'percent_correct': _percent(correct_by_version[version.id], submissions[version.id] * len(by_version[version.id])),
+                'questions': by_version[version.id],
+            }
+            for version in versions
+        ],
+        'topics': sorted(
+            (
+                {'topic': topic, 'difficulty': difficulty, 'percent_correct': _percent(correct, attempts)}
+                for (topic, difficulty), (correct, attempts) in topics.items()
+            ),
+            key=lambda row: (row['percent_correct'] is None, row['percent_correct'])
+        ),
+    }
+
+def _percent(part, whole):
+    return round(100 * part / whole, 1) if whole else None
@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+import time
+
+# Background jobs run in separate `flask worker` processes, never in the web
+# workers; set before the app is imported, which reads it at import
+os.environ.setdefault("JOB_WORKERS", "0")
+
+# Serve the app imported by main.py
+wsgi_app = "main:app"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+# Each worker serves requests on a few threads, so a job progress stream, a
+# streamed ZIP export or a multi-second PDF render holds one thread rather
+# than a whole worker. Threaded workers check in from their main loop, so
+# the timeout only restarts workers that hang, not ones busy with a long
+# request; it must stay above the longest request all the same
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+
+# Import the app once in the master and fork workers from it, so workers
+# start in milliseconds and share the imported code
+preload_app = True
+
+def on_starting(server):
+    """Prime the generator and renderer caches before the first fork."""
+    from commands import warm_up
+
+    started = time.perf_counter()
+    warm_up()
+    server.log.info("Warm-up done in %.2fs", time.perf_counter() - started)
+
+def post_fork(server, worker):
+    """Give each worker its own database connections."""
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
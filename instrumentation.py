@@ -0,0 +1,39 @@
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+from utils.metrics import enable_metrics, HTTP_REQUEST_SECONDS, DB_QUERY_SECONDS
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started:
+        operation = statement.lstrip().split(None, 1)[0].upper()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started.pop(), operation=operation)
+
+def record_request_start():
+    g.request_started = time.perf_counter()
+
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+# Hooks are only installed when metrics are on, so disabled metrics cost nothing
+if app.config['METRICS_ENABLED']:
+    enable_metrics()
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(record_request_start)
+    app.after_request(record_request_duration)
@@ -0,0 +1,337 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import url_for
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+
+from app import app, db, artifact_cache
+from models import Job, TestTemplate, TestVersion, Question
+from services import create_test_template
+from utils.pdf_version import PDF_RENDERER_VERSION
+
+# Registered job handlers, keyed by job kind
+JOB_HANDLERS = {}
+
+# In-process worker threads, started lazily in each process that enqueues jobs
+_worker_lock = threading.Lock()
+_worker_pid = None
+_worker_wakeup = threading.Event()
+
+# Fields reset when a job is queued again
+REQUEUED_FIELDS = {
+    'status': 'queued',
+    'result': None,
+    'error': None,
+    'progress_done': 0,
+    'progress_total': 0,
+    'started_at': None,
+    'finished_at': None,
+    'heartbeat_at': None,
+}
+
+def job_handler(kind):
+    """Register a function as the handler for a job kind."""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+def enqueue_job(kind, payload, key=None, requeue_finished=False):
+    """
+    Queue a background job, or return the existing job with the same key.
+
+    Args:
+        kind (str): Registered job kind
+        payload (dict): JSON-serializable job arguments
+        key (str, optional): Idempotency key; defaults to a random key
+        requeue_finished (bool): Run a finished job with the same key again
+
+    Returns:
+        Job: The queued (or existing) job
+    """
+    key = key or f"{kind}:{uuid.uuid4()}"
+
+    job = Job.query.filter_by(key=key).first()
+    if job is None:
+        job = Job(key=key, kind=kind, payload=json.dumps(payload))
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request queued the same job first
+            db.session.rollback()
+            return Job.query.filter_by(key=key).one()
+    elif (job.finished and requeue_finished) or is_stale(job):
+        # Only one request requeues the job, and never one a worker has just claimed
+        requeued = Job.query.filter_by(id=job.id, status=job.status, heartbeat_at=job.heartbeat_at).update(
+            dict(REQUEUED_FIELDS, payload=json.dumps(payload), attempts=0),
+            synchronize_session=False
+        )
+        db.session.commit()
+        db.session.refresh(job)
+        if not requeued:
+            return job
+    else:
+        return job
+
+    if app.config['JOB_WORKERS']:
+        start_job_workers(app.config['JOB_WORKERS'])
+        _worker_wakeup.set()
+    return job
+
+def lease_cutoff():
+    """Return the time before which a running job's last heartbeat means its worker died."""
+    return datetime.utcnow() - timedelta(seconds=app.config['JOB_LEASE_SECONDS'])
+
+def is_stale(job):
+    """Check whether a job is marked running but its worker stopped renewing the lease."""
+    return job.status == 'running' and (job.heartbeat_at is None or job.heartbeat_at < lease_cutoff())
+
+def recover_stale_jobs():
+    """
+    Queue running jobs whose worker died again, or fail them after
+    JOB_MAX_ATTEMPTS claims.
+
+    Returns:
+        tuple: (jobs requeued, jobs failed)
+    """
+    stale = (Job.status == 'running') & (Job.heartbeat_at.is_(None) | (Job.heartbeat_at < lease_cutoff()))
+    failed = Job.query.filter(stale, Job.attempts >= app.config['JOB_MAX_ATTEMPTS']).update(
+        {'status': 'failed', 'error': 'The worker running this job stopped', 'finished_at': datetime.utcnow()},
+        synchronize_session=False
+    )
+    requeued = Job.query.filter(stale).update(REQUEUED_FIELDS, synchronize_session=False)
+    db.session.commit()
+    if requeued or failed:
+        app.logger.warning("Recovered stale jobs: %d requeued, %d failed", requeued, failed)
+    return requeued, failed
+
+def claim_next_job():
+    """Mark the oldest queued job as running and return it, or None."""
+    recover_stale_jobs()
+    while True:
+        job = Job.query.filter_by(status='queued').order_by(Job.id).first()
+        if job is None:
+            db.session.rollback()
+            return None
+
+        # Only one worker wins the queued -> running transition
+        now = datetime.utcnow()
+        claimed = Job.query.filter_by(id=job.id, status='queued').update(
+            {'status': 'running', 'started_at': now, 'heartbeat_at': now, 'attempts': Job.attempts + 1},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if claimed:
+            db.session.refresh(job)
+            return job
+
+class JobProgress:
+    """
+    Progress callback that records job progress, committing at most every
+    interval seconds. Each commit also renews the job's lease.
+    """
+
+    def __init__(self, job, label, interval=None):
+        self.job = job
+        self.job.progress_label = label
+        self.interval = app.config['JOB_PROGRESS_INTERVAL'] if interval is None else interval
+        self._last_commit = 0.0
+
+    def __call__(self, done, total):
+        self.job.progress_done = done
+        self.job.progress_total = total
+        now = time.monotonic()
+        if done >= total or now - self._last_commit >= self.interval:
+            self.job.heartbeat_at = datetime.utcnow()
+            db.session.commit()
+            self._last_commit = now
+
+def renew_lease(job_id, stop):
+    """Renew the lease of a running job until stop is set, for phases that report no progress."""
+    interval = app.config['JOB_LEASE_SECONDS'] / 3
+    while not stop.wait(interval):
+        with app.app_context():
+            try:
+                Job.query.filter_by(id=job_id, status='running').update(
+                    {'heartbeat_at': datetime.utcnow()}, synchronize_session=False
+                )
+                db.session.commit()
+            except Exception:
+                # The job's own transaction may hold the database; try again next time
+                db.session.rollback()
+                app.logger.warning("Could not renew the lease of job %s", job_id, exc_info=True)
+
+def run_job(job):
+    """Run a claimed job and record its result or error."""
+    handler = JOB_HANDLERS[job.kind]
+    app.logger.info("Running job %s (%s)", job.uuid, job.kind)
+    started = time.perf_counter()
+
+    stop = threading.Event()
+    threading.Thread(target=renew_lease, args=(job.id, stop), name=f"job-lease-{job.id}", daemon=True).start()
+    try:
+        result = handler(job, job.get_payload())
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("Job %s (%s) failed", job.uuid, job.kind)
+        job.status = 'failed'
+        job.error = str(e) or e.__class__.__name__
+    else:
+        job.status = 'done'
+        job.result = json.dumps(result or {})
+        app.logger.info("Job %s (%s) done in %.2fs", job.uuid, job.kind, time.perf_counter() - started)
+
+    finally:
+        stop.set()
+
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+def run_worker(poll_interval=1.0, burst=False, wakeup=None):
+    """
+    Process queued jobs until stopped.
+
+    Args:
+        poll_interval (float): Seconds to wait between polls of an empty queue
+        burst (bool): Return once the queue is empty instead of waiting
+        wakeup (threading.Event, optional): Event that cuts a poll wait short
+    """
+    while True:
+        with app.app_context():
+            job = claim_next_job()
+            if job is not None:
+                run_job(job)
+                continue
+
+        if burst:
+            return
+        if wakeup is not None:
+            wakeup.wait(poll_interval)
+            wakeup.clear()
+        else:
+            time.sleep(poll_interval)
+
+def start_job_workers(count):
+    """Start the in-process worker threads once per process."""
+    global _worker_pid
+
+    with _worker_lock:
+        # Threads do not survive a fork, so track the owning process
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+
+        for i in range(count):
+            thread = threading.Thread(
+                target=run_worker,
+                kwargs={'poll_interval': app.config['JOB_POLL_INTERVAL'], 'wakeup': _worker_wakeup},
+                name=f"job-worker-{i + 1}",
+                daemon=True
+            )
+            thread.start()
+
+@job_handler('create_test')
+def run_create_test_job(job, payload):
+    """Generate a test template with all versions from a test specification."""
+    spec = payload['spec']
+    progress = JobProgress(job, 'versions generated')
+    progress(0, spec['num_versions'])
+
+    # Answer key URLs in the QR codes are built against the submitting host
+    with app.test_request_context(base_url=payload['base_url']):
+        # A run whose worker died leaves its template behind: finished, or
+        # half-built (and hidden), in which case it is built again
+        template = TestTemplate.query.filter_by(uuid=spec['uuid']).first()
+        if template is not None and template.status != 'ready':
+            db.session.delete(template)
+            db.session.commit()
+            template = None
+
+        if template is None:
+            try:
+                template = create_test_template(spec, progress=progress)
+            except Exception:
+                # Progress updates commit partial work, so remove it again
+                db.session.rollback()
+                partial = TestTemplate.query.filter_by(uuid=spec['uuid']).first()
+                if partial is not None:
+                    db.session.delete(partial)
+                    db.session.commit()
+                raise
+
+        return {
+            'template_uuid': template.uuid,
+            'redirect_url': url_for('view_test_template', template_uuid=template.uuid),
+        }
+
+@job_handler('render_batch_pdf')
+def run_render_batch_pdf_job(job, payload):
+    """Render the batch PDF of a test template into the artifact cache."""
+    from utils.pdf_generator import generate_batch_test_pdf  # ReportLab loads on first use
+
+    template = TestTemplate.query.filter_by(uuid=payload['template_uuid']).one()
+    versions = TestVersion.query.options(
+        selectinload(TestVersion.qr_code),
+        selectinload(TestVersion.questions).selectinload(Question.choices)
+    ).filter_by(
+        test_template_id=template.id
+    ).order_by(TestVersion.version_number).all()
+
+    # Cover page plus two pages per version
+    total_pages = 1 + 2 * len(versions)
+    progress = JobProgress(job, 'pages rendered')
+    progress(0, total_pages)
+
+    pdf_buffer = generate_batch_test_pdf(
+        template, versions,
+        copies=payload['copies'], duplex=payload['duplex'],
+        progress=lambda pages: progress(min(pages, total_pages), total_pages)
+    )
+    path = artifact_cache.path(payload['artifact_kind'], template.uuid, PDF_RENDERER_VERSION)
+    artifact_cache.put(path, pdf_buffer.getvalue())
+    progress(total_pages, total_pages)
+
+    return {'redirect_url': payload['redirect_url']}
+
+@job_handler('print_roster')
+def run_print_roster_job(job, payload):
+    """Print a test for every student on a roster into the artifact cache."""
+    from seating import plan_roster, write_roster
+    from utils.render_pool import get_render_pool
+
+    template = TestTemplate.query.filter_by(uuid=payload['template_uuid']).one()
+    # The route left the roster in the cache; it is removed once the job is done
+    # (a worker that dies leaves it for the job to be run again)
+    input_path = artifact_cache.path('roster-input', payload['artifact_key'], PDF_RENDERER_VERSION, extension='json')
+    data = artifact_cache.get(input_path)
+    if data is None:
+        raise ValueError("The roster is no longer available; please upload it again")
+    try:
+        roster = json.loads(data)
+        with app.test_request_context(base_url=payload['base_url']):
+            plan = plan_roster(template, roster['roster'], roster['room'])
+            total = len(plan['seats'])
+            progress = JobProgress(job, 'tests printed')
+            progress(0, total)
+
+            path = artifact_cache.path(payload['artifact_kind'], payload['artifact_key'], PDF_RENDERER_VERSION)
+            with artifact_cache.writer(path) as f:
+                write_roster(
+                    template, plan, f, as_zip=payload['output'] == 'zip', duplex=payload['duplex'],
+                    pool=get_render_pool(app.config['RENDER_WORKERS']),
+                    progress=lambda done: progress(done, total)
+                )
+            progress(total, total)
+    finally:
+        try:
+            os.unlink(input_path)
+        except FileNotFoundError:
+            pass
+
+    return {'redirect_url': payload['redirect_url']}
@@ -1,4 +1,7 @@
-from app import app  # noqa: F401
+from app import app, db  # noqa: F401
 
 if __name__ == "__main__":
+    # The development server creates missing tables; deployments run `flask init-db`
+    with app.app_context():
+        db.create_all()
     app.run(host="0.0.0.0", port=5000, debug=True)
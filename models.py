@@ -1,8 +1,11 @@
 import uuid
+import json
 import hashlib
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+from utils.qr_generator import encode_qr_matrix
+from utils.multiple_choice import answer_letter, unpack_choices
 
 class TestTemplate(db.Model):
     """Model representing a math test template."""
@@ -16,6 +19,8 @@ class TestTemplate(db.Model):
     num_versions = db.Column(db.Integer, nullable=False, default=1)  # Number of unique test versions
     password_hash = db.Column(db.String(256), nullable=False)  # For secure answer key access
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 'building' while a background job generates it; only 'ready' templates are shown
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')
     
     # Relationships
     question_templates = db.relationship('QuestionTemplate', backref='test_template', lazy=True, cascade="all, delete-orphan")
@@ -51,15 +56,34 @@ class TestVersion(db.Model):
     
     # Relationship with questions
     questions = db.relationship('Question', backref='test_version', lazy=True, cascade="all, delete-orphan")
+    qr_code = db.relationship('VersionQRCode', backref='test_version', uselist=False, lazy=True, cascade="all, delete-orphan")
+    submissions = db.relationship('Submission', backref='test_version', lazy=True, cascade="all, delete-orphan")
+    stats = db.relationship('VersionStats', backref='test_version', uselist=False, lazy=True, cascade="all, delete-orphan")
     
     def get_access_code(self):
         """Generate a unique access code for this test version's answer key."""
         unique_string = f"{self.uuid}-{self.test_template_id}-{self.version_number}"
         return hashlib.md5(unique_string.encode()).hexdigest()[:8].upper()
     
+    def get_qr_matrix(self, answer_key_url):
+        """Return the packed QR matrix for this version's answer key URL."""
+        if self.qr_code is not None and self.qr_code.payload == answer_key_url:
+            return self.qr_code.matrix
+        return encode_qr_matrix(answer_key_url)
+    
     def __repr__(self):
         return f"<TestVersion {self.version_number} for TestTemplate {self.test_template_id}>"
 
+class VersionQRCode(db.Model):
+    """Model storing the precomputed answer key QR code of a test version."""
+    id = db.Column(db.Integer, primary_key=True)
+    test_version_id = db.Column(db.Integer, db.ForeignKey('test_version.id'), unique=True, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # Encoded answer key URL
+    matrix = db.Column(db.LargeBinary, nullable=False)  # Packed module matrix (see utils.qr_generator)
+    
+    def __repr__(self):
+        return f"<VersionQRCode for TestVersion {self.test_version_id}>"
+
 class Question(db.Model):
     """Model representing a specific question instance."""
     id = db.Column(db.Integer, primary_key=True)
@@ -72,6 +96,161 @@ class Question(db.Model):
     
     # Relationship with question template
     question_template = db.relationship('QuestionTemplate')
+    canonical_answer = db.relationship('CanonicalAnswer', backref='question', uselist=False, lazy=True, cascade="all, delete-orphan")
+    stats = db.relationship('QuestionStats', backref='question', uselist=False, lazy=True, cascade="all, delete-orphan")
+    wrong_answers = db.relationship('WrongAnswerStats', backref='question', lazy=True, cascade="all, delete-orphan")
+    choices = db.relationship('QuestionChoices', backref='question', uselist=False, lazy=True, cascade="all, delete-orphan")
+    
+    def get_choices(self):
+        """Return the choices of a multiple-choice question in display order, or None."""
+        if self.choices is None:
+            return None
+        return unpack_choices(self.answer, self.choices.distractors, self.choices.answer_position)
+    
+    def get_answer_letter(self):
+        """Return the letter of the correct choice of a multiple-choice question, or None."""
+        if self.choices is None:
+            return None
+        return answer_letter(self.choices.answer_position)
     
     def __repr__(self):
         return f"<Question {self.id} for TestVersion {self.test_version_id}>"
+
+class QuestionChoices(db.Model):
+    """Model storing the choices of a multiple-choice question."""
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), unique=True, nullable=False)
+    distractors = db.Column(db.Text, nullable=False)  # Wrong choices in display order (see utils.multiple_choice)
+    answer_position = db.Column(db.SmallInteger, nullable=False)  # Position of the answer among the choices
+    
+    def __repr__(self):
+        return f"<QuestionChoices for Question {self.question_id}>"
+
+class CanonicalAnswer(db.Model):
+    """Model storing the parsed canonical form of a question's answer, for grading."""
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), unique=True, nullable=False)
+    form = db.Column(db.Text, nullable=False)  # JSON (see utils.answer_equivalence)
+    
+    def __repr__(self):
+        return f"<CanonicalAnswer for Question {self.question_id}>"
+
+class Submission(db.Model):
+    """Model representing a student's submitted answers to a test version."""
+    id = db.Column(db.Integer, primary_key=True)
+    uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
+    key = db.Column(db.String(64), unique=True, nullable=False)  # Idempotency key chosen by the client
+    test_version_id = db.Column(db.Integer, db.ForeignKey('test_version.id'), nullable=False, index=True)
+    student_name = db.Column(db.String(100), nullable=False)
+    submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relationship with the answers
+    answers = db.relationship('SubmittedAnswer', backref='submission', lazy=True, cascade="all, delete-orphan")
+    
+    def __repr__(self):
+        return f"<Submission {self.uuid} for TestVersion {self.test_version_id}>"
+
+class SubmittedAnswer(db.Model):
+    """Model representing a student's answer to one question."""
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False, index=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    
+    def __repr__(self):
+        return f"<SubmittedAnswer {self.id} for Submission {self.submission_id}>"
+
+class VersionStats(db.Model):
+    """Model keeping running totals of the graded submissions to a test version."""
+    id = db.Column(db.Integer, primary_key=True)
+    test_version_id = db.Column(db.Integer, db.ForeignKey('test_version.id'), unique=True, nullable=False)
+    submissions = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<VersionStats for TestVersion {self.test_version_id}: {self.submissions} submissions>"
+
+class QuestionStats(db.Model):
+    """Model keeping running totals of the graded answers to a question."""
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), unique=True, nullable=False)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<QuestionStats for Question {self.question_id}: {self.correct}/{self.answered}>"
+
+class WrongAnswerStats(db.Model):
+    """Model counting how often a (normalized) wrong answer was given to a question."""
+    __table_args__ = (db.UniqueConstraint('question_id', 'answer'),)
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
+    answer = db.Column(db.String(200), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<WrongAnswerStats {self.answer!r} x{self.count} for Question {self.question_id}>"
+
+class Job(db.Model):
+    """Model representing a background job (test creation, PDF rendering)."""
+    id = db.Column(db.Integer, primary_key=True)
+    uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
+    key = db.Column(db.String(200), unique=True, nullable=False)  # Idempotency key
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # 'queued', 'running', 'done', 'failed'
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON arguments
+    result = db.Column(db.Text, nullable=True)  # JSON result
+    error = db.Column(db.Text, nullable=True)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer, nullable=False, default=0)
+    progress_label = db.Column(db.String(50), nullable=True)  # Unit of progress, e.g. 'versions generated'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Last sign of life of the worker running the job
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Times the job was claimed
+    
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+    
+    def get_payload(self):
+        return json.loads(self.payload or '{}')
+    
+    def get_result(self):
+        return json.loads(self.result) if self.result else {}
+    
+    def to_dict(self):
+        """Return the job state as a JSON-serializable dictionary."""
+        return {
+            'id': self.uuid,
+            'kind': self.kind,
+            'status': self.status,
+            'progress_done': self.progress_done,
+            'progress_total': self.progress_total,
+            'progress_label': self.progress_label,
+            'error': self.error,
+            'result': self.get_result(),
+        }
+    
+    def __repr__(self):
+        return f"<Job {self.kind} {self.status}>"
+
+class UnlockThrottle(db.Model):
+    """Model tracking failed answer-key password attempts per test template."""
+    id = db.Column(db.Integer, primary_key=True)
+    template_uuid = db.Column(db.String(36), unique=True, nullable=False)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    window_started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<UnlockThrottle {self.template_uuid}: {self.failures} failures>"
+
+class SessionRecord(db.Model):
+    """Model storing server-side session data under its session id."""
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<SessionRecord expires {self.expires_at}>"
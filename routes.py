@@ -1,22 +1,223 @@
+import hashlib
 import io
+import json
+import math
+import mimetypes
 import os
+import pstats
+import re
+import time
+import tracemalloc
+import uuid
+import zipfile
+from concurrent.futures import as_completed
 from datetime import datetime
 from flask import (
     render_template, request, redirect, url_for, flash, 
-    jsonify, send_file, abort, session
+    jsonify, send_file, send_from_directory, abort, session, Response, stream_with_context, make_response
 )
-from app import app, db
-from models import TestTemplate, TestVersion, QuestionTemplate, Question
-from forms import TestTemplateForm, AnswerKeyAccessForm
-from utils.pdf_generator import generate_test_pdf, generate_batch_test_pdf
-from utils.qr_generator import generate_qr_code
-from utils.math_generator import generate_question_templates, generate_test_version_questions
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy.orm import selectinload, joinedload
+from app import app, db, artifact_cache, admission_gates, fragment_cache, asset_manifest
+from models import TestTemplate, TestVersion, QuestionTemplate, Question, Job
+from forms import TestTemplateForm, AnswerKeyAccessForm, SubmissionForm, RosterForm
+from utils.pdf_version import PDF_RENDERER_VERSION
+from utils.compression import ENCODINGS, ENCODING_SUFFIXES, choose_encoding, compress
+from utils.metrics import render_metrics
+from utils.profiling import token_matches, list_profiles
+from utils.qr_generator import render_qr_svg
+from utils.render_pool import get_render_pool
+from utils.zip_stream import stream_zip
+from services import (
+    test_spec_from_form, test_spec_from_data, validate_test_spec, hash_passwords, create_test_templates_bulk,
+    verify_template_password
+)
+from jobs import enqueue_job
+from submissions import submit_answers, find_submission
+from grading import grade_template, template_results
+
+# Bump when the version or template page templates change; part of their
+# ETags and of the keys of their cached fragments
+PAGE_RENDERER_VERSION = 4
+
+# Immutable responses may be cached for a year without revalidation
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Latest tracemalloc snapshot of this worker, for comparisons
+_last_memory_snapshot = None
 
 # Add now function for templates
 @app.context_processor
 def inject_now():
     return {'now': datetime.utcnow}
 
+@app.template_global()
+def asset_url(filename):
+    """URL of a static file; fingerprinted once `flask build-assets` has run."""
+    fingerprinted = asset_manifest.get(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('static_asset', filename=fingerprinted)
+
+@app.after_request
+def compress_response(response):
+    """Compress text responses above the size threshold with the best coding the client accepts."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in app.config['COMPRESS_MIMETYPES']):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    if response.content_length is None or response.content_length < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    # Each coding is a different representation, so it needs its own strong ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+def get_print_options():
+    """Read the copies and duplex print options from the query string."""
+    copies = request.args.get('copies', 1, type=int) or 1
+    copies = max(1, min(copies, app.config['PDF_MAX_COPIES']))
+    duplex = request.args.get('duplex', '') in ('1', 'true', 'on')
+    return copies, duplex
+
+def _grant_serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt='answer-key-grant')
+
+def rotate_session():
+    """
+    Give the session a new id when it gains privileges.
+    
+    Only server-side sessions have an id to rotate; a cookie session
+    changes with its data anyway.
+    """
+    regenerate = getattr(session, 'regenerate', None)
+    if regenerate is not None:
+        regenerate()
+
+def grant_template_unlock(template):
+    """Give the session a signed, time-limited grant to all answer keys of a template."""
+    serializer = _grant_serializer()
+    grants = {}
+    # Carry over the grants that are still valid, dropping expired ones
+    for template_uuid, token in session.get('answer_key_grants', {}).items():
+        try:
+            serializer.loads(token, max_age=app.config['ANSWER_KEY_GRANT_TTL'])
+        except BadSignature:
+            continue
+        grants[template_uuid] = token
+    grants[template.uuid] = serializer.dumps(template.uuid)
+    session['answer_key_grants'] = grants
+    rotate_session()
+
+def is_template_unlocked(template):
+    """Check whether the session holds a valid grant to the answer keys of a template."""
+    token = session.get('answer_key_grants', {}).get(template.uuid)
+    if not token:
+        return False
+    try:
+        return _grant_serializer().loads(token, max_age=app.config['ANSWER_KEY_GRANT_TTL']) == template.uuid
+    except BadSignature:
+        return False
+
+def check_unlock_password(template, form):
+    """
+    Verify a submitted answer-key password and grant the template on success.
+    
+    Returns:
+        int: 0 when the password was checked, or the seconds left in a
+            lockout after too many failed attempts
+    """
+    correct, retry_after = verify_template_password(template, form.password.data)
+    if correct:
+        grant_template_unlock(template)
+    elif retry_after:
+        flash(f'Too many incorrect attempts. Please try again in {math.ceil(retry_after / 60)} minutes.', 'error')
+    else:
+        flash('Incorrect password. Please try again.', 'error')
+    return retry_after
+
+def throttled(response, retry_after):
+    """Turn a response into 429 Too Many Requests while unlock attempts are locked out."""
+    if retry_after:
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def is_operator():
+    """
+    Check whether the request comes from an operator.
+    
+    Operators present the profiling token like they do to profile a request:
+    in the X-Profile header on every request (scripts, metrics scrapers), or
+    once in the _profile query parameter, after which the session remembers
+    it until the token changes.
+    """
+    token = app.config['PROFILING_TOKEN']
+    if not token:
+        return False
+    
+    if token_matches(request.headers.get('X-Profile'), token):
+        return True
+    fingerprint = hashlib.sha256(token.encode()).hexdigest()[:16]
+    if token_matches(request.args.get('_profile'), token) and session.get('operator') != fingerprint:
+        session['operator'] = fingerprint
+        rotate_session()
+    return session.get('operator') == fingerprint
+
+def immutable_etag(*parts, renderer_version=PDF_RENDERER_VERSION):
+    """Build the strong ETag of immutable content from its identifying parts and the renderer version."""
+    return '-'.join(str(part) for part in parts) + f"-r{renderer_version}"
+
+def not_modified(etag, private=False, revalidate=False):
+    """Return a 304 response when the client already holds this ETag (in any coding), otherwise None."""
+    for candidate in [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]:
+        if request.if_none_match.contains(candidate):
+            return cache_immutable(Response(status=304), candidate, private=private, revalidate=revalidate)
+    return None
+
+def cache_immutable(response, etag, private=False, revalidate=False):
+    """
+    Mark a response for immutable content as cacheable.
+    
+    Public content is cacheable by shared caches for a year. Private content
+    (answer keys) stays out of shared caches and is revalidated on every
+    use, so the access check runs before the browser gets its 304. HTML
+    pages (revalidate) may be shared but are revalidated on every use too:
+    their URLs do not change with PAGE_RENDERER_VERSION, so a page cached
+    for a year would never show a new page template.
+    """
+    response.set_etag(etag)
+    response.headers.pop('Expires', None)
+    if private:
+        response.cache_control.public = None
+        response.cache_control.max_age = None
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    elif revalidate:
+        response.cache_control.public = True
+        response.cache_control.max_age = None
+        response.cache_control.immutable = None
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+def is_safe_redirect(target):
+    """Only allow redirects to local paths."""
+    return bool(target) and target.startswith('/') and not target.startswith('//')
+
 @app.route('/')
 def index():
     """Home page with information about the application."""
@@ -28,104 +229,254 @@ def create_test():
     form = TestTemplateForm()
     
     if form.validate_on_submit():
-        # Create a new test template
-        test_template = TestTemplate()
-        test_template.title = form.title.data
-        test_template.description = form.description.data
-        test_template.difficulty = form.difficulty.data
-        # Handle the case where topics might be None
-        if form.topics.data:
-            test_template.topics = ','.join(form.topics.data)
-        else:
-            test_template.topics = ''
-        test_template.num_questions = form.num_questions.data
-        test_template.num_versions = form.num_versions.data
-        
-        # Set the password for answer key access
-        test_template.set_password(form.password.data)
-        
-        # Save the test template
-        db.session.add(test_template)
-        db.session.flush()  # Flush to get template ID
-        
-        # Generate question templates
-        question_template_data = generate_question_templates(
-            topics=form.topics.data,
-            difficulty=form.difficulty.data,
-            num_questions=form.num_questions.data
+        # Generate the versions in the background and follow the job's progress
+        spec = test_spec_from_form(form)
+        spec['uuid'] = str(uuid.uuid4())
+        job = enqueue_job(
+            'create_test',
+            {'spec': spec, 'base_url': request.host_url},
+            key=f"create_test:{form.request_key.data or uuid.uuid4()}"[:200]
         )
+        return redirect(url_for('view_job', job_uuid=job.uuid))
+    
+    return render_template('create_test.html', form=form)
+
+@app.route('/api/tests', methods=['POST'])
+def api_create_tests():
+    """
+    Create many tests from a JSON array of test specifications.
+    
+    Each item has title, topics, difficulty, num_questions, num_versions,
+    password and optionally description and answer_format
+    ('free_response' or 'multiple_choice'). The response reports every item
+    in input order, so invalid or failed items do not block the others.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('tests')
+    if not isinstance(data, list) or not data:
+        return jsonify({'error': 'Expected a non-empty JSON array of test specifications'}), 400
+    if len(data) > app.config['BULK_MAX_TESTS']:
+        return jsonify({'error': f"At most {app.config['BULK_MAX_TESTS']} tests per request"}), 400
+    
+    # Validate everything up front
+    results = [{'index': i, 'ok': False} for i in range(len(data))]
+    valid = []
+    for i, item in enumerate(data):
+        errors = validate_test_spec(item)
+        if errors:
+            results[i]['errors'] = errors
+        else:
+            valid.append(i)
+    
+    if valid:
+        with admission_gates['bulk'].admit():
+            password_hashes = hash_passwords(data[i]['password'] for i in valid)
+            specs = [test_spec_from_data(data[i], password_hashes[data[i]['password']]) for i in valid]
         
-        # Create question templates
-        for i, (topic, difficulty, order) in enumerate(question_template_data):
-            question_template = QuestionTemplate()
-            question_template.test_template_id = test_template.id
-            question_template.question_type = topic
-            question_template.difficulty = difficulty
-            question_template.order = order
-            db.session.add(question_template)
-        
-        # Commit to save question templates
-        db.session.commit()
-        
-        # Reload question templates from the database to ensure they have IDs
-        question_templates = QuestionTemplate.query.filter_by(
-            test_template_id=test_template.id
-        ).order_by(QuestionTemplate.order).all()
-        
-        # Generate each test version
-        num_versions = form.num_versions.data
-        if num_versions is None:
-            num_versions = 1
-        for version_number in range(1, num_versions + 1):
-            # Create a version record
-            test_version = TestVersion()
-            test_version.test_template_id = test_template.id
-            test_version.version_number = version_number
-            db.session.add(test_version)
-            db.session.flush()  # Flush to get version ID
-            
-            # Generate questions for this version
-            questions_data = generate_test_version_questions(question_templates, version_number)
-            
-            # Add questions to the database
-            for q_data in questions_data:
-                question = Question()
-                question.test_version_id = test_version.id
-                question.question_template_id = q_data['question_template_id']
-                question.question_text = q_data['question_text']
-                question.answer = q_data['answer']
-                question.solution_steps = q_data['solution_steps']
-                question.order = q_data['order']
-                db.session.add(question)
-        
-        # Final commit for all versions and questions
-        db.session.commit()
+            # Generate on the shared process pool when there is more than one core to use
+            workers = app.config['RENDER_WORKERS'] or os.cpu_count() or 1
+            pool = get_render_pool(app.config['RENDER_WORKERS']) if workers > 1 and len(specs) > 1 else None
         
-        # Redirect to view the test template
-        flash('Test created successfully with multiple versions!', 'success')
-        return redirect(url_for('view_test_template', template_uuid=test_template.uuid))
+            started = time.perf_counter()
+            for i, (report, error) in zip(valid, create_test_templates_bulk(specs, pool=pool)):
+                if error is not None:
+                    results[i]['errors'] = {'generation': [str(error) or error.__class__.__name__]}
+                    continue
+                results[i].update(report)
+                results[i]['ok'] = True
+                results[i]['url'] = url_for('view_test_template', template_uuid=report['uuid'], _external=True)
+            elapsed = time.perf_counter() - started
+            app.logger.info("Bulk created %d tests in %.2fs (%.0f tests/s)",
+                            len(specs), elapsed, len(specs) / elapsed if elapsed else 0)
     
-    return render_template('create_test.html', form=form)
+    created = sum(1 for result in results if result['ok'])
+    if created == len(results):
+        status = 201
+    elif created == 0:
+        status = 422
+    else:
+        status = 207
+    return jsonify({'created': created, 'failed': len(results) - created, 'results': results}), status
+
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    """Serve a fingerprinted static file, precompressed when the client accepts it."""
+    directory = app.config['ASSET_DIR']
+    available = [
+        encoding for encoding in ENCODINGS
+        if os.path.isfile(os.path.join(directory, filename + ENCODING_SUFFIXES[encoding]))
+    ]
+    encoding = choose_encoding(request.accept_encodings, available)
+    
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if encoding is None:
+        response = send_from_directory(directory, filename, mimetype=mimetype)
+    else:
+        response = send_from_directory(directory, filename + ENCODING_SUFFIXES[encoding], mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+    
+    # The name changes with the content, so the file can be cached forever
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/test-template/<template_uuid>')
 def view_test_template(template_uuid):
     """View a test template and its versions."""
-    template = TestTemplate.query.filter_by(uuid=template_uuid).first_or_404()
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
     
-    # Get all versions of this test
-    versions = TestVersion.query.filter_by(
-        test_template_id=template.id
-    ).order_by(TestVersion.version_number).all()
+    def render_version_table():
+        versions = TestVersion.query.filter_by(
+            test_template_id=template.id
+        ).order_by(TestVersion.version_number).all()
+        return render_template('fragments/version_table.html', versions=versions)
     
-    return render_template('view_test_template.html', template=template, versions=versions)
+    version_table = fragment_cache.get_or_render(
+        'version-table', template.uuid, PAGE_RENDERER_VERSION, render_version_table
+    )
+    return render_template('view_test_template.html', template=template, version_table=version_table)
 
 @app.route('/test-template/<template_uuid>/pdf')
 def download_batch_pdf(template_uuid):
     """Generate and download a PDF with all versions of the test."""
-    template = TestTemplate.query.filter_by(uuid=template_uuid).first_or_404()
+    copies, duplex = get_print_options()
+    kind = f"batch-x{copies}-duplex" if duplex else f"batch-x{copies}"
+    etag = immutable_etag(kind, template_uuid)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
     
-    # Get all versions of this test
-    versions = TestVersion.query.filter_by(
+    if TestVersion.query.filter_by(test_template_id=template.id).first() is None:
+        flash('No test versions found for this template.', 'error')
+        return redirect(url_for('view_test_template', template_uuid=template.uuid))
+    
+    # Serve the rendered PDF, or render it in the background first
+    pdf_data = artifact_cache.get(artifact_cache.path(kind, template.uuid, PDF_RENDERER_VERSION))
+    if pdf_data is None:
+        job = enqueue_job(
+            'render_batch_pdf',
+            {
+                'template_uuid': template.uuid,
+                'copies': copies,
+                'duplex': duplex,
+                'artifact_kind': kind,
+                'redirect_url': request.full_path,
+            },
+            key=f"render_batch_pdf:{template.uuid}:{kind}:r{PDF_RENDERER_VERSION}",
+            requeue_finished=True
+        )
+        return redirect(url_for('view_job', job_uuid=job.uuid))
+    
+    # Send the PDF as a downloadable file
+    copies_suffix = f"_x{copies}" if copies > 1 else ""
+    return cache_immutable(send_file(
+        io.BytesIO(pdf_data),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f"{template.title.replace(' ', '_')}_all_versions{copies_suffix}.pdf"
+    ), etag)
+
+@app.route('/test-template/<template_uuid>/unlock', methods=['GET', 'POST'])
+def unlock_template(template_uuid):
+    """Unlock the answer keys of all versions of a template with its password."""
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
+    next_url = request.args.get('next')
+    if not is_safe_redirect(next_url):
+        next_url = url_for('view_test_template', template_uuid=template.uuid)
+    
+    if is_template_unlocked(template):
+        return redirect(next_url)
+    
+    form = AnswerKeyAccessForm()
+    retry_after = 0
+    if form.validate_on_submit():
+        retry_after = check_unlock_password(template, form)
+        if is_template_unlocked(template):
+            return redirect(next_url)
+    
+    response = make_response(render_template(
+        'answer_key_auth.html',
+        test_version=None,
+        template=template,
+        form=form
+    ))
+    return throttled(response, retry_after)
+
+@app.route('/test-template/<template_uuid>/answer-keys.pdf')
+def download_batch_answer_key_pdf(template_uuid):
+    """Generate and download one PDF with the answer keys of all versions."""
+    from utils.pdf_generator import generate_batch_answer_key_pdf  # ReportLab loads on first use
+    
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
+    
+    if not is_template_unlocked(template):
+        return redirect(url_for('unlock_template', template_uuid=template.uuid, next=request.full_path))
+    
+    include_solutions = request.args.get('solutions') == '1'
+    kind = 'answer-keys-solutions' if include_solutions else 'answer-keys'
+    etag = immutable_etag(kind, template.uuid)
+    cached = not_modified(etag, private=True)
+    if cached is not None:
+        return cached
+    
+    def render():
+        # Load every version with its questions in a single query
+        rows = db.session.query(TestVersion, Question).join(
+            Question, Question.test_version_id == TestVersion.id
+        ).filter(
+            TestVersion.test_template_id == template.id
+        ).order_by(TestVersion.version_number, Question.order).all()
+        
+        versions_with_questions = []
+        for version, question in rows:
+            if not versions_with_questions or versions_with_questions[-1][0] is not version:
+                versions_with_questions.append((version, []))
+            versions_with_questions[-1][1].append(question)
+        
+        pdf_buffer = generate_batch_answer_key_pdf(
+            template, versions_with_questions, include_solutions=include_solutions
+        )
+        return pdf_buffer.getvalue()
+    
+    pdf_data = artifact_cache.get_or_render(
+        artifact_cache.path(kind, template.uuid, PDF_RENDERER_VERSION),
+        lambda: admission_gates['render'].run(render)
+    )
+    
+    # Send the PDF as a downloadable file
+    return cache_immutable(send_file(
+        io.BytesIO(pdf_data),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f"{template.title.replace(' ', '_')}_answer_keys.pdf"
+    ), etag, private=True)
+
+@app.route('/test-template/<template_uuid>/export.zip')
+def export_template_zip(template_uuid):
+    """Stream a ZIP with the test PDF and answer key PDF of every version."""
+    from utils.pdf_generator import render_version_pdf, version_data  # ReportLab loads on first use
+    
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
+    
+    # Answer keys are included unless explicitly excluded, and need the password
+    include_answers = request.args.get('answers', '1') != '0'
+    if include_answers and not is_template_unlocked(template):
+        return redirect(url_for('unlock_template', template_uuid=template.uuid, next=request.full_path))
+    
+    compression = zipfile.ZIP_STORED if request.args.get('compression') == 'stored' else zipfile.ZIP_DEFLATED
+    
+    # Load everything the renderers need up front; workers have no database access
+    versions = TestVersion.query.options(
+        joinedload(TestVersion.template),
+        selectinload(TestVersion.questions).selectinload(Question.choices),
+        selectinload(TestVersion.qr_code)
+    ).filter_by(
         test_template_id=template.id
     ).order_by(TestVersion.version_number).all()
     
@@ -133,71 +484,263 @@ def download_batch_pdf(template_uuid):
         flash('No test versions found for this template.', 'error')
         return redirect(url_for('view_test_template', template_uuid=template.uuid))
     
-    # Generate batch PDF
-    pdf_buffer = generate_batch_test_pdf(template, versions)
+    folder = template.title.replace(' ', '_')
+    entries = []
+    for version in versions:
+        answer_key_url = url_for('answer_key', test_uuid=version.uuid, _external=True)
+        base_name = f"{folder}/v{version.version_number:03d}_{version.get_access_code()}"
+        entries.append((
+            f"{base_name}_test.pdf",
+            artifact_cache.path('test', version.uuid, PDF_RENDERER_VERSION),
+            version, answer_key_url, False
+        ))
+        if include_answers:
+            entries.append((
+                f"{base_name}_answers.pdf",
+                artifact_cache.path('answers', version.uuid, PDF_RENDERER_VERSION),
+                version, None, True
+            ))
+    
+    # Exports with nothing left to render are cheap and skip the export gate
+    needs_render = any(not os.path.exists(entry[1]) for entry in entries)
+    slot = admission_gates['export'].enter() if needs_render else None
+    
+    pool = get_render_pool(app.config['RENDER_WORKERS'])
+    logger = app.logger
+    
+    def generate_entries():
+        try:
+            yield from render_entries()
+        finally:
+            if slot is not None:
+                slot.release()
+    
+    def render_entries():
+        started = time.perf_counter()
+        cached = []
+        pending = {}
+        
+        # Start rendering every cache miss before sending the cached files
+        for name, path, version, answer_key_url, answers in entries:
+            data = artifact_cache.get(path)
+            if data is None:
+                future = pool.submit(render_version_pdf, version_data(version, answer_key_url), answer_key_url, answers)
+                pending[future] = (name, path)
+            else:
+                cached.append((name, data))
+        
+        total_bytes = 0
+        for name, data in cached:
+            total_bytes += len(data)
+            yield name, data
+        
+        for future in as_completed(pending):
+            name, path = pending[future]
+            data = future.result()
+            artifact_cache.put(path, data)
+            total_bytes += len(data)
+            yield name, data
+        
+        elapsed = time.perf_counter() - started
+        logger.info(
+            "Exported %s: %d files (%d rendered, %d cached), %.1f MB in %.2fs (%.1f files/s, %.1f MB/s)",
+            template.uuid, len(entries), len(pending), len(cached), total_bytes / 1e6,
+            elapsed, len(entries) / elapsed, total_bytes / 1e6 / elapsed
+        )
+    
+    response = Response(stream_zip(generate_entries(), compression), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{folder}_export.zip"'
+    if slot is not None:
+        # The ZIP renders while it streams, so hold the slot until it is sent or the body is closed
+        response.call_on_close(slot.release)
+    return response
+
+@app.route('/test-template/<template_uuid>/roster', methods=['GET', 'POST'])
+def print_roster(template_uuid):
+    """Print a test for every student on an uploaded roster, with their name on it."""
+    from seating import plan_roster
+    
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
+    # Rosters name students, so they are for whoever holds the password
+    if not is_template_unlocked(template):
+        return redirect(url_for('unlock_template', template_uuid=template.uuid, next=request.full_path))
+    
+    form = RosterForm()
+    if form.validate_on_submit():
+        data = form.roster.data.read(app.config['ROSTER_MAX_BYTES'] + 1)
+        try:
+            if len(data) > app.config['ROSTER_MAX_BYTES']:
+                raise ValueError("The roster is too large")
+            roster = data.decode('utf-8-sig')
+            room = form.room.data or None
+            # Check the roster fits before queueing; the job plans it again
+            plan_roster(template, roster, room)
+        except UnicodeDecodeError:
+            flash('The roster must be a UTF-8 text or CSV file.', 'error')
+        except ValueError as e:
+            flash(str(e), 'error')
+        else:
+            digest = hashlib.sha256(json.dumps(
+                [roster, room, form.output.data, form.duplex.data, request.host_url]
+            ).encode()).hexdigest()[:16]
+            kind = f"roster-{form.output.data}"
+            key = f"{template.uuid}-{digest}"
+            download_url = url_for('download_roster', template_uuid=template.uuid, key=digest, output=form.output.data)
+            if os.path.exists(artifact_cache.path(kind, key, PDF_RENDERER_VERSION)):
+                return redirect(download_url)
+            # The student names stay out of the job row; the job deletes them when it is done
+            artifact_cache.put(
+                artifact_cache.path('roster-input', key, PDF_RENDERER_VERSION, extension='json'),
+                json.dumps({'roster': roster, 'room': room}).encode()
+            )
+            job = enqueue_job(
+                'print_roster',
+                {
+                    'template_uuid': template.uuid,
+                    'output': form.output.data,
+                    'duplex': form.duplex.data,
+                    'base_url': request.host_url,
+                    'artifact_kind': kind,
+                    'artifact_key': key,
+                    'redirect_url': download_url,
+                },
+                key=f"print_roster:{key}:{form.output.data}:r{PDF_RENDERER_VERSION}",
+                requeue_finished=True
+            )
+            return redirect(url_for('view_job', job_uuid=job.uuid))
+    
+    return render_template('print_roster.html', template=template, form=form)
+
+@app.route('/test-template/<template_uuid>/roster/<key>.<output>')
+def download_roster(template_uuid, key, output):
+    """Download the named tests printed from a roster."""
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
+    if not is_template_unlocked(template):
+        return redirect(url_for('unlock_template', template_uuid=template.uuid, next=request.full_path))
+    if output not in ('zip', 'pdf') or not re.fullmatch(r'[0-9a-f]{16}', key):
+        abort(404)
+    
+    path = artifact_cache.path(f"roster-{output}", f"{template.uuid}-{key}", PDF_RENDERER_VERSION)
+    if not os.path.exists(path):
+        flash('These tests are no longer available. Please upload the roster again.', 'error')
+        return redirect(url_for('print_roster', template_uuid=template.uuid))
     
-    # Send the PDF as a downloadable file
-    pdf_buffer.seek(0)
     return send_file(
-        pdf_buffer,
-        mimetype='application/pdf',
+        path,
+        mimetype='application/zip' if output == 'zip' else 'application/pdf',
         as_attachment=True,
-        download_name=f"{template.title.replace(' ', '_')}_all_versions.pdf"
+        download_name=f"{template.title.replace(' ', '_')}_roster.{output}"
     )
 
 @app.route('/test-version/<test_uuid>')
 def view_test_version(test_uuid):
     """View a specific test version."""
-    test_version = TestVersion.query.filter_by(uuid=test_uuid).first_or_404()
+    etag = immutable_etag('page', test_uuid, renderer_version=PAGE_RENDERER_VERSION)
+    cached = not_modified(etag, revalidate=True)
+    if cached is not None:
+        return cached
+    
+    # A page that shows flashed messages belongs to one session only
+    shared = '_flashes' not in session
+    
+    test_version = TestVersion.query.options(
+        joinedload(TestVersion.template)
+    ).filter_by(uuid=test_uuid).first_or_404()
     template = test_version.template
     
-    # Get questions ordered by their order field
-    questions = Question.query.filter_by(
-        test_version_id=test_version.id
-    ).order_by(Question.order).all()
+    def render_question_list():
+        questions = Question.query.options(selectinload(Question.choices)).filter_by(
+            test_version_id=test_version.id
+        ).order_by(Question.order).all()
+        return render_template('fragments/question_list.html', questions=questions)
     
-    # Generate QR code for the answer key
-    answer_key_url = url_for('answer_key', test_uuid=test_version.uuid, _external=True)
-    qr_code_img = generate_qr_code(answer_key_url)
+    question_list = fragment_cache.get_or_render(
+        'question-list', test_version.uuid, PAGE_RENDERER_VERSION, render_question_list
+    )
+    qr_block = fragment_cache.get_or_render(
+        'qr-block', test_version.uuid, PAGE_RENDERER_VERSION,
+        lambda: render_template('fragments/qr_block.html', test_version=test_version)
+    )
     
-    return render_template(
+    response = make_response(render_template(
         'view_test_version.html', 
         test_version=test_version, 
         template=template,
-        questions=questions,
-        qr_code=qr_code_img,
+        question_list=question_list,
+        qr_block=qr_block,
         access_code=test_version.get_access_code()
-    )
+    ))
+    return cache_immutable(response, etag, revalidate=True) if shared else response
+
+@app.route('/qr/<test_uuid>.svg')
+def qr_code_svg(test_uuid):
+    """Serve the answer key QR code of a test version as a cacheable SVG."""
+    etag = immutable_etag('qr', test_uuid)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    test_version = TestVersion.query.options(
+        selectinload(TestVersion.qr_code)
+    ).filter_by(uuid=test_uuid).first_or_404()
+    
+    answer_key_url = url_for('answer_key', test_uuid=test_version.uuid, _external=True)
+    svg = render_qr_svg(test_version.get_qr_matrix(answer_key_url))
+    
+    return cache_immutable(Response(svg, mimetype='image/svg+xml'), etag)
 
 @app.route('/test-version/<test_uuid>/pdf')
 def download_test_version_pdf(test_uuid):
     """Generate and download a PDF of a specific test version."""
-    test_version = TestVersion.query.filter_by(uuid=test_uuid).first_or_404()
+    from utils.pdf_generator import generate_test_pdf, render_version_pdf  # ReportLab loads on first use
     
-    # Get questions ordered by their order field
-    questions = Question.query.filter_by(
-        test_version_id=test_version.id
-    ).order_by(Question.order).all()
+    copies, duplex = get_print_options()
+    answer_sheet = request.args.get('sheet') == '1'
+    kind = 'test-sheet' if answer_sheet else 'test'
+    etag = immutable_etag(kind, test_uuid, f"x{copies}-duplex" if duplex else f"x{copies}")
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    test_version = TestVersion.query.filter_by(uuid=test_uuid).first_or_404()
     
     # Create QR code for answer key
     answer_key_url = url_for('answer_key', test_uuid=test_version.uuid, _external=True)
     
-    # Generate PDF
-    pdf_buffer = generate_test_pdf(
-        test_version, 
-        questions, 
-        answer_key_url,
-        version_number=test_version.version_number
-    )
+    # Generate PDF, reusing the cached single copy when possible
+    if copies == 1 and not duplex:
+        pdf_buffer = io.BytesIO(artifact_cache.get_or_render(
+            artifact_cache.path(kind, test_version.uuid, PDF_RENDERER_VERSION),
+            lambda: admission_gates['render'].run(
+                render_version_pdf, test_version, answer_key_url, answer_sheet=answer_sheet
+            )
+        ))
+    else:
+        # Get questions ordered by their order field
+        questions = Question.query.options(selectinload(Question.choices)).filter_by(
+            test_version_id=test_version.id
+        ).order_by(Question.order).all()
+        pdf_buffer = admission_gates['render'].run(
+            generate_test_pdf,
+            test_version, 
+            questions, 
+            answer_key_url,
+            version_number=test_version.version_number,
+            qr_matrix=test_version.get_qr_matrix(answer_key_url),
+            copies=copies,
+            duplex=duplex,
+            answer_sheet=answer_sheet
+        )
     
     # Send the PDF as a downloadable file
+    copies_suffix = f"_x{copies}" if copies > 1 else ""
     pdf_buffer.seek(0)
-    return send_file(
+    return cache_immutable(send_file(
         pdf_buffer,
         mimetype='application/pdf',
         as_attachment=True,
-        download_name=f"{test_version.template.title.replace(' ', '_')}_v{test_version.version_number}.pdf"
-    )
+        download_name=f"{test_version.template.title.replace(' ', '_')}_v{test_version.version_number}{copies_suffix}.pdf"
+    ), etag)
 
 @app.route('/answer-key/<test_uuid>', methods=['GET', 'POST'])
 def answer_key(test_uuid):
@@ -207,89 +750,316 @@ def answer_key(test_uuid):
     
     form = AnswerKeyAccessForm()
     
-    # Check if user has already been authenticated for this answer key
-    auth_key = f"auth_{test_uuid}"
-    if session.get(auth_key):
+    # One unlock covers the answer keys of every version of the template
+    if is_template_unlocked(template):
         # User is authenticated, show the answer key
-        questions = Question.query.filter_by(
+        etag = immutable_etag('answer-page', test_version.uuid, renderer_version=PAGE_RENDERER_VERSION)
+        cached = not_modified(etag, private=True)
+        if cached is not None:
+            return cached
+        
+        questions = Question.query.options(selectinload(Question.choices)).filter_by(
             test_version_id=test_version.id
         ).order_by(Question.order).all()
         
-        return render_template(
+        response = make_response(render_template(
             'answer_key.html', 
             test_version=test_version, 
             template=template, 
             questions=questions
-        )
+        ))
+        return cache_immutable(response, etag, private=True)
     
     # User needs to authenticate
+    retry_after = 0
     if form.validate_on_submit():
-        if template.check_password(form.password.data):
-            # Store authentication in session
-            session[auth_key] = True
-            
-            # Show the answer key
-            questions = Question.query.filter_by(
-                test_version_id=test_version.id
-            ).order_by(Question.order).all()
-            
-            return render_template(
-                'answer_key.html', 
-                test_version=test_version, 
-                template=template, 
-                questions=questions
-            )
-        else:
-            flash('Incorrect password. Please try again.', 'error')
+        retry_after = check_unlock_password(template, form)
+        if is_template_unlocked(template):
+            return redirect(url_for('answer_key', test_uuid=test_version.uuid))
     
     # Show password entry form
-    return render_template(
+    response = make_response(render_template(
         'answer_key_auth.html', 
         test_version=test_version, 
         template=template, 
         form=form,
         access_code=test_version.get_access_code()
-    )
+    ))
+    return throttled(response, retry_after)
 
 @app.route('/answer-key/<test_uuid>/pdf')
 def download_answer_key_pdf(test_uuid):
     """Generate and download a PDF of the answer key."""
+    from utils.pdf_generator import render_version_pdf  # ReportLab loads on first use
+    
     test_version = TestVersion.query.filter_by(uuid=test_uuid).first_or_404()
     template = test_version.template
     
     # Check if user has already been authenticated for this answer key
-    auth_key = f"auth_{test_uuid}"
-    if not session.get(auth_key):
+    if not is_template_unlocked(template):
         flash('Please authenticate to access the answer key.', 'error')
         return redirect(url_for('answer_key', test_uuid=test_uuid))
     
-    # Get questions ordered by their order field
-    questions = Question.query.filter_by(
-        test_version_id=test_version.id
-    ).order_by(Question.order).all()
+    etag = immutable_etag('answers', test_version.uuid)
+    cached = not_modified(etag, private=True)
+    if cached is not None:
+        return cached
     
-    # Generate PDF with answers
-    pdf_buffer = generate_test_pdf(
-        test_version, 
-        questions, 
-        version_number=test_version.version_number,
-        include_answers=True
-    )
+    # Generate PDF with answers, reusing the cached copy when available
+    pdf_buffer = io.BytesIO(artifact_cache.get_or_render(
+        artifact_cache.path('answers', test_version.uuid, PDF_RENDERER_VERSION),
+        lambda: admission_gates['render'].run(render_version_pdf, test_version, include_answers=True)
+    ))
     
     # Send the PDF as a downloadable file
     pdf_buffer.seek(0)
-    return send_file(
+    return cache_immutable(send_file(
         pdf_buffer,
         mimetype='application/pdf',
         as_attachment=True,
         download_name=f"{template.title.replace(' ', '_')}_v{test_version.version_number}_answers.pdf"
+    ), etag, private=True)
+
+@app.route('/test-version/<test_uuid>/submit', methods=['GET', 'POST'])
+def submit_test_answers(test_uuid):
+    """Let a student answer a test version online."""
+    test_version = TestVersion.query.options(
+        joinedload(TestVersion.template)
+    ).filter_by(uuid=test_uuid).first_or_404()
+    questions = Question.query.options(selectinload(Question.choices)).filter_by(
+        test_version_id=test_version.id
+    ).order_by(Question.order).all()
+    
+    form = SubmissionForm()
+    answers = {
+        question.order: request.form.get(f"answer-{question.order}", '')
+        for question in questions
+    }
+    if form.validate_on_submit():
+        status, error = submit_answers(
+            test_version.uuid, form.submission_key.data, form.student_name.data, answers
+        )
+        if error is None:
+            return redirect(url_for('view_submission', key=form.submission_key.data))
+        flash(error, 'error')
+    
+    return render_template(
+        'submit_answers.html',
+        test_version=test_version,
+        template=test_version.template,
+        questions=questions,
+        answers=answers,
+        form=form
     )
 
+@app.route('/api/test-versions/<test_uuid>/submissions', methods=['POST'])
+def api_submit_answers(test_uuid):
+    """
+    Submit a student's answers to a test version.
+    
+    The body has key (an idempotency key chosen by the client),
+    student_name and answers (question number to answer). Submissions are
+    written in batches shortly after the 202 response; resending the same
+    key is harmless.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('answers'), dict):
+        return jsonify({'error': 'Expected a JSON object with key, student_name and answers'}), 400
+    try:
+        answers = {int(order): answer for order, answer in data['answers'].items()}
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Answers must be keyed by question number'}), 400
+    
+    status, error = submit_answers(test_uuid, data.get('key'), data.get('student_name'), answers)
+    if error is not None:
+        return jsonify({'error': error}), 404 if error == 'Test version not found' else 400
+    return jsonify({
+        'status': status,
+        'key': data['key'],
+        'receipt_url': url_for('view_submission', key=data['key'], _external=True),
+    }), 202
+
+@app.route('/submissions/<key>')
+def view_submission(key):
+    """Show the receipt of a submission."""
+    submission = find_submission(key)
+    if submission is None:
+        abort(404)
+    return render_template('submission_receipt.html', submission=submission, key=key)
+
+@app.route('/test-template/<template_uuid>/results')
+def view_template_results(template_uuid):
+    """Show the results of the submissions to a template: by version, question and topic."""
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
+    if not is_template_unlocked(template):
+        return redirect(url_for('unlock_template', template_uuid=template.uuid, next=request.full_path))
+    
+    # Served from the running totals kept as submissions are written
+    return render_template('template_results.html', template=template, results=template_results(template))
+
+@app.route('/api/test-templates/<template_uuid>/grades')
+def api_template_grades(template_uuid):
+    """
+    Grade every stored submission to the versions of a test template.
+    
+    Requires the template's answer keys to be unlocked in this session.
+    Answers are graded for equivalence rather than string equality, so
+    0.75 and 6/8 are both correct for 3/4.
+    """
+    template = TestTemplate.query.filter_by(uuid=template_uuid, status='ready').first_or_404()
+    if not is_template_unlocked(template):
+        return jsonify({'error': 'Unlock the answer keys of this test first'}), 403
+    
+    report = grade_template(template)
+    for result in report:
+        result['submitted_at'] = result['submitted_at'].isoformat()
+    return jsonify({'submissions': len(report), 'results': report})
+
+@app.route('/jobs/<job_uuid>')
+def view_job(job_uuid):
+    """Show the progress of a background job."""
+    job = Job.query.filter_by(uuid=job_uuid).first_or_404()
+    
+    if job.status == 'done' and job.get_result().get('redirect_url'):
+        return redirect(job.get_result()['redirect_url'])
+    
+    return render_template('job_status.html', job=job)
+
+@app.route('/jobs/<job_uuid>/events')
+def job_events(job_uuid):
+    """Stream the progress of a background job as server-sent events."""
+    job_id = Job.query.filter_by(uuid=job_uuid).first_or_404().id
+    
+    def generate():
+        last_state = None
+        deadline = time.monotonic() + app.config['JOB_EVENTS_TIMEOUT']
+        # Streams are short; tell the browser to reconnect soon after one ends
+        yield f"retry: {app.config['JOB_EVENTS_RETRY_MS']}\n\n"
+        while True:
+            job = db.session.get(Job, job_id, populate_existing=True)
+            state = job.to_dict()
+            # End the read transaction so the next poll sees the worker's updates
+            db.session.rollback()
+            
+            if state != last_state:
+                yield f"data: {json.dumps(state)}\n\n"
+                last_state = state
+            
+            # The browser reconnects by itself when a job outlives the stream
+            if state['status'] in ('done', 'failed') or time.monotonic() > deadline:
+                return
+            time.sleep(app.config['JOB_EVENTS_INTERVAL'])
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/metrics')
+def metrics():
+    """Expose request, database, generation and rendering metrics for Prometheus (operators only)."""
+    if not app.config['METRICS_ENABLED'] or not is_operator():
+        abort(404)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/_ops/profiles')
+def list_request_profiles():
+    """List the most recent request profiles (operators only)."""
+    if not is_operator():
+        abort(404)
+    
+    return render_template(
+        'ops_profiles.html',
+        profiles=list_profiles(app.config['PROFILE_DIR']),
+        tracing=tracemalloc.is_tracing()
+    )
+
+@app.route('/_ops/profiles/<name>')
+def view_request_profile(name):
+    """Show one request profile as text, or download the raw stats (operators only)."""
+    if not is_operator() or not re.fullmatch(r'\d+-[0-9a-f]{8}', name):
+        abort(404)
+    
+    directory = app.config['PROFILE_DIR']
+    path = os.path.join(directory, f"{name}.prof")
+    if not os.path.exists(path):
+        path = os.path.join(directory, f"{name}.folded")
+        if not os.path.exists(path):
+            abort(404)
+    
+    if request.args.get('download') or path.endswith('.folded'):
+        return send_file(path, as_attachment=bool(request.args.get('download')), mimetype='text/plain')
+    
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'ncalls'):
+        sort = 'cumulative'
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).strip_dirs().sort_stats(sort).print_stats(request.args.get('limit', 60, type=int))
+    return Response(output.getvalue(), mimetype='text/plain')
+
+@app.route('/_ops/memory')
+def memory_snapshot():
+    """
+    Show the top allocation sites of this worker process (operators only).
+    
+    Tracing slows allocations down, so it only runs between ?action=start
+    and ?action=stop. Each snapshot is compared with the previous one.
+    """
+    global _last_memory_snapshot
+    if not is_operator():
+        abort(404)
+    
+    action = request.args.get('action')
+    if action == 'start' and not tracemalloc.is_tracing():
+        tracemalloc.start(request.args.get('frames', 10, type=int))
+        _last_memory_snapshot = None
+    elif action == 'stop' and tracemalloc.is_tracing():
+        tracemalloc.stop()
+        _last_memory_snapshot = None
+    
+    if not tracemalloc.is_tracing():
+        return Response(
+            f"tracemalloc is not running in worker {os.getpid()}; start it with ?action=start\n",
+            mimetype='text/plain'
+        )
+    
+    group = request.args.get('group', 'lineno')
+    if group not in ('lineno', 'filename', 'traceback'):
+        group = 'lineno'
+    limit = request.args.get('limit', 30, type=int)
+    
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"Worker {os.getpid()}: {current / 1e6:.1f} MB traced, peak {peak / 1e6:.1f} MB", "", "Top allocation sites:"]
+    for stat in snapshot.statistics(group)[:limit]:
+        lines.append(str(stat))
+        if group == 'traceback':
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+    
+    if _last_memory_snapshot is not None:
+        lines += ["", "Changes since the previous snapshot:"]
+        lines += [str(stat) for stat in snapshot.compare_to(_last_memory_snapshot, 'lineno')[:limit]]
+    _last_memory_snapshot = snapshot
+    
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Handle 404 errors."""
     return render_template('error.html', error_code=404, message='Page not found'), 404
 
+@app.errorhandler(503)
+def service_unavailable(e):
+    """Handle 503 errors from admission control, keeping the Retry-After header."""
+    headers = [(name, value) for name, value in e.get_headers() if name == 'Retry-After']
+    if request.path.startswith('/api/'):
+        return jsonify({'error': e.description}), 503, headers
+    return render_template('error.html', error_code=503, message='Server busy, please try again shortly'), 503, headers
+
 @app.errorhandler(500)
 def server_error(e):
     """Handle 500 errors."""
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import app, db
+from models import TestVersion, QuestionChoices
+from grading import get_answer_forms
+from submissions import get_version_questions, write_submissions
+from utils.answer_equivalence import grade
+from utils.multiple_choice import grid_letter
+
+# Scanned page images read by grade-scans
+SCAN_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+def find_scans(folder):
+    """Return the scanned page images in a folder, in file name order (the order they were scanned)."""
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(SCAN_EXTENSIONS)
+    )
+
+def collate_sheets(readings):
+    """
+    Group the readings of scanned pages into answer sheets.
+
+    Pages are in scan order; a sheet starts at a first page, or wherever
+    the version code or page sequence breaks. Pages that could not be read
+    are kept as sheets of their own, so they are reported.
+
+    Args:
+        readings (list): Results of utils.bubble_sheet.read_scan
+
+    Returns:
+        list: Lists of readings, one per sheet
+    """
+    sheets = []
+    for reading in readings:
+        current = sheets[-1] if sheets else None
+        if (
+            reading['error'] is None and current is not None and reading['page'] > 0
+            and current[-1]['error'] is None
+            and current[-1]['access_code'] == reading['access_code']
+            and current[-1]['page'] == reading['page'] - 1
+        ):
+            current.append(reading)
+        else:
+            sheets.append([reading])
+    return sheets
+
+def versions_by_access_code():
+    """
+    Return TestVersion IDs and UUIDs by access code.
+
+    Access codes are hashes of the version (see TestVersion.get_access_code),
+    so they are computed for every version once per grading run.
+    """
+    return {
+        TestVersion(uuid=version_uuid, test_template_id=template_id, version_number=version_number).get_access_code():
+            (version_id, version_uuid)
+        for version_id, version_uuid, template_id, version_number in db.session.execute(
+            select(TestVersion.id, TestVersion.uuid, TestVersion.test_template_id, TestVersion.version_number)
+        )
+    }
+
+def grade_scans(readings, store=True):
+    """
+    Grade the readings of a stack of scanned answer sheets.
+
+    Each sheet is looked up by its version code and graded against the
+    version's stored answers with the same equivalence rules as online
+    submissions. Stored sheets become submissions keyed by a hash of their
+    first page, so scanning a stack twice stores it once, and they count in
+    the results dashboard. Sheets carry no name, so the student is named
+    after the first page's file. Multiple-choice answers are gridded as the
+    number of the choice and read back as its letter.
+
+    Args:
+        readings (list): Results of utils.bubble_sheet.read_scan, in scan order
+        store (bool): Whether to store the graded sheets as submissions
+
+    Returns:
+        list: One dict per sheet with paths, student_name, access_code,
+            version_uuid, answers (question number to text), score, total,
+            correct (question number to bool), ambiguous and error
+    """
+    versions = versions_by_access_code()
+    sheets = []
+    records = []
+    for pages in collate_sheets(readings):
+        first = pages[0]
+        sheet = {
+            'paths': [page['path'] for page in pages],
+            'student_name': os.path.splitext(os.path.basename(first['path']))[0][:100],
+            'access_code': first['access_code'],
+            'version_uuid': None,
+            'answers': {},
+            'score': 0,
+            'total': 0,
+            'correct': {},
+            'ambiguous': sorted(number for page in pages for number in page['ambiguous']),
+            'error': first['error'],
+        }
+        sheets.append(sheet)
+        if sheet['error'] is not None:
+            continue
+        if first['access_code'] not in versions:
+            sheet['error'] = f"unknown version code {first['access_code']}"
+            continue
+        if first['page'] != 0:
+            sheet['error'] = f"starts at page {first['page'] + 1}"
+
+        version_id, sheet['version_uuid'] = versions[first['access_code']]
+        _, question_ids = get_version_questions(sheet['version_uuid'])
+        multiple_choice = set(db.session.scalars(
+            select(QuestionChoices.question_id).where(QuestionChoices.question_id.in_(question_ids.values()))
+        ))
+        for page in pages:
+            sheet['answers'].update(
+                (number, answer) for number, answer in page['answers'].items() if number in question_ids
+            )
+        for number, answer in sheet['answers'].items():
+            if question_ids[number] in multiple_choice:
+                sheet['answers'][number] = grid_letter(answer) or answer
+
+        forms = get_answer_forms(question_ids.values())
+        expected = {number: forms[question_id] for number, question_id in question_ids.items()}
+        sheet['correct'] = grade(expected, [sheet['answers']])[0]
+        sheet['score'] = sum(sheet['correct'].values())
+        sheet['total'] = len(expected)
+
+        with open(first['path'], 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        records.append({
+            'uuid': str(uuid.uuid4()),
+            'key': f"scan-{digest[:40]}",
+            'test_version_id': version_id,
+            'student_name': sheet['student_name'],
+            'submitted_at': datetime.utcnow(),
+            'answers': [(question_ids[number], answer) for number, answer in sorted(sheet['answers'].items())],
+        })
+
+    if store:
+        batch_size = app.config['SUBMISSION_BATCH_SIZE']
+        for start in range(0, len(records), batch_size):
+            write_submissions(records[start:start + batch_size])
+    return sheets
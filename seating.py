@@ -0,0 +1,295 @@
+import csv
+import io
+import os
+import re
+import zipfile
+from collections import defaultdict
+from itertools import combinations
+
+from flask import url_for
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app import artifact_cache, db
+from models import TestVersion, Question
+from utils.pdf_stamp import stamp_header
+from utils.pdf_version import PDF_RENDERER_VERSION
+from utils.seating import assign_versions, chart, parse_adjacency, parse_grid, parse_roster, seat_students
+
+def version_overlap(template):
+    """
+    Count the questions each pair of versions of a test has in common.
+
+    Questions are the same when their text and answer are; small tests
+    drawn from few question types can repeat a question across versions.
+
+    Returns:
+        tuple: (versions in version order, versions x versions list of counts)
+    """
+    versions = TestVersion.query.filter_by(test_template_id=template.id).order_by(TestVersion.version_number).all()
+    index = {version.id: i for i, version in enumerate(versions)}
+    holders = defaultdict(set)
+    for version_id, question_text, answer in db.session.execute(
+        select(Question.test_version_id, Question.question_text, Question.answer)
+        .where(Question.test_version_id.in_(index))
+    ):
+        holders[question_text, answer].add(index[version_id])
+
+    overlap = [[0] * len(versions) for _ in versions]
+    for holding in holders.values():
+        for first, second in combinations(sorted(holding), 2):
+            overlap[first][second] += 1
+            overlap[second][first] += 1
+    return versions, overlap
+
+def plan_seating(template, room, roster=None, diagonal=True):
+    """
+    Seat a class and hand out the versions of a test.
+
+    Args:
+        template (TestTemplate): The test
+        room (str): The room, drawn as text or as a JSON adjacency list (see
+            utils.seating)
+        roster (str, optional): The class roster (see utils.seating.parse_roster)
+        diagonal (bool): Whether diagonally adjacent seats of a drawn room
+            are neighbours
+
+    Returns:
+        dict: seats (list of dicts with seat, student, version_number,
+            version_uuid and access_code, in seat order), clashes and
+            shared (neighbouring seat pairs with the same version, or with
+            versions that share questions) and chart (the drawn room with
+            version numbers, or None for adjacency lists)
+
+    Raises:
+        ValueError: If the room or roster cannot be read or do not fit
+    """
+    if room.lstrip().startswith('{'):
+        seats, neighbours, positions = parse_adjacency(room)
+    else:
+        seats, neighbours, positions = parse_grid(room, diagonal)
+    if not seats:
+        raise ValueError("The room has no seats")
+    students = seat_students(seats, parse_roster(roster)) if roster else {}
+
+    versions, overlap = version_overlap(template)
+    assigned, clashes, shared = assign_versions(seats, neighbours, len(versions), overlap)
+    access_codes = [version.get_access_code() for version in versions]
+    return {
+        'seats': [
+            {
+                'seat': seat,
+                'student': students.get(seat),
+                'version_number': versions[assigned[seat]].version_number,
+                'version_uuid': versions[assigned[seat]].uuid,
+                'access_code': access_codes[assigned[seat]],
+            }
+            for seat in seats
+        ],
+        'clashes': clashes,
+        'shared': shared,
+        'chart': chart(positions, {seat: versions[assigned[seat]].version_number for seat in seats})
+        if positions is not None else None,
+    }
+
+def seating_csv(plan):
+    """Return a seating plan as CSV: seat, student, version, version UUID and access code."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['seat', 'student', 'version', 'version_uuid', 'access_code'])
+    for row in plan['seats']:
+        writer.writerow([row['seat'], row['student'] or '', row['version_number'], row['version_uuid'], row['access_code']])
+    return output.getvalue()
+
+def plan_roster(template, roster, room=None, diagonal=True):
+    """
+    Hand out the versions of a test to the students on a roster.
+
+    With a room, students are seated and get versions by seat (see
+    plan_seating); without one, the versions are handed out in turn in
+    roster order.
+
+    Returns:
+        dict: A seating plan (see plan_seating) listing only the students;
+            seats are None without a room
+
+    Raises:
+        ValueError: If the room or roster cannot be read or do not fit
+    """
+    if room:
+        plan = plan_seating(template, room, roster, diagonal)
+        plan['seats'] = [row for row in plan['seats'] if row['student'] is not None]
+        return plan
+
+    students = parse_roster(roster)
+    if not students:
+        raise ValueError("The roster has no students")
+    versions = TestVersion.query.filter_by(test_template_id=template.id).order_by(TestVersion.version_number).all()
+    access_codes = [version.get_access_code() for version in versions]
+    return {
+        'seats': [
+            {
+                'seat': None,
+                'student': name,
+                'version_number': versions[i % len(versions)].version_number,
+                'version_uuid': versions[i % len(versions)].uuid,
+                'access_code': access_codes[i % len(versions)],
+            }
+            for i, (name, _) in enumerate(students)
+        ],
+        'clashes': [],
+        'shared': [],
+        'chart': None,
+    }
+
+def header_text(row):
+    """Return the header printed on a student's test."""
+    return f"Name: {row['student']}" + (f"    Seat: {row['seat']}" if row['seat'] else '')
+
+def student_file_name(seat, student):
+    """Return the file name of a student's test: seat (or roster number) and name, safe for any file system."""
+    name = re.sub(r'[^A-Za-z0-9]+', '-', student).strip('-')[:60]
+    return f"{seat}-{name}.pdf" if name else f"{seat}.pdf"
+
+def render_header_pdfs(template, version_uuids, pool=None, progress=None):
+    """
+    Render the versions handed out, each with a student header placeholder.
+
+    Rendered PDFs are kept in the artifact cache, and those missing are
+    rendered on the pool when given. Must run inside a request context, for
+    the answer key URLs.
+
+    Args:
+        template (TestTemplate): The test
+        version_uuids (iterable): UUIDs of the versions to render
+        pool (concurrent.futures.Executor, optional): Pool to render on
+        progress (callable, optional): Called as progress(done) after each version
+
+    Returns:
+        dict: Version UUID to PDF bytes
+    """
+    from utils.pdf_generator import render_version_pdf, version_data  # ReportLab loads on first use
+
+    version_uuids = set(version_uuids)
+    versions = TestVersion.query.options(
+        joinedload(TestVersion.template),
+        selectinload(TestVersion.questions).selectinload(Question.choices),
+        selectinload(TestVersion.qr_code)
+    ).filter(TestVersion.test_template_id == template.id, TestVersion.uuid.in_(list(version_uuids))).all()
+
+    rendered = {}
+    pending = {}
+    for version in versions:
+        path = artifact_cache.path('test-header', version.uuid, PDF_RENDERER_VERSION)
+        data = artifact_cache.get(path)
+        if data is not None:
+            rendered[version.uuid] = data
+            continue
+        url = url_for('answer_key', test_uuid=version.uuid, _external=True)
+        if pool is not None:
+            pending[version.uuid] = (path, pool.submit(render_version_pdf, version_data(version, url), url, student_header=True).result)
+        else:
+            pending[version.uuid] = (path, lambda version=version, url=url: render_version_pdf(version, url, student_header=True))
+
+    if progress is not None:
+        progress(len(rendered))
+    for version_uuid, (path, result) in pending.items():
+        rendered[version_uuid] = result()
+        artifact_cache.put(path, rendered[version_uuid])
+        if progress is not None:
+            progress(len(rendered))
+    return rendered
+
+def write_student_pdfs(plan, folder, rendered):
+    """
+    Write one test PDF per seated student, with their name and seat stamped on it.
+
+    Args:
+        plan (dict): Seating plan from plan_seating or plan_roster
+        folder (str): Folder the PDFs are written to
+        rendered (dict): Version UUID to PDF bytes, from render_header_pdfs
+
+    Returns:
+        int: PDFs written
+    """
+    os.makedirs(folder, exist_ok=True)
+    written = 0
+    for number, row in enumerate(plan['seats'], start=1):
+        if row['student'] is None:
+            continue
+        name = student_file_name(row['seat'] or f"{number:04d}", row['student'])
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(stamp_header(rendered[row['version_uuid']], header_text(row)))
+        written += 1
+    return written
+
+def write_roster_zip(plan, rendered, output, progress=None):
+    """
+    Write a ZIP of one stamped test PDF per student, plus the seating plan as CSV.
+
+    Entries are stored uncompressed (the PDFs are compressed already) and
+    written one at a time, so the archive is never held in memory.
+
+    Args:
+        plan (dict): Seating plan from plan_roster
+        rendered (dict): Version UUID to PDF bytes, from render_header_pdfs
+        output: Binary file object the ZIP is written to
+        progress (callable, optional): Called as progress(done) after each student
+    """
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr('seating.csv', seating_csv(plan))
+        for number, row in enumerate(plan['seats'], start=1):
+            name = student_file_name(row['seat'] or f"{number:04d}", row['student'])
+            archive.writestr(f"students/{name}", stamp_header(rendered[row['version_uuid']], header_text(row)))
+            if progress is not None:
+                progress(number)
+
+def write_roster_pdf(template, plan, output, duplex=False, progress=None):
+    """
+    Write a single print file with every student's test, in roster (or seat) order.
+
+    Each version is laid out once; see utils.pdf_generator.generate_roster_pdf.
+    Must run inside a request context, for the answer key URLs.
+    """
+    from utils.pdf_generator import generate_roster_pdf  # ReportLab loads on first use
+
+    version_uuids = list(dict.fromkeys(row['version_uuid'] for row in plan['seats']))
+    index = {version_uuid: i for i, version_uuid in enumerate(version_uuids)}
+    versions = {
+        version.uuid: version
+        for version in TestVersion.query.options(
+            joinedload(TestVersion.template),
+            selectinload(TestVersion.questions).selectinload(Question.choices),
+            selectinload(TestVersion.qr_code)
+        ).filter(TestVersion.test_template_id == template.id, TestVersion.uuid.in_(version_uuids))
+    }
+    buffer = generate_roster_pdf(
+        [versions[version_uuid] for version_uuid in version_uuids],
+        [(index[row['version_uuid']], header_text(row)) for row in plan['seats']],
+        [url_for('answer_key', test_uuid=version_uuid, _external=True) for version_uuid in version_uuids],
+        duplex=duplex,
+        progress=progress
+    )
+    output.write(buffer.getbuffer())
+
+def write_roster(template, plan, output, as_zip, duplex=False, pool=None, progress=None):
+    """
+    Write every student's test: a ZIP of one PDF per student, or a single print file.
+
+    Must run inside a request context, for the answer key URLs.
+
+    Args:
+        template (TestTemplate): The test
+        plan (dict): Seating plan from plan_roster
+        output: Binary file object written to
+        as_zip (bool): Write a ZIP rather than a print file
+        duplex (bool): Pad each test of a print file to an even page count
+        pool (concurrent.futures.Executor, optional): Pool the versions of a
+            ZIP are rendered on
+        progress (callable, optional): Called as progress(done) after each student
+    """
+    if as_zip:
+        rendered = render_header_pdfs(template, {row['version_uuid'] for row in plan['seats']}, pool=pool)
+        write_roster_zip(plan, rendered, output, progress=progress)
+    else:
+        write_roster_pdf(template, plan, output, duplex=duplex, progress=progress)
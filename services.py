@@ -0,0 +1,494 @@
+import math
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask import url_for
+from sqlalchemy import case, delete, insert, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import app, db
+from forms import TestTemplateForm
+from models import TestTemplate, TestVersion, QuestionTemplate, Question, QuestionChoices, VersionQRCode, UnlockThrottle
+from utils.metrics import TESTS_CREATED, VERSIONS_CREATED, QUESTIONS_CREATED
+from utils.qr_generator import encode_qr_matrix
+from utils.math_generator import generate_question_templates, generate_test_versions
+
+def test_spec_from_form(form):
+    """Build a test specification from a validated TestTemplateForm."""
+    return {
+        'title': form.title.data,
+        'description': form.description.data,
+        'difficulty': form.difficulty.data,
+        'topics': form.topics.data or [],
+        'num_questions': form.num_questions.data,
+        'num_versions': form.num_versions.data or 1,
+        'multiple_choice': form.answer_format.data == 'multiple_choice',
+        'password_hash': generate_password_hash(form.password.data),
+    }
+
+def test_spec_from_data(data, password_hash):
+    """Build a test specification from validated API or manifest data."""
+    return {
+        'title': data['title'],
+        'description': data.get('description'),
+        'difficulty': data['difficulty'],
+        'topics': data['topics'],
+        'num_questions': data['num_questions'],
+        'num_versions': data.get('num_versions') or 1,
+        'multiple_choice': data.get('answer_format') == 'multiple_choice',
+        'password_hash': password_hash,
+    }
+
+def create_test_template(spec, progress=None):
+    """
+    Create a test template with all of its versions and questions.
+
+    Must run inside a request context (real or test) so that the answer key
+    URLs encoded in the QR codes can be built.
+
+    Args:
+        spec (dict): Test specification with title, description, difficulty,
+            topics (list), num_questions, num_versions, multiple_choice,
+            password_hash and optionally a preassigned template uuid
+        progress (callable, optional): Called as progress(done, total) after
+            each version is generated
+
+    The template is saved as 'building' and becomes 'ready' with the final
+    commit, so one whose progress updates have committed it part-way is
+    never shown.
+
+    Returns:
+        TestTemplate: The saved test template
+    """
+    # Create a new test template
+    test_template = TestTemplate(status='building')
+    if spec.get('uuid'):
+        test_template.uuid = spec['uuid']
+    test_template.title = spec['title']
+    test_template.description = spec.get('description')
+    test_template.difficulty = spec['difficulty']
+    test_template.topics = ','.join(spec['topics'])
+    test_template.num_questions = spec['num_questions']
+    test_template.num_versions = spec['num_versions']
+    test_template.password_hash = spec['password_hash']
+
+    # Save the test template
+    db.session.add(test_template)
+    db.session.flush()  # Flush to get template ID
+
+    # Generate question templates
+    question_template_data = generate_question_templates(
+        topics=spec['topics'],
+        difficulty=spec['difficulty'],
+        num_questions=spec['num_questions']
+    )
+
+    # Create question templates
+    question_templates = []
+    for topic, difficulty, order in question_template_data:
+        question_template = QuestionTemplate()
+        question_template.test_template_id = test_template.id
+        question_template.question_type = topic
+        question_template.difficulty = difficulty
+        question_template.order = order
+        db.session.add(question_template)
+        question_templates.append(question_template)
+    db.session.flush()  # Flush to get question template IDs
+
+    # Generate the questions of every version, keeping the versions comparable in difficulty
+    num_versions = spec['num_versions']
+    versions_data = generate_test_versions(
+        question_templates, num_versions,
+        multiple_choice=spec.get('multiple_choice', False),
+        fairness_threshold=app.config['FAIRNESS_THRESHOLD'],
+        progress=progress
+    )
+
+    for version_number, questions_data in enumerate(versions_data, start=1):
+        # Create a version record
+        test_version = TestVersion()
+        test_version.test_template_id = test_template.id
+        test_version.version_number = version_number
+        db.session.add(test_version)
+        db.session.flush()  # Flush to get version ID
+
+        # Precompute the answer key QR code once for the lifetime of the version
+        answer_key_url = url_for('answer_key', test_uuid=test_version.uuid, _external=True)
+        test_version.qr_code = VersionQRCode(
+            payload=answer_key_url,
+            matrix=encode_qr_matrix(answer_key_url)
+        )
+
+        # Add questions to the database
+        for q_data in questions_data:
+            question = Question()
+            question.test_version_id = test_version.id
+            question.question_template_id = q_data['question_template_id']
+            question.question_text = q_data['question_text']
+            question.answer = q_data['answer']
+            question.solution_steps = q_data['solution_steps']
+            question.order = q_data['order']
+            if 'choices' in q_data:
+                question.choices = QuestionChoices(
+                    distractors=q_data['choices'],
+                    answer_position=q_data['answer_position']
+                )
+            db.session.add(question)
+
+    # Final commit for all versions and questions
+    test_template.status = 'ready'
+    db.session.commit()
+
+    TESTS_CREATED.inc()
+    VERSIONS_CREATED.inc(num_versions)
+    QUESTIONS_CREATED.inc(num_versions * len(question_templates))
+
+    return test_template
+
+def validate_test_spec(data):
+    """
+    Validate a test specification submitted to the JSON API.
+
+    Applies the same rules as the create test form.
+
+    Args:
+        data: Decoded JSON object with title, description, topics,
+            difficulty, num_questions, num_versions and password
+
+    Returns:
+        dict: Field name to list of error messages (empty when valid)
+    """
+    if not isinstance(data, dict):
+        return {'spec': ['Must be an object']}
+
+    errors = {}
+    for name in ('title', 'description', 'difficulty', 'answer_format', 'password'):
+        if data.get(name) is not None and not isinstance(data[name], str):
+            errors[name] = ['Must be a string']
+    for name in ('num_questions', 'num_versions'):
+        value = data.get(name)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            errors[name] = ['Must be an integer']
+    topics = data.get('topics')
+    if not isinstance(topics, list) or not all(isinstance(topic, str) for topic in topics):
+        errors['topics'] = ['Must be a list of topic names']
+    if errors:
+        return errors
+
+    form = TestTemplateForm(
+        formdata=None,
+        data={
+            'title': data.get('title'),
+            'description': data.get('description') or '',
+            'answer_format': data.get('answer_format') or 'free_response',
+            'difficulty': data.get('difficulty'),
+            'topics': topics,
+            'num_questions': data.get('num_questions'),
+            'num_versions': data.get('num_versions', 1),
+            'password': data.get('password'),
+            'confirm_password': data.get('password'),
+        },
+        meta={'csrf': False}
+    )
+    form.validate()
+    return form.errors
+
+def hash_passwords(passwords):
+    """
+    Hash a collection of passwords, each distinct password once.
+
+    Password hashing is deliberately slow and dominates bulk creation, so
+    the distinct passwords are hashed on a thread pool (the hash function
+    releases the GIL).
+
+    Returns:
+        dict: Password to password hash
+    """
+    unique = list(dict.fromkeys(passwords))
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(unique)))) as executor:
+        return dict(zip(unique, executor.map(generate_password_hash, unique)))
+
+# At most this many password hashes run at once in a process. The request
+# still waits for its own check; the hash releases the GIL, so the other
+# threads of the worker keep serving meanwhile.
+_password_checks = threading.BoundedSemaphore(app.config['PASSWORD_CHECK_WORKERS'])
+
+def verify_template_password(template, password):
+    """
+    Check the answer-key password of a test template, throttling failures.
+
+    After UNLOCK_MAX_FAILURES failed attempts within UNLOCK_FAILURE_WINDOW
+    seconds, further attempts are refused for UNLOCK_LOCKOUT seconds
+    without running the password hash at all.
+
+    Returns:
+        tuple: (correct, retry_after) where retry_after is the number of
+            seconds left in a lockout, or 0 when the password was checked
+    """
+    now = datetime.utcnow()
+    throttle = UnlockThrottle.query.filter_by(template_uuid=template.uuid).first()
+    if throttle is not None and throttle.locked_until is not None and throttle.locked_until > now:
+        return False, math.ceil((throttle.locked_until - now).total_seconds())
+    
+    with _password_checks:
+        correct = check_password_hash(template.password_hash, password)
+    
+    if correct:
+        if throttle is not None:
+            db.session.execute(delete(UnlockThrottle).where(UnlockThrottle.template_uuid == template.uuid))
+            db.session.commit()
+        return True, 0
+    
+    record_unlock_failure(template.uuid, now)
+    return False, 0
+
+def record_unlock_failure(template_uuid, now):
+    """
+    Count a failed unlock attempt, and lock the template out on reaching
+    UNLOCK_MAX_FAILURES within the window.
+
+    The count is incremented in the database in one statement, so
+    concurrent failures are all counted.
+
+    Returns:
+        int: Failures counted in the current window, before any lockout resets it
+    """
+    expired = UnlockThrottle.window_started_at < now - timedelta(seconds=app.config['UNLOCK_FAILURE_WINDOW'])
+    while True:
+        failures = db.session.execute(
+            update(UnlockThrottle)
+            .where(UnlockThrottle.template_uuid == template_uuid)
+            .values(
+                failures=case((expired, 1), else_=UnlockThrottle.failures + 1),
+                window_started_at=case((expired, now), else_=UnlockThrottle.window_started_at),
+            )
+            .returning(UnlockThrottle.failures)
+        ).scalar()
+        if failures is not None:
+            break
+        try:
+            db.session.execute(insert(UnlockThrottle).values(
+                template_uuid=template_uuid, failures=1, window_started_at=now
+            ))
+            db.session.commit()
+            failures = 1
+            break
+        except IntegrityError:
+            # A concurrent first failure created the row; count this one on it
+            db.session.rollback()
+    
+    if failures >= app.config['UNLOCK_MAX_FAILURES']:
+        db.session.execute(
+            update(UnlockThrottle)
+            .where(UnlockThrottle.template_uuid == template_uuid)
+            .values(locked_until=now + timedelta(seconds=app.config['UNLOCK_LOCKOUT']), failures=0, window_started_at=now)
+        )
+    db.session.commit()
+    return failures
+
+def generate_version_content(plan, answer_key_urls, multiple_choice=False, fairness_threshold=None):
+    """
+    Generate the questions and answer key QR codes for the versions of a test.
+
+    Takes and returns plain data so it can run in a process pool.
+
+    Args:
+        plan (list): (question template id, question type, difficulty, order)
+            tuples
+        answer_key_urls (list): Answer key URL of each version, in version order
+        multiple_choice (bool): Whether to add choices to each question
+        fairness_threshold (float, optional): See generate_test_versions
+
+    Returns:
+        list: (questions data, packed QR matrix) per version
+    """
+    question_templates = [
+        SimpleNamespace(id=template_id, question_type=question_type, difficulty=difficulty, order=order)
+        for template_id, question_type, difficulty, order in plan
+    ]
+    versions_data = generate_test_versions(
+        question_templates, len(answer_key_urls), multiple_choice, fairness_threshold
+    )
+    return [
+        (questions_data, encode_qr_matrix(url))
+        for questions_data, url in zip(versions_data, answer_key_urls)
+    ]
+
+def _outcome(call):
+    """Run call and return (result, exception)."""
+    try:
+        return call(), None
+    except Exception as e:
+        return None, e
+
+def create_test_templates_bulk(specs, pool=None, chunk_size=None):
+    """
+    Create many test templates, committing them in batches.
+
+    Rows are written with multi-row inserts rather than through the unit of
+    work. Question generation and QR encoding for each test can run on a
+    shared process pool. A test that fails to generate is reported and left
+    out without affecting the rest of its batch.
+
+    Must run inside a request context (real or test) so that the answer key
+    URLs encoded in the QR codes can be built.
+
+    Args:
+        specs (list): Validated test specifications (see create_test_template)
+        pool (concurrent.futures.Executor, optional): Pool for question generation
+        chunk_size (int, optional): Tests per transaction
+
+    Returns:
+        list: One (report, error) tuple per spec, in input order; report is a
+        dict with the template uuid and its versions' uuids and access codes
+    """
+    chunk_size = chunk_size or app.config['BULK_CHUNK_SIZE']
+    fairness_threshold = app.config['FAIRNESS_THRESHOLD']
+    outcomes = []
+
+    for start in range(0, len(specs), chunk_size):
+        chunk = specs[start:start + chunk_size]
+        template_uuids = [spec.get('uuid') or str(uuid.uuid4()) for spec in chunk]
+        question_plans = [
+            generate_question_templates(spec['topics'], spec['difficulty'], spec['num_questions'])
+            for spec in chunk
+        ]
+
+        # Templates and question templates first, to get the IDs that seed generation
+        try:
+            template_ids = db.session.scalars(
+                insert(TestTemplate).returning(TestTemplate.id, sort_by_parameter_order=True),
+                [
+                    {
+                        'uuid': template_uuid,
+                        'title': spec['title'],
+                        'description': spec.get('description'),
+                        'difficulty': spec['difficulty'],
+                        'topics': ','.join(spec['topics']),
+                        'num_questions': spec['num_questions'],
+                        'num_versions': spec['num_versions'],
+                        'password_hash': spec['password_hash'],
+                    }
+                    for spec, template_uuid in zip(chunk, template_uuids)
+                ]
+            ).all()
+            question_template_ids = iter(db.session.scalars(
+                insert(QuestionTemplate).returning(QuestionTemplate.id, sort_by_parameter_order=True),
+                [
+                    {'test_template_id': template_id, 'question_type': topic, 'difficulty': difficulty, 'order': order}
+                    for template_id, plan in zip(template_ids, question_plans)
+                    for topic, difficulty, order in plan
+                ]
+            ).all())
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.exception("Bulk test creation failed")
+            outcomes.extend((None, e) for _ in chunk)
+            continue
+
+        # Generate the versions of every test in the chunk
+        calls = []
+        version_uuids = []
+        answer_key_urls = []
+        for spec, plan in zip(chunk, question_plans):
+            plan = [(next(question_template_ids), topic, difficulty, order) for topic, difficulty, order in plan]
+            uuids = [str(uuid.uuid4()) for _ in range(spec['num_versions'])]
+            urls = [url_for('answer_key', test_uuid=version_uuid, _external=True) for version_uuid in uuids]
+            multiple_choice = spec.get('multiple_choice', False)
+            if pool is not None:
+                calls.append(pool.submit(generate_version_content, plan, urls, multiple_choice, fairness_threshold).result)
+            else:
+                calls.append(lambda plan=plan, urls=urls, multiple_choice=multiple_choice: generate_version_content(
+                    plan, urls, multiple_choice, fairness_threshold
+                ))
+            version_uuids.append(uuids)
+            answer_key_urls.append(urls)
+        contents = [_outcome(call) for call in calls]
+
+        try:
+            # Drop the tests that failed to generate
+            failed_ids = [template_id for template_id, (_, error) in zip(template_ids, contents) if error is not None]
+            if failed_ids:
+                db.session.execute(delete(QuestionTemplate).where(QuestionTemplate.test_template_id.in_(failed_ids)))
+                db.session.execute(delete(TestTemplate).where(TestTemplate.id.in_(failed_ids)))
+
+            # Then versions, their questions and QR codes
+            generated = [
+                (template_id, uuids, urls, content)
+                for template_id, uuids, urls, (content, error) in zip(template_ids, version_uuids, answer_key_urls, contents)
+                if error is None
+            ]
+            version_rows = [
+                {'uuid': version_uuid, 'test_template_id': template_id, 'version_number': version_number}
+                for template_id, uuids, _, _ in generated
+                for version_number, version_uuid in enumerate(uuids, start=1)
+            ]
+            version_ids = iter(db.session.scalars(
+                insert(TestVersion).returning(TestVersion.id, sort_by_parameter_order=True),
+                version_rows
+            ).all() if version_rows else ())
+
+            question_rows = []
+            choice_rows = []
+            qr_code_rows = []
+            for template_id, uuids, urls, content in generated:
+                for url, (questions_data, qr_matrix) in zip(urls, content):
+                    version_id = next(version_ids)
+                    for q_data in questions_data:
+                        q_data = dict(q_data, test_version_id=version_id)
+                        choices = (q_data.pop('choices'), q_data.pop('answer_position')) if 'choices' in q_data else None
+                        question_rows.append(q_data)
+                        choice_rows.append(choices)
+                    qr_code_rows.append({'test_version_id': version_id, 'payload': url, 'matrix': qr_matrix})
+            if any(choice_rows):
+                # Multiple-choice questions need their IDs for the choices
+                question_ids = db.session.scalars(
+                    insert(Question).returning(Question.id, sort_by_parameter_order=True),
+                    question_rows
+                ).all()
+                db.session.execute(insert(QuestionChoices), [
+                    {'question_id': question_id, 'distractors': choices[0], 'answer_position': choices[1]}
+                    for question_id, choices in zip(question_ids, choice_rows) if choices is not None
+                ])
+            elif question_rows:
+                db.session.execute(insert(Question), question_rows)
+            if qr_code_rows:
+                db.session.execute(insert(VersionQRCode), qr_code_rows)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.exception("Bulk test creation failed")
+            outcomes.extend((None, error or e) for _, error in contents)
+            continue
+
+        TESTS_CREATED.inc(len(generated))
+        VERSIONS_CREATED.inc(len(version_rows))
+        QUESTIONS_CREATED.inc(len(question_rows))
+
+        for template_id, template_uuid, uuids, (_, error) in zip(template_ids, template_uuids, version_uuids, contents):
+            if error is not None:
+                outcomes.append((None, error))
+                continue
+
+            # Access codes are derived from the version identity
+            versions = [
+                TestVersion(uuid=version_uuid, test_template_id=template_id, version_number=version_number)
+                for version_number, version_uuid in enumerate(uuids, start=1)
+            ]
+            outcomes.append(({
+                'uuid': template_uuid,
+                'versions': [
+                    {
+                        'version_number': version.version_number,
+                        'uuid': version.uuid,
+                        'access_code': version.get_access_code(),
+                    }
+                    for version in versions
+                ],
+            }, None))
+
+    return outcomes
@@ -0,0 +1,345 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import TestVersion, Question, Submission, SubmittedAnswer
+from grading import get_answer_forms, record_stats
+from utils.metrics import SUBMISSIONS_RECEIVED, SUBMISSIONS_WRITTEN, SUBMISSIONS_FAILED, SUBMISSION_FLUSH_SECONDS
+
+# Question IDs by order of recently submitted-to versions; versions never change
+_version_questions = {}
+_version_questions_lock = threading.Lock()
+VERSION_QUESTIONS_CACHE_SIZE = 1024
+
+def get_version_questions(test_uuid):
+    """
+    Return (version id, {question order: question id}) of a test version, or None.
+
+    Cached per process, so a burst of submissions to the same version costs
+    no queries.
+    """
+    with _version_questions_lock:
+        cached = _version_questions.get(test_uuid)
+    if cached is not None:
+        return cached
+
+    version_id = db.session.scalar(select(TestVersion.id).where(TestVersion.uuid == test_uuid))
+    if version_id is None:
+        return None
+    questions = dict(db.session.execute(
+        select(Question.order, Question.id).where(Question.test_version_id == version_id)
+    ).all())
+
+    with _version_questions_lock:
+        if len(_version_questions) >= VERSION_QUESTIONS_CACHE_SIZE:
+            _version_questions.clear()
+        _version_questions[test_uuid] = (version_id, questions)
+    return version_id, questions
+
+def write_submissions(records):
+    """
+    Insert buffered submissions and their answers in one transaction.
+
+    Submissions whose key is already stored are skipped, so retries and
+    double clicks are written once. The submissions are graded as they are
+    written, and the running totals of the results dashboard updated in the
+    same transaction.
+
+    Returns:
+        int: Number of submissions written
+
+    Raises:
+        SQLAlchemyError: If a submission could not be stored for any reason
+            other than its key being stored already
+    """
+    forms = get_answer_forms({question_id for record in records for question_id, _ in record['answers']})
+    keys = [record['key'] for record in records]
+    existing = set(db.session.scalars(select(Submission.key).where(Submission.key.in_(keys))))
+    records = [record for record in records if record['key'] not in existing]
+    if not records:
+        db.session.rollback()
+        return 0
+
+    try:
+        _insert_submissions(records, forms)
+        db.session.commit()
+        return len(records)
+    except IntegrityError:
+        # Another process stored some of the keys since the check; write one by one
+        db.session.rollback()
+
+    written = 0
+    for record in records:
+        try:
+            _insert_submissions([record], forms)
+            db.session.commit()
+            written += 1
+        except IntegrityError:
+            db.session.rollback()
+            # Only a duplicate key means the submission is stored; anything else
+            # goes back to the buffer to be retried (and set aside eventually)
+            if db.session.scalar(select(Submission.id).where(Submission.key == record['key'])) is None:
+                raise
+    return written
+
+def _insert_submissions(records, forms):
+    submission_ids = db.session.scalars(
+        insert(Submission).returning(Submission.id, sort_by_parameter_order=True),
+        [
+            {
+                'uuid': record['uuid'],
+                'key': record['key'],
+                'test_version_id': record['test_version_id'],
+                'student_name': record['student_name'],
+                'submitted_at': record['submitted_at'],
+            }
+            for record in records
+        ]
+    ).all()
+    answer_rows = [
+        {'submission_id': submission_id, 'question_id': question_id, 'answer': answer}
+        for submission_id, record in zip(submission_ids, records)
+        for question_id, answer in record['answers']
+    ]
+    if answer_rows:
+        db.session.execute(insert(SubmittedAnswer), answer_rows)
+    record_stats(records, forms)
+
+def dead_letter_line(record, error):
+    """Return a submission that could not be written as a JSON line for the dead-letter file."""
+    return json.dumps({
+        **{name: value for name, value in record.items() if name not in ('attempts', 'retry_at')},
+        'error': error,
+    }, default=str) + '\n'
+
+def read_dead_letters(path):
+    """Read the submissions set aside in a dead-letter file, as records for write_submissions."""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                record.pop('error', None)
+                record['submitted_at'] = datetime.fromisoformat(record['submitted_at'])
+                record['answers'] = [tuple(answer) for answer in record['answers']]
+                records.append(record)
+    return records
+
+# Longest wait, in seconds, before a submission that failed to write is tried again
+MAX_RETRY_DELAY = 60
+
+class SubmissionBuffer:
+    """
+    Write-behind buffer for student submissions.
+
+    Requests add submissions to the buffer and return immediately; a
+    background thread writes them in batches, every flush_interval seconds
+    or as soon as batch_size submissions are waiting. Submissions with a
+    key that is already buffered are ignored.
+
+    A batch that fails is written again record by record, so one bad
+    record cannot hold up the others. A record that fails is retried after
+    a delay that doubles with each attempt (up to MAX_RETRY_DELAY), which
+    rides out a short database outage; after max_attempts it is set aside
+    in the dead-letter file (one JSON line per submission, see `flask
+    retry-failed-submissions`) instead of staying in memory.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_attempts=10, dead_letter_path=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def add(self, record):
+        """Buffer a submission; returns False when its key is already buffered."""
+        self._start()
+        with self._lock:
+            if record['key'] in self._pending or record['key'] in self._flushing:
+                return False
+            self._pending[record['key']] = record
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+        return True
+
+    def get(self, key):
+        """Return a buffered submission that is not written yet, or None."""
+        with self._lock:
+            return self._pending.get(key) or self._flushing.get(key)
+
+    def flush(self):
+        """Write every buffered submission; returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+                batch = list(self._flushing.values())
+            if not batch:
+                return 0
+
+            written = 0
+            now = time.monotonic()
+            # Records waiting out their retry delay are carried over untouched
+            retry = {record['key']: record for record in batch if record.get('retry_at', 0) > now}
+            batch = [record for record in batch if record['key'] not in retry]
+            started = time.perf_counter()
+            with app.app_context():
+                for start in range(0, len(batch), self.batch_size):
+                    chunk = batch[start:start + self.batch_size]
+                    try:
+                        written += write_submissions(chunk)
+                        continue
+                    except Exception:
+                        db.session.rollback()
+                        app.logger.exception("Writing %d buffered submissions failed; writing them one by one", len(chunk))
+                    for record in chunk:
+                        try:
+                            written += write_submissions([record])
+                        except Exception as e:
+                            db.session.rollback()
+                            record['attempts'] = record.get('attempts', 0) + 1
+                            if record['attempts'] >= self.max_attempts:
+                                self._set_aside(record, e)
+                            else:
+                                delay = min(self.flush_interval * 2 ** record['attempts'], MAX_RETRY_DELAY)
+                                record['retry_at'] = time.monotonic() + delay
+                                retry[record['key']] = record
+
+            with self._lock:
+                # Records to retry go in front of anything buffered since
+                self._pending = {**retry, **self._pending}
+                self._flushing = {}
+            SUBMISSION_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            SUBMISSIONS_WRITTEN.inc(written)
+            return written
+
+    def _set_aside(self, record, error):
+        app.logger.error(
+            "Setting submission %s aside after %d failed writes: %s", record['key'], record['attempts'], error
+        )
+        SUBMISSIONS_FAILED.inc()
+        if self.dead_letter_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                f.write(dead_letter_line(record, str(error) or error.__class__.__name__))
+        except (OSError, TypeError, ValueError):
+            app.logger.exception("Could not write submission %s to the dead-letter file", record['key'])
+
+    def _start(self):
+        # Threads do not survive a fork, so track the owning process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='submission-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+submission_buffer = SubmissionBuffer(
+    app.config['SUBMISSION_BATCH_SIZE'],
+    app.config['SUBMISSION_FLUSH_INTERVAL'],
+    max_attempts=app.config['SUBMISSION_MAX_ATTEMPTS'],
+    dead_letter_path=app.config['SUBMISSION_DEAD_LETTER'],
+)
+
+# Write what is still buffered when the process exits normally
+atexit.register(submission_buffer.flush)
+
+def submit_answers(test_uuid, key, student_name, answers):
+    """
+    Accept a student's answers to a test version for writing.
+
+    Args:
+        test_uuid (str): Test version UUID
+        key (str): Client-chosen idempotency key for this submission
+        student_name (str): Name of the student
+        answers (dict): Question order (int) to answer text
+
+    Returns:
+        tuple: (status, error) where status is 'accepted', or 'duplicate'
+            when the key is already buffered; a key that is already stored
+            is accepted and skipped when the buffer is written
+    """
+    if not isinstance(key, str) or not key or len(key) > 64:
+        return None, 'A submission key of at most 64 characters is required'
+    student_name = student_name.strip() if isinstance(student_name, str) else ''
+    if not student_name or len(student_name) > 100:
+        return None, 'A student name of at most 100 characters is required'
+
+    version = get_version_questions(test_uuid)
+    if version is None:
+        return None, 'Test version not found'
+    version_id, question_ids = version
+
+    max_length = app.config['SUBMISSION_MAX_ANSWER_LENGTH']
+    rows = []
+    for order, answer in answers.items():
+        question_id = question_ids.get(order)
+        if question_id is None:
+            return None, f'Unknown question {order}'
+        if isinstance(answer, bool) or not isinstance(answer, (str, int, float)):
+            return None, f'Answer to question {order} must be text or a number'
+        answer = str(answer).strip()
+        if len(answer) > max_length:
+            return None, f'Answer to question {order} is longer than {max_length} characters'
+        if answer:
+            rows.append((question_id, answer))
+
+    record = {
+        'uuid': str(uuid.uuid4()),
+        'key': key,
+        'test_version_id': version_id,
+        'student_name': student_name,
+        'submitted_at': datetime.utcnow(),
+        'answers': rows,
+    }
+    status = 'accepted' if submission_buffer.add(record) else 'duplicate'
+    SUBMISSIONS_RECEIVED.inc(outcome=status)
+    return status, None
+
+def find_submission(key):
+    """
+    Look up a submission by key, in the buffer or the database.
+
+    Returns:
+        dict: status ('pending' or 'stored'), student_name, answered and
+            submitted_at, or None when the key is unknown
+    """
+    record = submission_buffer.get(key)
+    if record is not None:
+        return {
+            'status': 'pending',
+            'student_name': record['student_name'],
+            'answered': len(record['answers']),
+            'submitted_at': record['submitted_at'],
+        }
+    submission = Submission.query.filter_by(key=key).first()
+    if submission is None:
+        return None
+    return {
+        'status': 'stored',
+        'student_name': submission.student_name,
+        'answered': SubmittedAnswer.query.filter_by(submission_id=submission.id).count(),
+        'submitted_at': submission.submitted_at,
+    }
@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+import pytest
+
+# The app reads its configuration when it is imported, so point everything it
+# writes at a scratch directory first
+_scratch = tempfile.mkdtemp(prefix='math-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_scratch, 'test.db')}",
+    'ARTIFACT_CACHE_DIR': os.path.join(_scratch, 'artifacts'),
+    'ADMISSION_DIR': os.path.join(_scratch, 'admission'),
+    'SESSION_DIR': os.path.join(_scratch, 'sessions'),
+    'SUBMISSION_DEAD_LETTER': os.path.join(_scratch, 'failed_submissions.jsonl'),
+    'JOB_WORKERS': '0',
+    'LOG_LEVEL': 'WARNING',
+})
+
+from app import app as flask_app, db  # noqa: E402
+
+@pytest.fixture
+def app():
+    """The app in an application context, with empty tables."""
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def make_template(app):
+    """Create a test template with its versions and questions."""
+    from services import create_test_template, test_spec_from_data
+    from werkzeug.security import generate_password_hash
+
+    def make(num_versions=2, num_questions=6, multiple_choice=False, password='secret'):
+        spec = {
+            'title': 'Test Fixture',
+            'difficulty': 'medium',
+            'topics': ['addition', 'fractions', 'decimals', 'algebra'],
+            'num_questions': num_questions,
+            'num_versions': num_versions,
+            'answer_format': 'multiple_choice' if multiple_choice else 'free_response',
+        }
+        # A cheap hash; the real cost factor only slows the tests down
+        password_hash = generate_password_hash(password, method='pbkdf2:sha256:1000')
+        with app.test_request_context():
+            return create_test_template(test_spec_from_data(spec, password_hash))
+
+    return make
@@ -0,0 +1,107 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import routes
+from utils.admission import AdmissionGate
+
+def make_gate(tmp_path, limit=1, queue_size=0, timeout=0.0):
+    return AdmissionGate('render', limit, queue_size=queue_size, timeout=timeout, directory=str(tmp_path))
+
+def test_a_request_beyond_the_limit_is_rejected(tmp_path):
+    gate = make_gate(tmp_path)
+    held = gate.acquire()
+    assert held is not None
+
+    started = time.monotonic()
+    assert gate.acquire() is None
+    assert time.monotonic() - started < 0.1
+
+    gate.release(held)
+    fd = gate.acquire()
+    assert fd is not None
+    gate.release(fd)
+
+def test_a_queued_request_gets_the_slot_when_it_is_released(tmp_path):
+    gate = make_gate(tmp_path, queue_size=1, timeout=5)
+    held = gate.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(gate.acquire()))
+    waiter.start()
+    time.sleep(0.2)
+
+    # The queue is full while the waiter is in it
+    assert gate.acquire() is None
+    assert results == []
+    gate.release(held)
+    waiter.join()
+
+    [fd] = results
+    assert fd is not None
+    gate.release(fd)
+
+def test_a_queued_request_gives_up_after_the_timeout(tmp_path):
+    gate = make_gate(tmp_path, queue_size=1, timeout=0.2)
+    held = gate.acquire()
+
+    started = time.monotonic()
+    assert gate.acquire() is None
+    assert time.monotonic() - started >= 0.2
+    # The place in the queue was given back
+    place = gate._try_lock(gate._queue_paths)
+    assert place is not None
+    gate._unlock(place)
+    gate.release(held)
+
+def test_a_slot_held_by_another_process_counts_and_is_freed_when_it_dies(tmp_path):
+    gate = make_gate(tmp_path)
+    holder = subprocess.Popen([sys.executable, '-c', (
+        'import fcntl, os, sys\n'
+        f'fd = os.open({gate._slot_paths[0]!r}, os.O_RDWR | os.O_CREAT)\n'
+        'fcntl.flock(fd, fcntl.LOCK_EX)\n'
+        'print("held", flush=True)\n'
+        'sys.stdin.read()\n'
+    )], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline() == 'held\n'
+        assert gate.acquire() is None
+    finally:
+        holder.kill()
+        holder.wait()
+
+    fd = gate.acquire()
+    assert fd is not None
+    gate.release(fd)
+
+def test_a_released_slot_can_be_released_again(tmp_path):
+    gate = make_gate(tmp_path)
+    slot = gate.enter()
+    slot.release()
+    slot.release()
+
+    fd = gate.acquire()
+    assert fd is not None
+    gate.release(fd)
+
+@pytest.fixture
+def render_gate(app, tmp_path, monkeypatch):
+    gate = make_gate(tmp_path)
+    monkeypatch.setitem(routes.admission_gates, 'render', gate)
+    return gate
+
+def test_a_pdf_request_is_turned_away_while_the_renderers_are_busy(render_gate, make_template):
+    version = make_template(num_versions=1, num_questions=3).test_versions[0]
+    client = routes.app.test_client()
+    held = render_gate.acquire()
+
+    response = client.get(f'/test-version/{version.uuid}/pdf')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(render_gate.retry_after)
+
+    render_gate.release(held)
+    response = client.get(f'/test-version/{version.uuid}/pdf')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from utils.answer_equivalence import canonicalize, dumps, grade, is_correct, loads, normalize_response
+
+def accepts(answer, response):
+    return is_correct(canonicalize(answer), normalize_response(response))
+
+@pytest.mark.parametrize('answer, response', [
+    ('3/4', '0.75'),
+    ('3/4', '6/8'),
+    ('0.75', '3/4'),
+    ('12.0', '12'),
+    ('16', '2^4'),
+    ('1000', '1,000'),
+    ('5', '5 cm'),
+    ('25', '25%'),
+    ('Yes', ' yes '),
+    # Stored float reprs and rounded decimals
+    ('2.3333333333333335', '7/3'),
+    ('2.3333333333333335', '2.33'),
+    ('3.14', '3.14159'),
+    # Roots are unordered; a single value may be named
+    ('-2, 3', '3, -2'),
+    ('-2, 3', 'x = 3 or x = -2'),
+    ('3', 'x = 3'),
+    ('x = 1, y = -2', 'y = -2, x = 1'),
+    ('(2, 3)', '(2, 3)'),
+    # Surds, exactly or to two places
+    ('-1/2 + sqrt(5)/2, -sqrt(5)/2 - 1/2', '(-1+√5)/2, (-1-√5)/2'),
+    ('2*sqrt(3)', '2sqrt(3)'),
+    ('sqrt(2)', '1.41'),
+    ('16*pi', '50.27'),
+])
+def test_equivalent_responses_are_accepted(answer, response):
+    assert accepts(answer, response)
+
+@pytest.mark.parametrize('answer, response', [
+    ('3/4', '0.7'),
+    ('3.14', '3.1'),
+    ('2.3333333333333335', '2.3'),
+    ('sqrt(2)', '1.4'),
+    ('-2, 3', '3'),
+    ('-2, 3', '-2, 3, 4'),
+    ('(2, 3)', '(3, 2)'),
+    ('x = 1, y = -2', 'x = -2, y = 1'),
+    ('Yes', 'no'),
+    ('3', ''),
+    ('3', 'three'),
+    ('3', '9^9^9'),
+])
+def test_other_responses_are_rejected(answer, response):
+    assert not accepts(answer, response)
+
+def test_unparseable_responses_are_text():
+    assert normalize_response('1/0').kind == 'text'
+    assert normalize_response('__import__("os")').kind == 'text'
+
+@pytest.mark.parametrize('response', [
+    '(((((((9)**12)**12)**12)**12)**12)**12)**12',
+    '((9^12)^12)^12',
+    '((1/9^12)^12)^12',
+])
+def test_nested_powers_are_not_computed(response):
+    started = time.perf_counter()
+    assert normalize_response(response).kind == 'text'
+    assert time.perf_counter() - started < 0.1
+
+def test_canonical_forms_survive_storage():
+    for answer in ('3/4', '2.3333333333333335', '-2, 3', 'x = 1, y = -2', '(2, 3)', 'sqrt(2)', 'Yes'):
+        assert loads(dumps(canonicalize(answer))) == canonicalize(answer)
+
+def test_grade_marks_every_expected_answer():
+    expected = {1: canonicalize('3/4'), 2: canonicalize('-2, 3')}
+    results = grade(expected, [{1: '0.75', 2: '3, -2'}, {1: '1/2'}, {2: '3 or -2', 3: 'extra'}])
+
+    assert results == [{1: True, 2: True}, {1: False, 2: False}, {1: False, 2: True}]
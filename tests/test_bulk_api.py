@@ -0,0 +1,100 @@
+import pytest
+
+import models
+import services
+from models import Question, QuestionChoices, QuestionTemplate
+
+def make_spec(title='Bulk Test', **overrides):
+    spec = {
+        'title': title,
+        'difficulty': 'easy',
+        'topics': ['addition', 'fractions'],
+        'num_questions': 3,
+        'num_versions': 2,
+        'password': 'secret1',
+    }
+    spec.update(overrides)
+    return spec
+
+@pytest.fixture
+def client(app, monkeypatch):
+    # Generate in this process, where the tests can reach it
+    monkeypatch.setitem(app.config, 'RENDER_WORKERS', 1)
+    return app.test_client()
+
+def test_a_mixed_request_creates_the_valid_tests_and_reports_the_rest(client):
+    response = client.post('/api/tests', json=[
+        make_spec('Free Response'),
+        make_spec('No Topics', topics=[]),
+        make_spec('Multiple Choice', answer_format='multiple_choice', num_versions=3),
+        make_spec('No Versions', num_versions=0),
+        'not a spec',
+    ])
+
+    assert response.status_code == 207
+    body = response.get_json()
+    assert (body['created'], body['failed']) == (2, 3)
+    results = body['results']
+    assert [result['index'] for result in results] == [0, 1, 2, 3, 4]
+    assert [result['ok'] for result in results] == [True, False, True, False, False]
+    assert 'topics' in results[1]['errors']
+    assert 'num_versions' in results[3]['errors']
+    assert 'spec' in results[4]['errors']
+    for result in (results[1], results[3], results[4]):
+        assert 'uuid' not in result
+
+    free, multiple_choice = results[0], results[2]
+    assert [version['version_number'] for version in free['versions']] == [1, 2]
+    assert [version['version_number'] for version in multiple_choice['versions']] == [1, 2, 3]
+    assert free['url'].endswith(f"/test-template/{free['uuid']}")
+
+    templates = {template.uuid: template for template in models.TestTemplate.query.all()}
+    assert set(templates) == {free['uuid'], multiple_choice['uuid']}
+    assert templates[free['uuid']].title == 'Free Response'
+    for result, expected in ((free, 2), (multiple_choice, 3)):
+        template = templates[result['uuid']]
+        versions = models.TestVersion.query.filter_by(test_template_id=template.id).all()
+        assert {version.uuid for version in versions} == {version['uuid'] for version in result['versions']}
+        assert {version.uuid: version.get_access_code() for version in versions} == {
+            version['uuid']: version['access_code'] for version in result['versions']
+        }
+        assert QuestionTemplate.query.filter_by(test_template_id=template.id).count() == 3
+        version_ids = [version.id for version in versions]
+        assert Question.query.filter(Question.test_version_id.in_(version_ids)).count() == 3 * expected
+    assert QuestionChoices.query.count() == 3 * 3
+
+def test_a_test_that_fails_to_generate_is_left_out(client, monkeypatch):
+    generate = services.generate_version_content
+
+    def generate_or_fail(plan, urls, multiple_choice, fairness_threshold):
+        if multiple_choice:
+            raise RuntimeError('generation failed')
+        return generate(plan, urls, multiple_choice, fairness_threshold)
+
+    monkeypatch.setattr(services, 'generate_version_content', generate_or_fail)
+    response = client.post('/api/tests', json=[make_spec('Fails', answer_format='multiple_choice'), make_spec()])
+
+    assert response.status_code == 207
+    failed, created = response.get_json()['results']
+    assert failed == {'index': 0, 'ok': False, 'errors': {'generation': ['generation failed']}}
+    assert created['ok']
+    assert [template.uuid for template in models.TestTemplate.query.all()] == [created['uuid']]
+    assert QuestionTemplate.query.count() == 3
+    assert models.TestVersion.query.count() == 2
+
+def test_a_request_with_only_valid_tests_is_created(client):
+    response = client.post('/api/tests', json={'tests': [make_spec(), make_spec()]})
+
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 2
+
+def test_a_request_with_only_invalid_tests_creates_nothing(client):
+    response = client.post('/api/tests', json=[make_spec(title='x'), make_spec(password='short')])
+
+    assert response.status_code == 422
+    assert response.get_json()['created'] == 0
+    assert models.TestTemplate.query.count() == 0
+
+@pytest.mark.parametrize('body', [[], {}, 'tests', None])
+def test_a_request_that_is_not_a_list_of_specs_is_refused(client, body):
+    assert client.post('/api/tests', json=body).status_code == 400
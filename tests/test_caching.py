@@ -0,0 +1,72 @@
+import pytest
+
+import routes
+from routes import IMMUTABLE_MAX_AGE
+
+@pytest.fixture
+def version(make_template):
+    return make_template(num_versions=1, num_questions=4).test_versions[0]
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def test_a_version_page_is_revalidated_on_every_use(client, version):
+    response = client.get(f'/test-version/{version.uuid}', headers={'Accept-Encoding': 'identity'})
+
+    assert response.status_code == 200
+    etag, weak = response.get_etag()
+    assert etag and not weak
+    assert response.cache_control.no_cache
+    assert response.cache_control.public
+    assert response.cache_control.max_age is None
+    assert not response.cache_control.immutable
+
+def test_a_version_page_the_client_holds_is_not_sent_again(client, version):
+    url = f'/test-version/{version.uuid}'
+    etag, _ = client.get(url, headers={'Accept-Encoding': 'identity'}).get_etag()
+
+    response = client.get(url, headers={'If-None-Match': f'"{etag}"', 'Accept-Encoding': 'identity'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.get_etag() == (etag, False)
+    assert response.cache_control.no_cache
+
+def test_the_compressed_page_has_its_own_etag_and_gets_a_304(client, version):
+    url = f'/test-version/{version.uuid}'
+    plain, _ = client.get(url, headers={'Accept-Encoding': 'identity'}).get_etag()
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    gzip_etag, _ = response.get_etag()
+    assert gzip_etag == f'{plain}-gzip'
+
+    response = client.get(url, headers={'If-None-Match': f'"{gzip_etag}"', 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 304
+    assert response.get_etag() == (gzip_etag, False)
+
+def test_a_new_page_renderer_reaches_clients_that_hold_the_page(client, version, monkeypatch):
+    url = f'/test-version/{version.uuid}'
+    etag, _ = client.get(url, headers={'Accept-Encoding': 'identity'}).get_etag()
+
+    monkeypatch.setattr(routes, 'PAGE_RENDERER_VERSION', routes.PAGE_RENDERER_VERSION + 1)
+    response = client.get(url, headers={'If-None-Match': f'"{etag}"', 'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+
+def test_a_qr_code_is_cached_for_a_year(client, version):
+    url = f'/qr/{version.uuid}.svg'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.cache_control.public
+    assert response.cache_control.max_age == IMMUTABLE_MAX_AGE
+    assert response.cache_control.immutable
+
+    etag, _ = response.get_etag()
+    response = client.get(url, headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.cache_control.immutable
+
+def test_an_unknown_etag_gets_the_page(client, version):
+    response = client.get(f'/test-version/{version.uuid}', headers={'If-None-Match': '"page-other-r1"'})
+
+    assert response.status_code == 200
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.fairness import (
+    DEFAULT_THRESHOLD, MAX_REDRAWS, MIN_VERSIONS, analyze, feature_array, question_features, rebalance
+)
+from utils.math_generator import generate_test_versions
+
+EASY = {'question_text': 'What is 12 + 13?', 'answer': '25', 'solution_steps': '12 + 13 = 25'}
+HARD = {
+    'question_text': 'What is 987654 + 456789?',
+    'answer': '1444443',
+    'solution_steps': '987654 + 456789\n= 1444443',
+}
+
+def make_versions(num_versions=12, num_questions=5, hard_version=None):
+    return [
+        [dict(HARD if version == hard_version else EASY) for _ in range(num_questions)]
+        for version in range(num_versions)
+    ]
+
+@pytest.mark.parametrize('question_text, regroupings', [
+    ('What is 47 + 38?', 1),
+    ('What is 99 + 1?', 2),
+    ('What is 1000 - 1?', 3),
+    ('What is 58 - 23?', 0),
+    ('What is 3 * 4?', 0),
+])
+def test_regroupings_are_counted_column_by_column(question_text, regroupings):
+    assert question_features(question_text, '0', '')[2] == regroupings
+
+@pytest.mark.parametrize('answer, non_integer', [('12', 0), ('3/4', 1), ('0.5', 1), ('2*sqrt(3)', 2), ('0.333', 2)])
+def test_answers_are_graded_by_how_far_from_whole_numbers_they_are(answer, non_integer):
+    assert question_features('What is it?', answer, '')[3] == non_integer
+
+def test_identical_versions_are_all_fair():
+    analysis = analyze(feature_array(make_versions()))
+
+    assert analysis['flagged'] == []
+    assert not analysis['deviation'].any()
+
+def test_a_version_much_harder_than_the_rest_is_flagged():
+    analysis = analyze(feature_array(make_versions(hard_version=4)))
+
+    assert analysis['flagged'] == [4]
+    assert analysis['scores'].argmax() == 4
+
+def test_too_few_versions_are_never_flagged():
+    analysis = analyze(feature_array(make_versions(MIN_VERSIONS - 1, hard_version=0)))
+
+    assert analysis['flagged'] == []
+
+def test_rebalancing_redraws_the_outlier_until_it_is_in_line():
+    versions = make_versions(hard_version=4)
+    draws = []
+
+    def redraw(version, question, draw):
+        draws.append((version, question, draw))
+        return dict(EASY)
+
+    replaced = rebalance(versions, redraw)
+    assert replaced
+    assert {version for version, _ in replaced} == {4}
+    assert {version for version, _, _ in draws} == {4}
+    assert analyze(feature_array(versions))['flagged'] == []
+    for version, question in replaced:
+        assert versions[version][question] == EASY
+
+def test_a_redraw_that_is_no_better_is_not_kept():
+    versions = make_versions(hard_version=4)
+
+    replaced = rebalance(versions, lambda version, question, draw: dict(HARD))
+    assert replaced == []
+    assert versions == make_versions(hard_version=4)
+
+def test_at_most_max_redraws_questions_of_a_version_are_redrawn():
+    versions = make_versions(num_questions=MAX_REDRAWS + 5, hard_version=4)
+    redrawn = set()
+
+    def redraw(version, question, draw):
+        redrawn.add(question)
+        # A little easier, never enough to bring the version in line
+        return dict(HARD, answer='1444440')
+
+    rebalance(versions, redraw)
+    assert len(redrawn) == MAX_REDRAWS
+
+def test_too_few_versions_are_not_rebalanced():
+    def redraw(version, question, draw):
+        raise AssertionError('no redraws expected')
+
+    assert rebalance(make_versions(MIN_VERSIONS - 1, hard_version=0), redraw) == []
+
+def test_generated_versions_are_rebalanced_reproducibly():
+    topics = ['addition', 'subtraction', 'decimals', 'fractions', 'algebra', 'statistics']
+    question_templates = [
+        SimpleNamespace(id=i, question_type=topic, difficulty='hard', order=i)
+        for i, topic in enumerate(topics, start=1)
+    ]
+    drawn = generate_test_versions(question_templates, 30)
+    assert analyze(feature_array(drawn))['flagged']
+
+    rebalanced = generate_test_versions(question_templates, 30, fairness_threshold=DEFAULT_THRESHOLD)
+    assert rebalanced == generate_test_versions(question_templates, 30, fairness_threshold=DEFAULT_THRESHOLD)
+    assert analyze(feature_array(rebalanced))['flagged'] == []
+    assert all([question['order'] for question in version] == list(range(1, 7)) for version in rebalanced)
+    assert sum(before != after for before, after in zip(drawn, rebalanced)) < len(drawn) / 2
+
+def test_the_fairness_report_lists_every_version(app, make_template):
+    template = make_template(num_versions=6, num_questions=4)
+
+    result = app.test_cli_runner().invoke(args=['fairness-report', template.uuid])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert [int(line.split()[0]) for line in lines[1:7]] == [1, 2, 3, 4, 5, 6]
+    assert ' of 6 versions beyond ' in lines[-1]
+
+def test_the_fairness_report_needs_a_known_test(app):
+    result = app.test_cli_runner().invoke(args=['fairness-report', 'no-such-test'])
+
+    assert result.exit_code != 0
+    assert 'No test template no-such-test' in result.output
@@ -0,0 +1,101 @@
+import json
+import uuid
+
+import pytest
+
+import models
+from commands import MANIFEST_NAMESPACE, read_manifest
+
+BASE_URL = 'https://tests.example.org'
+
+def make_entry(title, **overrides):
+    entry = {
+        'title': title,
+        'difficulty': 'easy',
+        'topics': ['addition', 'fractions'],
+        'num_questions': 2,
+        'num_versions': 2,
+        'password': 'secret1',
+    }
+    entry.update(overrides)
+    return entry
+
+def write_manifest(path, entries):
+    path.write_text(''.join(f'{json.dumps(entry)}\n' for entry in entries))
+    return path
+
+@pytest.fixture
+def generate(app):
+    runner = app.test_cli_runner()
+
+    def generate(manifest):
+        return runner.invoke(args=['generate-tests', str(manifest), '--base-url', BASE_URL, '--workers', '1'])
+
+    return generate
+
+def templates():
+    return {template.uuid: template.title for template in models.TestTemplate.query.all()}
+
+def test_a_rerun_skips_the_tests_already_created(generate, tmp_path):
+    manifest = write_manifest(tmp_path / 'term.jsonl', [make_entry('First'), make_entry('Second')])
+
+    result = generate(manifest)
+    assert result.exit_code == 0, result.output
+    assert '2 created, 0 skipped, 0 failed' in result.output
+    created = templates()
+    assert sorted(created.values()) == ['First', 'Second']
+
+    result = generate(manifest)
+    assert result.exit_code == 0, result.output
+    assert '0 created, 2 skipped, 0 failed' in result.output
+    assert templates() == created
+    assert models.TestVersion.query.count() == 4
+
+def test_an_interrupted_run_picks_up_where_it_stopped(generate, tmp_path):
+    entries = [make_entry('First'), make_entry('Second'), make_entry('Third')]
+    # The run stopped after the first test
+    generate(write_manifest(tmp_path / 'term.jsonl', entries[:1]))
+
+    result = generate(write_manifest(tmp_path / 'term.jsonl', entries))
+    assert result.exit_code == 0, result.output
+    assert '2 created, 1 skipped, 0 failed' in result.output
+    assert sorted(templates().values()) == ['First', 'Second', 'Third']
+
+def test_identical_entries_are_separate_tests(generate, tmp_path):
+    manifest = write_manifest(tmp_path / 'term.jsonl', [make_entry('Same'), make_entry('Same')])
+
+    generate(manifest)
+    generate(manifest)
+    assert list(templates().values()) == ['Same', 'Same']
+
+def test_an_entry_key_names_its_test(generate, tmp_path):
+    manifest = write_manifest(tmp_path / 'term.jsonl', [make_entry('Keyed', key='algebra-week-1')])
+    generate(manifest)
+
+    # Editing a keyed entry does not make it a new test
+    generate(write_manifest(tmp_path / 'term.jsonl', [make_entry('Renamed', key='algebra-week-1')]))
+    assert templates() == {str(uuid.uuid5(MANIFEST_NAMESPACE, 'algebra-week-1')): 'Keyed'}
+
+def test_invalid_entries_fail_the_run_without_blocking_the_rest(generate, tmp_path):
+    manifest = tmp_path / 'term.jsonl'
+    manifest.write_text(f"{json.dumps(make_entry('Good'))}\nnot json\n{json.dumps(make_entry('x'))}\n")
+
+    result = generate(manifest)
+    assert result.exit_code != 0
+    assert 'line 2: Invalid JSON' in result.output
+    assert 'line 3: title' in result.output
+    assert '1 created, 0 skipped, 2 failed' in result.output
+    assert list(templates().values()) == ['Good']
+
+def test_a_csv_manifest_splits_its_topics(tmp_path):
+    manifest = tmp_path / 'term.csv'
+    manifest.write_text(
+        'title,difficulty,topics,num_questions,num_versions,password\n'
+        'Week 1,easy,addition; fractions,2,3,secret1\n'
+    )
+
+    [(line_number, key, entry, error)] = read_manifest(str(manifest))
+    assert (line_number, error) == (2, None)
+    assert key.startswith('term.csv:')
+    assert entry['topics'] == ['addition', 'fractions']
+    assert (entry['num_questions'], entry['num_versions']) == (2, 3)
@@ -0,0 +1,222 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import models
+import services
+from app import app as flask_app, db
+from jobs import claim_next_job, enqueue_job, is_stale, recover_stale_jobs, renew_lease, run_worker
+from models import Job
+from services import create_test_template
+
+def test_enqueue_returns_the_job_with_the_same_key(app):
+    first = enqueue_job('create_test', {'n': 1}, key='same')
+    second = enqueue_job('create_test', {'n': 2}, key='same')
+
+    assert second.id == first.id
+    assert second.get_payload() == {'n': 1}
+    assert Job.query.count() == 1
+
+def test_enqueue_requeues_a_finished_job_only_when_asked(app):
+    job = enqueue_job('create_test', {'n': 1}, key='done')
+    job.status = 'done'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+    assert enqueue_job('create_test', {'n': 2}, key='done').status == 'done'
+
+    job = enqueue_job('create_test', {'n': 2}, key='done', requeue_finished=True)
+    assert job.status == 'queued'
+    assert job.get_payload() == {'n': 2}
+
+def test_each_job_is_claimed_by_one_worker(app):
+    ids = {enqueue_job('create_test', {'n': n}).id for n in range(20)}
+    claimed = []
+    errors = []
+    start = threading.Barrier(4)
+
+    def worker():
+        try:
+            with flask_app.app_context():
+                start.wait()
+                while (job := claim_next_job()) is not None:
+                    claimed.append(job.id)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(claimed) == sorted(ids)
+    assert Job.query.filter_by(status='running').count() == len(ids)
+
+def test_claim_takes_a_lease(app):
+    enqueue_job('create_test', {})
+    job = claim_next_job()
+
+    assert job.status == 'running'
+    assert job.heartbeat_at is not None
+    assert job.attempts == 1
+    assert claim_next_job() is None
+
+def test_a_job_whose_lease_expired_is_claimed_again(app):
+    enqueue_job('create_test', {})
+    job = claim_next_job()
+    job.heartbeat_at = datetime.utcnow() - timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+    db.session.commit()
+
+    again = claim_next_job()
+    assert again.id == job.id
+    assert again.attempts == 2
+
+def test_a_job_that_keeps_losing_its_worker_fails(app):
+    enqueue_job('create_test', {})
+    job = claim_next_job()
+    job.attempts = app.config['JOB_MAX_ATTEMPTS']
+    job.heartbeat_at = datetime.utcnow() - timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+    db.session.commit()
+
+    assert recover_stale_jobs() == (0, 1)
+    db.session.refresh(job)
+    assert job.status == 'failed'
+    assert claim_next_job() is None
+
+def test_enqueue_requeues_a_stale_job(app):
+    job = enqueue_job('create_test', {'n': 1}, key='stale')
+    claim_next_job()
+    job.heartbeat_at = datetime.utcnow() - timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+    db.session.commit()
+
+    job = enqueue_job('create_test', {'n': 1}, key='stale')
+    assert job.status == 'queued'
+    assert job.attempts == 0
+
+def expire_lease(job):
+    job.heartbeat_at = datetime.utcnow() - timedelta(seconds=flask_app.config['JOB_LEASE_SECONDS'] + 1)
+    db.session.commit()
+
+def test_a_stale_job_is_requeued_until_it_runs_out_of_attempts(app):
+    job = enqueue_job('create_test', {})
+    for attempt in range(1, app.config['JOB_MAX_ATTEMPTS'] + 1):
+        assert claim_next_job().id == job.id
+        db.session.refresh(job)
+        assert job.attempts == attempt
+        expire_lease(job)
+        if attempt < app.config['JOB_MAX_ATTEMPTS']:
+            assert recover_stale_jobs() == (1, 0)
+            db.session.refresh(job)
+            assert (job.status, job.heartbeat_at) == ('queued', None)
+
+    assert recover_stale_jobs() == (0, 1)
+    db.session.refresh(job)
+    assert job.status == 'failed'
+    assert job.finished_at is not None
+
+def test_a_job_with_a_fresh_lease_is_left_running(app):
+    enqueue_job('create_test', {})
+    job = claim_next_job()
+
+    assert recover_stale_jobs() == (0, 0)
+    db.session.refresh(job)
+    assert job.status == 'running'
+
+def test_the_lease_is_renewed_while_the_job_runs(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_LEASE_SECONDS', 0.3)
+    enqueue_job('create_test', {})
+    job = claim_next_job()
+    claimed_at = job.heartbeat_at
+    stop = threading.Event()
+    renewer = threading.Thread(target=renew_lease, args=(job.id, stop))
+    renewer.start()
+    time.sleep(0.5)
+
+    db.session.refresh(job)
+    assert job.heartbeat_at > claimed_at
+    assert not is_stale(job)
+    stop.set()
+    renewer.join(1)
+    assert not renewer.is_alive()
+
+def test_a_finished_job_keeps_its_last_heartbeat(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_LEASE_SECONDS', 0.3)
+    enqueue_job('create_test', {})
+    job = claim_next_job()
+    job.status = 'done'
+    db.session.commit()
+    heartbeat_at = job.heartbeat_at
+    stop = threading.Event()
+    renewer = threading.Thread(target=renew_lease, args=(job.id, stop))
+    renewer.start()
+    time.sleep(0.3)
+    stop.set()
+    renewer.join()
+
+    db.session.refresh(job)
+    assert job.heartbeat_at == heartbeat_at
+
+def create_test_spec(num_versions=3):
+    spec = services.test_spec_from_data({
+        'title': 'Background Test',
+        'difficulty': 'easy',
+        'topics': ['addition', 'fractions'],
+        'num_questions': 3,
+        'num_versions': num_versions,
+    }, generate_password_hash('secret', method='pbkdf2:sha256:1000'))
+    spec['uuid'] = str(uuid.uuid4())
+    return spec
+
+def test_a_template_is_hidden_until_it_is_built(app):
+    spec = create_test_spec()
+    url = f"/test-template/{spec['uuid']}"
+    client = app.test_client()
+    seen = []
+
+    def progress(done, total):
+        # Job progress commits the template part-way
+        db.session.commit()
+        seen.append(client.get(url).status_code)
+
+    with app.test_request_context():
+        template = create_test_template(spec, progress=progress)
+
+    assert seen == [404, 404, 404]
+    assert template.status == 'ready'
+    assert client.get(url).status_code == 200
+
+def test_a_half_built_template_is_built_again(app):
+    spec = create_test_spec()
+    # Left behind by a worker that died
+    db.session.add(models.TestTemplate(
+        uuid=spec['uuid'], title='Half Built', difficulty='easy', topics='addition',
+        num_questions=3, num_versions=3, password_hash=spec['password_hash'], status='building'
+    ))
+    db.session.commit()
+
+    job = enqueue_job('create_test', {'spec': spec, 'base_url': 'http://localhost/'})
+    run_worker(burst=True)
+    db.session.refresh(job)
+
+    assert job.status == 'done', job.error
+    template = models.TestTemplate.query.filter_by(uuid=spec['uuid']).one()
+    assert (template.title, template.status) == ('Background Test', 'ready')
+    assert len(template.test_versions) == 3
+
+def test_a_template_already_built_is_not_built_again(app):
+    spec = create_test_spec()
+    with app.test_request_context():
+        create_test_template(spec)
+
+    job = enqueue_job('create_test', {'spec': spec, 'base_url': 'http://localhost/'})
+    run_worker(burst=True)
+    db.session.refresh(job)
+
+    assert job.status == 'done', job.error
+    assert job.get_result()['template_uuid'] == spec['uuid']
+    assert models.TestTemplate.query.count() == 1
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import pytest
+
+from utils.answer_equivalence import canonicalize, is_correct, normalize_response
+from utils.math_generator import generate_question_from_template, generate_version_question
+from utils.multiple_choice import NONE_OF_THESE, NUM_CHOICES, build_choices, unpack_choices
+
+TOPICS = ['addition', 'subtraction', 'multiplication', 'division', 'fractions',
+          'decimals', 'percentages', 'algebra', 'geometry', 'statistics']
+
+@pytest.mark.parametrize('topic', TOPICS)
+@pytest.mark.parametrize('difficulty', ['easy', 'medium', 'hard'])
+def test_choices_are_distinct_and_only_one_is_right(topic, difficulty):
+    template = SimpleNamespace(id=7, question_type=topic, difficulty=difficulty, order=1)
+    for version_number in range(1, 41):
+        question = generate_version_question(template, version_number, multiple_choice=True)
+        choices = unpack_choices(question['answer'], question['choices'], question['answer_position'])
+        expected = canonicalize(question['answer'])
+
+        assert len(choices) == NUM_CHOICES
+        assert len({' '.join(choice.lower().split()) for choice in choices}) == NUM_CHOICES
+        assert 'None' not in choices
+        assert NONE_OF_THESE not in choices
+        right = [is_correct(expected, normalize_response(choice)) for choice in choices]
+        assert right.count(True) == 1
+        assert right.index(True) == question['answer_position']
+
+def test_normal_distribution_questions_have_three_real_distractors():
+    questions = [generate_question_from_template('statistics', 'hard', seed=seed) for seed in range(300)]
+    questions = [question for question in questions if 'normal distribution' in question['question']]
+
+    assert questions
+    for question in questions:
+        distractors = question['distractors']
+        assert None not in distractors
+        assert len(set(distractors)) == 3
+        assert question['answer'] not in distractors
+
+def test_missing_and_repeated_distractors_are_replaced():
+    distractors, position = build_choices('3/4', [None, '6/8', '1/2', '1/2', 0.75], seed=1)
+
+    assert len(distractors) == NUM_CHOICES - 1
+    assert '1/2' in distractors
+    assert len(set(distractors)) == len(distractors)
+    assert not any(is_correct(canonicalize('3/4'), normalize_response(choice)) for choice in distractors)
+    assert 0 <= position < NUM_CHOICES
+
+def test_a_text_answer_falls_back_to_none_of_these():
+    distractors, _ = build_choices('Yes', [], seed=1)
+
+    assert NONE_OF_THESE in distractors
@@ -0,0 +1,27 @@
+import pytest
+
+from commands import build_sample_test
+from utils.pdf_generator import generate_batch_test_pdf
+
+# Size budget of a batch PDF in the optimized output mode, per version of
+# SAMPLE_QUESTIONS questions; it was about 5600 bytes when set
+MAX_BYTES_PER_VERSION = 6500
+SAMPLE_VERSIONS = 100
+SAMPLE_QUESTIONS = 50
+
+@pytest.fixture(scope='module')
+def sample_test():
+    return build_sample_test(SAMPLE_VERSIONS, SAMPLE_QUESTIONS)
+
+def test_batch_pdf_stays_within_its_size_budget(app, sample_test):
+    template, versions = sample_test
+    size = len(generate_batch_test_pdf(template, versions).getvalue())
+
+    assert size / SAMPLE_VERSIONS <= MAX_BYTES_PER_VERSION
+
+def test_the_optimized_mode_is_what_keeps_it_small(app, sample_test):
+    template, versions = sample_test
+    optimized = len(generate_batch_test_pdf(template, versions).getvalue())
+    unoptimized = len(generate_batch_test_pdf(template, versions, optimize=False).getvalue())
+
+    assert unoptimized > 2 * optimized
@@ -0,0 +1,134 @@
+import io
+import json
+import re
+import zipfile
+
+import pytest
+
+import models
+from app import artifact_cache, db
+from jobs import run_worker
+from seating import plan_roster, write_roster
+from utils.pdf_version import PDF_RENDERER_VERSION
+
+ROSTER = 'Name,Seat\nAda Lovelace,\nGrace Hopper,\nAlan Turing,\n'
+
+def csrf_token(response):
+    return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', response.text).group(1)
+
+@pytest.fixture
+def template(make_template):
+    return make_template(num_versions=2, num_questions=3)
+
+@pytest.fixture
+def client(app, template):
+    """A client holding the template's unlock."""
+    client = app.test_client()
+    url = f'/test-template/{template.uuid}/unlock'
+    response = client.post(url, data={'csrf_token': csrf_token(client.get(url)), 'password': 'secret'})
+    assert response.status_code == 302
+    return client
+
+def upload(client, template, roster=ROSTER, output='zip', duplex=False):
+    url = f'/test-template/{template.uuid}/roster'
+    data = {
+        'csrf_token': csrf_token(client.get(url)),
+        'roster': (io.BytesIO(roster.encode()), 'class.csv'),
+        'output': output,
+    }
+    if duplex:
+        data['duplex'] = 'y'
+    return client.post(url, data=data, content_type='multipart/form-data')
+
+def count_pages(pdf):
+    return len(re.findall(rb'/Type /Page\b', pdf))
+
+def test_the_roster_is_for_whoever_holds_the_password(app, template):
+    response = app.test_client().get(f'/test-template/{template.uuid}/roster')
+
+    assert response.status_code == 302
+    assert f'/test-template/{template.uuid}/unlock' in response.location
+
+def test_the_names_stay_out_of_the_job(client, template):
+    response = upload(client, template)
+    assert response.status_code == 302
+
+    job = models.Job.query.one()
+    assert response.location.endswith(f'/jobs/{job.uuid}')
+    assert 'Ada' not in job.payload and 'Ada' not in job.key
+    payload = job.get_payload()
+    input_path = artifact_cache.path('roster-input', payload['artifact_key'], PDF_RENDERER_VERSION, extension='json')
+    assert json.loads(artifact_cache.get(input_path))['roster'] == ROSTER
+
+    run_worker(burst=True)
+    db.session.refresh(job)
+    assert job.status == 'done', job.error
+    # The names are removed with the job done
+    assert artifact_cache.get(input_path) is None
+
+def test_a_zip_has_a_test_for_every_student(client, template):
+    upload(client, template)
+    run_worker(burst=True)
+    response = client.get(models.Job.query.one().get_payload()['redirect_url'])
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert sorted(archive.namelist()) == [
+        'seating.csv',
+        'students/0001-Ada-Lovelace.pdf',
+        'students/0002-Grace-Hopper.pdf',
+        'students/0003-Alan-Turing.pdf',
+    ]
+    assert archive.read('students/0002-Grace-Hopper.pdf').startswith(b'%PDF')
+    seating = archive.read('seating.csv').decode().splitlines()
+    assert [line.split(',')[1:3] for line in seating[1:]] == [
+        ['Ada Lovelace', '1'], ['Grace Hopper', '2'], ['Alan Turing', '1']
+    ]
+
+def test_a_print_file_has_every_test_and_duplex_pads_them(app, template):
+    plan = plan_roster(template, ROSTER)
+    with app.test_request_context():
+        simplex, duplex = io.BytesIO(), io.BytesIO()
+        write_roster(template, plan, simplex, as_zip=False)
+        write_roster(template, plan, duplex, as_zip=False, duplex=True)
+
+    pages = count_pages(simplex.getvalue())
+    assert pages >= 3
+    assert count_pages(duplex.getvalue()) >= pages
+    assert count_pages(duplex.getvalue()) % 2 == 0
+
+def test_an_uploaded_print_file_is_served_once_printed(client, template):
+    upload(client, template, output='pdf', duplex=True)
+    run_worker(burst=True)
+    url = models.Job.query.one().get_payload()['redirect_url']
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    # The same upload again goes straight to the printed file
+    assert upload(client, template, output='pdf', duplex=True).location.endswith(url)
+    assert models.Job.query.count() == 1
+
+def test_a_roster_that_cannot_be_read_is_refused(client, template):
+    url = f'/test-template/{template.uuid}/roster'
+    data = {'csrf_token': csrf_token(client.get(url)), 'roster': (io.BytesIO(b'\xff\xfe\xfa'), 'class.csv')}
+    response = client.post(url, data=data, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert 'UTF-8' in response.text
+    assert models.Job.query.count() == 0
+
+def test_an_empty_roster_is_refused(client, template):
+    response = upload(client, template, roster='Name\n')
+
+    assert response.status_code == 200
+    assert 'no students' in response.text
+    assert models.Job.query.count() == 0
+
+def test_a_printed_roster_that_is_gone_must_be_uploaded_again(client, template):
+    url = f'/test-template/{template.uuid}/roster'
+
+    assert client.get(f'{url}/0123456789abcdef.zip').location.endswith(url)
+    assert client.get(f'{url}/not-a-key.zip').status_code == 404
+    assert client.get(f'{url}/0123456789abcdef.exe').status_code == 404
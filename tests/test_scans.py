@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+import models
+from models import Question, Submission
+from scans import find_scans, grade_scans
+from utils.bubble_sheet import grid_answer, read_scan
+
+def make_scans(app, folder, multiple_choice=False):
+    """Write a scan fixture (see `flask make-scan-fixture`) and return its expected.json."""
+    args = ['make-scan-fixture', str(folder), '--students', '3', '--versions', '2', '--questions', '30']
+    result = app.test_cli_runner().invoke(args=args + (['--multiple-choice'] if multiple_choice else []))
+    assert result.exit_code == 0, result.output
+    with open(os.path.join(folder, 'expected.json')) as f:
+        return json.load(f)
+
+@pytest.mark.parametrize('multiple_choice', [False, True])
+def test_pages_read_as_filled_in(app, tmp_path, multiple_choice):
+    expected = make_scans(app, tmp_path, multiple_choice)
+    paths = find_scans(tmp_path)
+    assert len(paths) == len(expected['pages']) > 3
+
+    for path in paths:
+        reading = read_scan(path)
+        page = expected['pages'][os.path.basename(path)]
+        assert reading['error'] is None
+        assert (reading['access_code'], reading['page']) == (page['access_code'], page['page'])
+        assert {str(number): answer for number, answer in reading['answers'].items()} == page['answers']
+        assert reading['ambiguous'] == []
+
+def test_scanned_sheets_are_graded_and_stored_once(app, tmp_path):
+    expected = make_scans(app, tmp_path)
+    template = models.TestTemplate.query.filter_by(uuid=expected['template_uuid']).one()
+    readings = [read_scan(path) for path in find_scans(tmp_path)]
+
+    sheets = grade_scans(readings)
+    assert len(sheets) == 3
+    for sheet in sheets:
+        assert sheet['error'] is None
+        assert sheet['total'] == template.num_questions
+        version = next(version for version in template.test_versions if version.uuid == sheet['version_uuid'])
+        answers = {question.order: question.answer for question in Question.query.filter_by(test_version_id=version.id)}
+        # Answers gridded as stored are right; the fixture fills in the rest at random
+        for number, answer in sheet['answers'].items():
+            if answer == grid_answer(answers[number]):
+                assert sheet['correct'][number]
+        assert sheet['score'] == sum(sheet['correct'].values())
+    assert Submission.query.count() == 3
+
+    grade_scans(readings)
+    assert Submission.query.count() == 3
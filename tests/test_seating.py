@@ -0,0 +1,112 @@
+import json
+from collections import Counter
+
+import pytest
+
+from seating import plan_roster
+from utils.seating import assign_versions, parse_adjacency, parse_grid, parse_roster, row_name, seat_students
+
+def neighbour_pairs(neighbours):
+    return {frozenset((seat, other)) for seat, others in neighbours.items() for other in others}
+
+def test_rows_are_named_like_spreadsheet_columns():
+    assert [row_name(row) for row in (0, 1, 25, 26, 27, 701, 702)] == ['A', 'B', 'Z', 'AA', 'AB', 'ZZ', 'AAA']
+
+def test_a_grid_names_seats_by_row_and_place():
+    seats, neighbours, positions = parse_grid('xx.x\nxxxx\n')
+
+    assert seats == ['A1', 'A2', 'A4', 'B1', 'B2', 'B3', 'B4']
+    assert positions['A4'] == (0, 3)
+    assert neighbours['A1'] == {'A2', 'B1', 'B2'}
+    # The aisle separates A2 and A4
+    assert neighbours['A4'] == {'B3', 'B4'}
+
+def test_diagonal_neighbours_are_optional():
+    _, neighbours, _ = parse_grid('xx\nxx', diagonal=False)
+
+    assert neighbours['A1'] == {'A2', 'B1'}
+
+def test_an_adjacency_list_is_mutual():
+    seats, neighbours, positions = parse_adjacency('{"front": ["left", "right"], "left": ["right"]}')
+
+    assert seats == ['front', 'left', 'right']
+    assert neighbours['right'] == {'front', 'left'}
+    assert positions is None
+    with pytest.raises(ValueError):
+        parse_adjacency('["front", "left"]')
+
+def test_a_roster_is_names_or_csv():
+    assert parse_roster('Ada\n\nGrace \n') == [('Ada', None), ('Grace', None)]
+    assert parse_roster('Name,Seat\nAda,B2\nGrace,\n') == [('Ada', 'B2'), ('Grace', None)]
+
+def test_students_keep_their_seats_and_the_rest_fill_in():
+    seats = ['A1', 'A2', 'A3']
+
+    assert seat_students(seats, [('Ada', None), ('Grace', 'A1'), ('Alan', None)]) == {
+        'A1': 'Grace', 'A2': 'Ada', 'A3': 'Alan'
+    }
+    with pytest.raises(ValueError, match='not in the room'):
+        seat_students(seats, [('Ada', 'Z9')])
+    with pytest.raises(ValueError, match='both seated'):
+        seat_students(seats, [('Ada', 'A1'), ('Grace', 'A1')])
+    with pytest.raises(ValueError, match='3 seats for 4 students'):
+        seat_students(seats, [(name, None) for name in 'abcd'])
+
+def test_four_versions_separate_every_neighbour_and_are_used_evenly():
+    seats, neighbours, _ = parse_grid('\n'.join(['xxxxxxxx'] * 6))
+    versions, clashes, shared = assign_versions(seats, neighbours, 4)
+
+    assert clashes == []
+    assert shared == []
+    assert all(versions[seat] != versions[other] for seat, other in neighbour_pairs(neighbours))
+    assert sorted(Counter(versions.values()).values()) == [12, 12, 12, 12]
+
+def test_two_versions_color_a_bipartite_room():
+    # An even cycle listed out of order; DSATUR colors bipartite graphs exactly
+    room = {'a': ['d', 'f'], 'b': ['c', 'e'], 'c': ['f'], 'd': ['e']}
+    seats, neighbours, _ = parse_adjacency(json.dumps(room))
+    versions, clashes, _ = assign_versions(seats, neighbours, 2)
+
+    assert clashes == []
+    assert len(set(versions.values())) == 2
+
+def test_too_few_versions_report_the_clashes():
+    seats, neighbours, _ = parse_grid('xxx\nxxx\nxxx')
+    versions, clashes, _ = assign_versions(seats, neighbours, 2)
+
+    assert clashes
+    for seat, other in clashes:
+        assert other in neighbours[seat]
+        assert versions[seat] == versions[other]
+
+def test_neighbours_avoid_versions_that_share_questions():
+    seats, neighbours, _ = parse_grid('xxx', diagonal=False)
+    # Versions 1 and 2 share questions; 3 shares none
+    overlap = [[0, 4, 0], [4, 0, 0], [0, 0, 0]]
+    versions, clashes, shared = assign_versions(seats, neighbours, 3, overlap)
+
+    assert clashes == []
+    assert shared == []
+    assert {versions['A1'], versions['A2']} != {0, 1}
+    assert {versions['A2'], versions['A3']} != {0, 1}
+
+def test_there_must_be_a_version_to_hand_out():
+    with pytest.raises(ValueError):
+        assign_versions(['A1'], {'A1': set()}, 0)
+
+def test_without_a_room_versions_are_handed_out_in_turn(make_template):
+    template = make_template(num_versions=2, num_questions=3)
+    plan = plan_roster(template, 'Ada\nGrace\nAlan\n')
+
+    assert [row['student'] for row in plan['seats']] == ['Ada', 'Grace', 'Alan']
+    assert [row['version_number'] for row in plan['seats']] == [1, 2, 1]
+    assert all(row['seat'] is None for row in plan['seats'])
+    with pytest.raises(ValueError):
+        plan_roster(template, '\n')
+
+def test_with_a_room_only_the_students_are_listed(make_template):
+    template = make_template(num_versions=4, num_questions=3)
+    plan = plan_roster(template, 'Name,Seat\nAda,B2\nGrace,\n', 'xxx\nxxx')
+
+    assert {row['seat']: row['student'] for row in plan['seats']} == {'B2': 'Ada', 'A1': 'Grace'}
+    assert plan['clashes'] == []
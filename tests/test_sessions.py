@@ -0,0 +1,89 @@
+import re
+import secrets
+
+import pytest
+
+from app import app as flask_app, db
+from models import SessionRecord
+from utils.server_session import DatabaseSessionStore, FileSessionStore, ServerSessionInterface
+
+@pytest.fixture(params=['filesystem', 'database'])
+def store(request, app, tmp_path, monkeypatch):
+    """Server-side sessions for the app, in each kind of store."""
+    if request.param == 'filesystem':
+        store = FileSessionStore(str(tmp_path / 'sessions'))
+    else:
+        store = DatabaseSessionStore(db, SessionRecord)
+    monkeypatch.setattr(flask_app, 'session_interface', ServerSessionInterface(store, 3600))
+    return store
+
+@pytest.fixture
+def client_for_store(store):
+    return flask_app.test_client(), store
+
+@pytest.fixture
+def template(make_template):
+    return make_template(password='secret')
+
+def session_id(client):
+    cookie = client.get_cookie(flask_app.config['SESSION_COOKIE_NAME'])
+    return cookie.value if cookie else None
+
+def open_unlock_page(client, template):
+    """Load the unlock page, which starts a session; returns its CSRF token."""
+    response = client.get(f'/test-template/{template.uuid}/unlock')
+    assert response.status_code == 200
+    return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', response.text).group(1)
+
+@pytest.mark.parametrize('sid', ['../../../etc/passwd', '..', 'a/b', 'short', 'x' * 65, ''])
+def test_the_file_store_refuses_ids_that_are_not_tokens(tmp_path, sid):
+    store = FileSessionStore(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        store.load(sid)
+    with pytest.raises(ValueError):
+        store.save(sid, '{}', None)
+
+@pytest.mark.parametrize('forged', ['../../../etc/passwd', '..%2F..%2Fsessions', 'not a token'])
+def test_a_forged_session_id_is_ignored(client_for_store, template, forged):
+    client, store = client_for_store
+    client.set_cookie(flask_app.config['SESSION_COOKIE_NAME'], forged)
+
+    open_unlock_page(client, template)
+    sid = session_id(client)
+    assert sid != forged
+    assert store.load(sid) is not None
+
+def test_an_unknown_session_id_is_not_adopted(client_for_store, template):
+    client, store = client_for_store
+    planted = secrets.token_urlsafe(32)
+    client.set_cookie(flask_app.config['SESSION_COOKIE_NAME'], planted)
+
+    open_unlock_page(client, template)
+    assert session_id(client) != planted
+    assert store.load(planted) is None
+
+def test_unlocking_moves_the_session_to_a_new_id(client_for_store, template):
+    client, store = client_for_store
+    csrf_token = open_unlock_page(client, template)
+    before = session_id(client)
+    assert store.load(before) is not None
+
+    response = client.post(f'/test-template/{template.uuid}/unlock',
+                           data={'csrf_token': csrf_token, 'password': 'secret'})
+    assert response.status_code == 302
+    after = session_id(client)
+    assert after != before
+    assert store.load(before) is None
+    assert store.load(after) is not None
+    # The grant moved with the session
+    response = client.get(f'/test-template/{template.uuid}/unlock')
+    assert response.status_code == 302
+
+def test_a_wrong_password_keeps_the_session_id(client_for_store, template):
+    client, store = client_for_store
+    csrf_token = open_unlock_page(client, template)
+    before = session_id(client)
+
+    client.post(f'/test-template/{template.uuid}/unlock', data={'csrf_token': csrf_token, 'password': 'wrong'})
+    assert session_id(client) == before
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+# Libraries that must load on first use rather than when the app is imported
+LAZY_MODULES = ('reportlab', 'sympy', 'qrcode', 'numpy', 'PIL')
+
+# Import time budget of the app, fastest of IMPORT_RUNS runs
+MAX_IMPORT_MS = 1000
+IMPORT_RUNS = 3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_app():
+    """Import the app in a fresh interpreter; returns (milliseconds, heavy modules it loaded)."""
+    script = f"import sys, app; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script], cwd=ROOT, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    # Lines look like "import time:  self [us] | cumulative | <indent>name"
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if name.rstrip() == ' app':
+                return int(cumulative) / 1000, [m for m in result.stdout.strip().split(',') if m]
+    raise AssertionError("importtime did not report the app")
+
+def test_heavy_libraries_are_not_imported_at_startup():
+    _, eager = import_app()
+
+    assert eager == []
+
+def test_the_app_imports_within_its_budget():
+    fastest = min(import_app()[0] for _ in range(IMPORT_RUNS))
+
+    assert fastest <= MAX_IMPORT_MS
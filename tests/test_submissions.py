@@ -0,0 +1,132 @@
+import json
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+import submissions
+from app import db
+from grading import _increment
+from models import QuestionStats, Submission, SubmittedAnswer, VersionStats
+from submissions import SubmissionBuffer, read_dead_letters, submit_answers
+
+@pytest.fixture
+def version(make_template):
+    return make_template(num_versions=1, num_questions=3).test_versions[0]
+
+@pytest.fixture
+def buffer(tmp_path):
+    # The writer thread never gets to flush on its own; the tests flush
+    return SubmissionBuffer(1000, 3600, max_attempts=2, dead_letter_path=str(tmp_path / 'failed.jsonl'))
+
+def make_record(version, key=None, student_name='Ada'):
+    questions = sorted(version.questions, key=lambda question: question.order)
+    return {
+        'uuid': str(uuid.uuid4()),
+        'key': key or uuid.uuid4().hex,
+        'test_version_id': version.id,
+        'student_name': student_name,
+        'submitted_at': datetime.utcnow(),
+        'answers': [(questions[0].id, questions[0].answer)],
+    }
+
+def test_a_buffered_submission_is_written_on_flush(app, version, buffer):
+    record = make_record(version)
+    assert buffer.add(record)
+    assert buffer.get(record['key']) is record
+    assert Submission.query.count() == 0
+
+    assert buffer.flush() == 1
+    assert buffer.get(record['key']) is None
+    submission = Submission.query.filter_by(key=record['key']).one()
+    assert submission.student_name == 'Ada'
+    assert SubmittedAnswer.query.filter_by(submission_id=submission.id).count() == 1
+
+def test_a_key_is_buffered_once(app, version, buffer):
+    record = make_record(version, key='double-click')
+    assert buffer.add(record)
+    assert not buffer.add(make_record(version, key='double-click'))
+
+    assert buffer.flush() == 1
+
+def test_a_stored_key_is_not_written_again(app, version, buffer):
+    buffer.add(make_record(version, key='retry'))
+    buffer.flush()
+
+    assert buffer.add(make_record(version, key='retry'))
+    assert buffer.flush() == 0
+    assert Submission.query.filter_by(key='retry').count() == 1
+
+def test_a_bad_record_does_not_hold_up_the_others(app, version, buffer):
+    good = [make_record(version) for _ in range(3)]
+    bad = make_record(version, student_name=['not', 'text'])
+    for record in good[:1] + [bad] + good[1:]:
+        buffer.add(record)
+
+    assert buffer.flush() == 3
+    assert Submission.query.count() == 3
+    # The bad one waits out its retry delay in the buffer
+    assert buffer.get(bad['key']) is bad
+    assert buffer.flush() == 0
+    assert bad['attempts'] == 1
+
+def test_a_record_that_keeps_failing_is_set_aside(app, version, buffer, monkeypatch):
+    monkeypatch.setattr(submissions, 'MAX_RETRY_DELAY', 0)
+    bad = make_record(version, student_name=['not', 'text'])
+    buffer.add(bad)
+
+    buffer.flush()
+    assert buffer.get(bad['key']) is bad
+    buffer.flush()
+    assert buffer.get(bad['key']) is None
+
+    [line] = open(buffer.dead_letter_path).read().splitlines()
+    assert json.loads(line)['error']
+    [record] = read_dead_letters(buffer.dead_letter_path)
+    assert record['key'] == bad['key']
+    assert record['submitted_at'] == bad['submitted_at']
+    assert record['answers'] == bad['answers']
+
+def test_submissions_with_the_wrong_types_are_refused(app, version):
+    answers = {1: '3'}
+    assert submit_answers(version.uuid, 123, 'Ada', answers)[1] is not None
+    assert submit_answers(version.uuid, 'key', ['Ada'], answers)[1] is not None
+    assert submit_answers(version.uuid, 'key', 'Ada', {1: ['3']})[1] is not None
+    assert submit_answers(version.uuid, 'key', 'Ada', {99: '3'})[1] is not None
+
+def test_a_record_the_database_refuses_is_not_dropped(app, version, buffer, monkeypatch):
+    monkeypatch.setattr(submissions, 'MAX_RETRY_DELAY', 0)
+    # Violates a constraint without being a duplicate key
+    bad = dict(make_record(version), test_version_id=None)
+    buffer.add(bad)
+
+    assert buffer.flush() == 0
+    assert buffer.get(bad['key']) is bad
+    buffer.flush()
+    [record] = read_dead_letters(buffer.dead_letter_path)
+    assert record['key'] == bad['key']
+
+def test_written_submissions_add_to_the_totals(app, version, buffer):
+    for _ in range(2):
+        buffer.add(make_record(version))
+        buffer.flush()
+
+    question = min(version.questions, key=lambda question: question.order)
+    assert VersionStats.query.filter_by(test_version_id=version.id).one().submissions == 2
+    stats = QuestionStats.query.filter_by(question_id=question.id).one()
+    assert (stats.answered, stats.correct) == (2, 2)
+
+def test_totals_add_to_existing_rows_and_insert_new_ones(app, version):
+    question_ids = sorted(question.id for question in version.questions)
+    # e.g. inserted by another worker
+    db.session.add(QuestionStats(question_id=question_ids[0], answered=5, correct=1))
+    db.session.flush()
+
+    _increment(QuestionStats.__table__, ('question_id',), [
+        {'question_id': question_id, 'answered': 1, 'correct': 1} for question_id in question_ids
+    ])
+    db.session.commit()
+
+    totals = dict(db.session.execute(select(QuestionStats.question_id, QuestionStats.answered)).all())
+    assert totals == {question_ids[0]: 6, **{question_id: 1 for question_id in question_ids[1:]}}
@@ -0,0 +1,73 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from werkzeug.security import generate_password_hash
+
+from app import app as flask_app, db
+from models import UnlockThrottle
+from services import record_unlock_failure, verify_template_password
+
+def make_template():
+    return SimpleNamespace(
+        uuid=str(uuid.uuid4()), password_hash=generate_password_hash('secret', method='pbkdf2:sha256:1000')
+    )
+
+def test_the_right_password_unlocks(app):
+    template = make_template()
+
+    assert verify_template_password(template, 'secret') == (True, 0)
+    assert verify_template_password(template, 'wrong') == (False, 0)
+
+def test_too_many_failures_lock_the_template_out(app):
+    template = make_template()
+    for _ in range(app.config['UNLOCK_MAX_FAILURES']):
+        assert verify_template_password(template, 'wrong') == (False, 0)
+
+    correct, retry_after = verify_template_password(template, 'secret')
+    assert not correct
+    assert 0 < retry_after <= app.config['UNLOCK_LOCKOUT']
+
+def test_failures_outside_the_window_start_a_new_count(app):
+    template = make_template()
+    now = datetime.utcnow()
+    for _ in range(app.config['UNLOCK_MAX_FAILURES'] - 1):
+        record_unlock_failure(template.uuid, now)
+
+    later = now + timedelta(seconds=app.config['UNLOCK_FAILURE_WINDOW'] + 1)
+    assert record_unlock_failure(template.uuid, later) == 1
+    assert verify_template_password(template, 'secret') == (True, 0)
+
+def test_the_right_password_clears_the_count(app):
+    template = make_template()
+    verify_template_password(template, 'wrong')
+    verify_template_password(template, 'secret')
+
+    assert UnlockThrottle.query.filter_by(template_uuid=template.uuid).count() == 0
+
+def test_concurrent_failures_are_all_counted(app):
+    template = make_template()
+    now = datetime.utcnow()
+    counts = []
+    errors = []
+    start = threading.Barrier(4)
+
+    def guess():
+        try:
+            with flask_app.app_context():
+                start.wait()
+                counts.append(record_unlock_failure(template.uuid, now))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=guess) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(counts) == [1, 2, 3, 4]
+    db.session.expire_all()
+    assert UnlockThrottle.query.filter_by(template_uuid=template.uuid).one().failures == 4
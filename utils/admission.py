@@ -0,0 +1,157 @@
+import fcntl
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from utils.metrics import ADMISSION_DECISIONS, ADMISSION_IN_FLIGHT, ADMISSION_WAIT_SECONDS
+
+# How often a queued request tries again for a slot
+POLL_INTERVAL = 0.02
+
+# Lock files this process holds. A forked child (a render pool worker) would
+# otherwise share the locks and keep them alive if this process died.
+_held = set()
+
+def _close_inherited():
+    for fd in _held:
+        os.close(fd)
+    _held.clear()
+
+os.register_at_fork(after_in_child=_close_inherited)
+
+class AdmissionGate:
+    """
+    Concurrency limit for one class of expensive endpoints.
+
+    At most `limit` requests run at once. Up to `queue_size` more wait for a
+    slot for at most `timeout` seconds; anything beyond that is rejected
+    straight away with 503 and a Retry-After header, so an overloaded server
+    answers quickly instead of piling up work it cannot finish.
+
+    Slots and places in the queue are exclusive flocks on files in
+    `directory`, so the limits hold across all processes and threads that
+    share the directory. The kernel drops a lock when its holder dies, so a
+    worker killed mid-request (timeout, OOM, SIGKILL) cannot leak a slot.
+    """
+
+    def __init__(self, name, limit, queue_size=0, timeout=0.0, retry_after=None, directory=None):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after or max(1, math.ceil(timeout))
+        os.makedirs(directory, exist_ok=True)
+        self._slot_paths = [os.path.join(directory, f"{name}-slot-{i}.lock") for i in range(limit)]
+        self._queue_paths = [os.path.join(directory, f"{name}-queue-{i}.lock") for i in range(queue_size)]
+
+    @staticmethod
+    def _try_lock(paths):
+        """Lock the first free file of paths; return its descriptor, or None if all are taken."""
+        for path in paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            _held.add(fd)
+            return fd
+        return None
+
+    @staticmethod
+    def _unlock(fd):
+        _held.discard(fd)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if there is room; return the held slot lock, or None."""
+        fd = self._try_lock(self._slot_paths)
+        if fd is not None:
+            ADMISSION_DECISIONS.inc(gate=self.name, outcome='admitted')
+            ADMISSION_IN_FLIGHT.inc(gate=self.name)
+            return fd
+
+        place = self._try_lock(self._queue_paths)
+        if place is None:
+            ADMISSION_DECISIONS.inc(gate=self.name, outcome='rejected')
+            return None
+
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        try:
+            while fd is None and time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                fd = self._try_lock(self._slot_paths)
+        finally:
+            self._unlock(place)
+
+        if fd is None:
+            ADMISSION_DECISIONS.inc(gate=self.name, outcome='timeout')
+            return None
+        ADMISSION_DECISIONS.inc(gate=self.name, outcome='queued')
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, gate=self.name)
+        ADMISSION_IN_FLIGHT.inc(gate=self.name)
+        return fd
+
+    def release(self, fd):
+        ADMISSION_IN_FLIGHT.dec(gate=self.name)
+        self._unlock(fd)
+
+    def enter(self):
+        """Take a slot or raise ServiceUnavailable; returns the Slot to release."""
+        fd = self.acquire()
+        if fd is None:
+            raise ServiceUnavailable(
+                f"The server is busy with other {self.name} requests. Please try again shortly.",
+                retry_after=self.retry_after
+            )
+        return Slot(self, fd)
+
+    @contextmanager
+    def admit(self):
+        """Run the block in a slot, raising ServiceUnavailable when overloaded."""
+        slot = self.enter()
+        try:
+            yield
+        finally:
+            slot.release()
+
+    def run(self, func, *args, **kwargs):
+        """Call func in a slot, raising ServiceUnavailable when overloaded."""
+        with self.admit():
+            return func(*args, **kwargs)
+
+class Slot:
+    """A taken gate slot; releasing it more than once is harmless."""
+
+    def __init__(self, gate, fd):
+        self.gate = gate
+        self.fd = fd
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.gate.release(self.fd)
+
+def create_gates(config, directory):
+    """
+    Build the admission gates from configuration.
+
+    Args:
+        config (dict): Gate name -> dict with limit, queue_size and timeout
+        directory (str): Directory of the slot lock files, shared by every
+            process the limits apply to
+
+    Returns:
+        dict: Gate name -> AdmissionGate
+    """
+    return {name: AdmissionGate(name, directory=directory, **options) for name, options in config.items()}
@@ -0,0 +1,317 @@
+import ast
+import json
+import math
+import re
+from collections import namedtuple
+from fractions import Fraction
+from functools import lru_cache
+
+# A number in an answer. places is the number of decimal places it was
+# written with, or None for integers, fractions and expressions; approximate
+# marks irrational values (square roots, pi) and float reprs with more
+# digits than anyone writes down.
+Value = namedtuple('Value', 'number places approximate')
+
+# Canonical form of an answer:
+#   kind    'number', 'set' (unordered list, e.g. roots), 'list' (a
+#           response's unbracketed list, in the order typed), 'tuple'
+#           (ordered, e.g. a point), 'vars' (x = 1, y = -2) or 'text'
+#   values  tuple of Value; sets are sorted by value and vars by name
+#   names   variable names of 'vars' answers, otherwise ()
+#   text    the normalized answer text, compared for 'text' answers
+Answer = namedtuple('Answer', 'kind values names text')
+
+# Stored decimals with more places than this are float reprs (2.3333333333333335)
+MAX_EXACT_PLACES = 6
+
+# Responses to irrational answers must be given to at least this many places
+MIN_APPROXIMATE_PLACES = 2
+
+# Relative tolerance for comparing irrational values computed two ways
+TOLERANCE = Fraction(1, 10 ** 9)
+
+# Memoized normalizations of student responses
+RESPONSE_CACHE_SIZE = 65536
+
+# Bound on exponents in responses, so 9^9^9 cannot stall a grading run
+MAX_EXPONENT = 12
+
+# Bound on the size of numbers in responses, in bits of numerator or
+# denominator: far beyond any answer, and cheap to compute with
+MAX_NUMBER_BITS = 4096
+
+_ASSIGNMENT = re.compile(r'^([a-z][a-z0-9_]*)\s*=\s*(.+)$')
+_DECIMAL = re.compile(r'^[+-]?(\d*)\.(\d+)$')
+_THOUSANDS = re.compile(r'^[+-]?\d{1,3}(,\d{3})+(\.\d+)?$')
+_UNIT_SUFFIX = re.compile(r'^(.*?[\d)π])\s*([a-z%°²³][a-z%°²³.\s]*)$')
+_LIST_SEPARATOR = re.compile(r'\s*(?:,|;|\bor\b|\band\b)\s*')
+_IMPLICIT_PRODUCT = re.compile(r'(\d|\))\s*(?=sqrt|pi|\()')
+_SYMBOLS = str.maketrans({'−': '-', '–': '-', '×': '*', '·': '*', '÷': '/'})
+
+def canonicalize(answer):
+    """
+    Parse a stored answer into its canonical form.
+
+    Unbracketed lists ("-2, 3", roots and other answers with several
+    values) are unordered; bracketed ones ("(2, 3)") are ordered.
+
+    Args:
+        answer (str): Answer as generated, e.g. "3/4", "x = 1, y = -2" or
+            "-1/2 + sqrt(5)/2, -sqrt(5)/2 - 1/2"
+
+    Returns:
+        Answer: The canonical form
+    """
+    parsed = _parse(answer, stored=True)
+    if parsed.kind == 'list':
+        return parsed._replace(kind='set', values=tuple(sorted(parsed.values, key=lambda value: value.number)))
+    return parsed
+
+@lru_cache(maxsize=RESPONSE_CACHE_SIZE)
+def normalize_response(response):
+    """
+    Parse a student response into its canonical form.
+
+    Memoized: a class gives the same (often wrong) responses many times.
+    Besides the forms stored answers take, responses may use x^2, √5, ×,
+    implicit products (2sqrt(3)), "or"/"and" between values, "x = 3" for a
+    single value, thousands separators and trailing units.
+
+    Returns:
+        Answer: The canonical form; kind 'text' when it does not parse
+    """
+    return _parse(response, stored=False)
+
+def is_correct(expected, response):
+    """
+    Compare a canonical stored answer with a normalized response.
+
+    Constant time for the answers tests contain: one comparison per value,
+    and answers have at most a couple of values.
+
+    Args:
+        expected (Answer): Canonical stored answer (see canonicalize)
+        response (Answer): Normalized response (see normalize_response)
+
+    Returns:
+        bool: Whether the response is equivalent to the answer
+    """
+    if expected.kind == 'text' or response.kind == 'text':
+        return expected.text == response.text
+
+    values = response.values
+    # Names only matter when both name their values; "x = 3" answers "3"
+    if expected.kind == 'vars' and response.kind == 'vars' and response.names != expected.names:
+        return False
+
+    if len(values) != len(expected.values):
+        return False
+    if expected.kind == 'set':
+        values = sorted(values, key=lambda value: value.number)
+    return all(_value_matches(e, v) for e, v in zip(expected.values, values))
+
+def grade(expected_answers, responses):
+    """
+    Grade a batch of responses, e.g. a whole class.
+
+    Args:
+        expected_answers (dict): Key (e.g. question id) to canonical Answer
+        responses (list): One dict per student of key to response text;
+            keys without an expected answer are ignored
+
+    Returns:
+        list: One dict per student of key to bool, covering every expected
+            answer (unanswered ones are incorrect)
+    """
+    results = []
+    for student_responses in responses:
+        results.append({
+            key: bool(student_responses.get(key)) and is_correct(expected, normalize_response(student_responses[key]))
+            for key, expected in expected_answers.items()
+        })
+    return results
+
+def dumps(answer):
+    """Serialize a canonical Answer to JSON for storage."""
+    return json.dumps({
+        'kind': answer.kind,
+        'values': [[str(value.number), value.places, value.approximate] for value in answer.values],
+        'names': list(answer.names),
+        'text': answer.text,
+    }, separators=(',', ':'))
+
+@lru_cache(maxsize=RESPONSE_CACHE_SIZE)
+def loads(data):
+    """Deserialize a stored canonical Answer; memoized, as Answers are immutable."""
+    data = json.loads(data)
+    return Answer(
+        data['kind'],
+        tuple(Value(Fraction(number), places, approximate) for number, places, approximate in data['values']),
+        tuple(data['names']),
+        data['text'],
+    )
+
+def _value_matches(expected, given):
+    if expected.approximate:
+        if given.places is None or given.approximate:
+            return _close(expected.number, given.number)
+        return given.places >= MIN_APPROXIMATE_PLACES and _round(expected.number, given.places) == given.number
+    if given.approximate and expected.places is None:
+        return _close(expected.number, given.number)
+    if expected.places is None or (given.places is not None and given.places <= expected.places):
+        return expected.number == given.number
+    # Accept a more precise value (or an expression like 16pi) that rounds to the stored answer
+    return _round(given.number, expected.places) == expected.number
+
+def _close(a, b):
+    return abs(a - b) <= TOLERANCE * max(1, abs(a))
+
+def _round(number, places):
+    """Round half away from zero, as answers are rounded by hand."""
+    scale = 10 ** places
+    rounded = Fraction(math.floor(abs(number) * scale + Fraction(1, 2)), scale)
+    return rounded if number >= 0 else -rounded
+
+def _normalize_text(text):
+    return ' '.join(str(text).lower().translate(_SYMBOLS).split())
+
+def _parse(text, stored):
+    normalized = _normalize_text(text)
+    try:
+        return _parse_values(normalized, stored)
+    except (ValueError, ZeroDivisionError, OverflowError, SyntaxError, RecursionError):
+        return Answer('text', (), (), normalized)
+
+def _parse_values(text, stored):
+    text = text.replace('$', '').strip()
+    if _THOUSANDS.match(text):
+        text = text.replace(',', '')
+
+    kind = 'list'
+    if text.startswith('(') and text.endswith(')') and _closing_paren(text, 0) == len(text) - 1:
+        items = _split(text[1:-1])
+        if len(items) > 1:
+            kind = 'tuple'
+        else:
+            items = [text]
+    else:
+        items = _split(text)
+    if not items or not all(items):
+        raise ValueError(text)
+
+    names = []
+    values = []
+    for item in items:
+        match = _ASSIGNMENT.match(item)
+        if match:
+            names.append(match.group(1))
+            item = match.group(2)
+        values.append(_parse_value(item, stored))
+
+    if names:
+        if len(names) != len(items) or kind == 'tuple':
+            raise ValueError(text)
+        if len(set(names)) == len(names):
+            pairs = sorted(zip(names, values))
+            return Answer('vars', tuple(value for _, value in pairs), tuple(name for name, _ in pairs), text)
+        # "x = -2 or x = 3": the values of one variable
+        if len(set(names)) > 1:
+            raise ValueError(text)
+        return Answer('vars', tuple(values), tuple(names), text)
+    if len(values) == 1:
+        return Answer('number', tuple(values), (), text)
+    return Answer(kind, tuple(values), (), text)
+
+def _split(text):
+    """Split on top-level list separators (commas inside sqrt(...) do not count)."""
+    items = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif depth == 0:
+            match = _LIST_SEPARATOR.match(text, i)
+            if match and match.end() > i and (char in ',;' or text[i].isalpha()):
+                items.append(text[start:i].strip())
+                start = i = match.end()
+                continue
+        i += 1
+    items.append(text[start:].strip())
+    return items
+
+def _closing_paren(text, start):
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def _parse_value(text, stored):
+    text = text.rstrip('%°').strip()
+    match = _UNIT_SUFFIX.match(text)
+    if match and 'pi' not in match.group(2).split():
+        text = match.group(1)
+
+    match = _DECIMAL.match(text)
+    if match:
+        number = Fraction(text)
+        places = len(match.group(2))
+        if stored:
+            # Stored answers are str(float): "12.0" is exact and "2.3333333333333335" is not
+            places = len(match.group(2).rstrip('0'))
+            if places > MAX_EXACT_PLACES:
+                return Value(number, None, True)
+        return Value(number, places or None, False)
+
+    expression = _IMPLICIT_PRODUCT.sub(r'\1*', text.replace('√', 'sqrt').replace('π', 'pi'))
+    expression = re.sub(r'sqrt\s*(\d+(?:\.\d+)?)', r'sqrt(\1)', expression).replace('^', '**')
+    number, approximate = _evaluate(ast.parse(expression, mode='eval').body)
+    return Value(number, None, approximate)
+
+def _evaluate(node):
+    """Evaluate an arithmetic expression tree to (Fraction, approximate)."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        return Fraction(repr(node.value)), False
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        number, approximate = _evaluate(node.operand)
+        return (-number if isinstance(node.op, ast.USub) else number), approximate
+    if isinstance(node, ast.Name) and node.id == 'pi':
+        return Fraction(math.pi), True
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'sqrt' \
+            and len(node.args) == 1 and not node.keywords:
+        number, approximate = _evaluate(node.args[0])
+        if number < 0:
+            raise ValueError('square root of a negative number')
+        numerator, denominator = math.isqrt(number.numerator), math.isqrt(number.denominator)
+        if not approximate and numerator ** 2 == number.numerator and denominator ** 2 == number.denominator:
+            return Fraction(numerator, denominator), False
+        return Fraction(math.sqrt(number)), True
+    if isinstance(node, ast.BinOp):
+        left, left_approximate = _evaluate(node.left)
+        right, right_approximate = _evaluate(node.right)
+        approximate = left_approximate or right_approximate
+        if isinstance(node.op, ast.Add):
+            return left + right, approximate
+        if isinstance(node.op, ast.Sub):
+            return left - right, approximate
+        if isinstance(node.op, ast.Mult):
+            return left * right, approximate
+        if isinstance(node.op, ast.Div):
+            return left / right, approximate
+        if isinstance(node.op, ast.Pow):
+            if right.denominator != 1 or abs(right) > MAX_EXPONENT:
+                raise ValueError('unsupported exponent')
+            # Nested powers multiply exponents, so bound the result, not just each exponent
+            if max(left.numerator, left.denominator).bit_length() * abs(right) > MAX_NUMBER_BITS:
+                raise ValueError('number too large')
+            return left ** int(right), approximate
+    raise ValueError(f'unsupported expression: {ast.dump(node)}')
@@ -0,0 +1,67 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+class ArtifactCache:
+    """
+    On-disk cache for rendered artifacts (PDFs) of immutable test versions.
+
+    Test versions never change after creation, so an artifact is keyed by
+    its kind, the version UUID and the renderer version and never needs
+    invalidation. Files are written atomically, which makes the cache safe
+    to share between worker processes on the same host.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, kind, uuid, renderer_version, extension='pdf'):
+        """Return the file path of an artifact."""
+        return os.path.join(self.directory, kind, f"{uuid}-r{renderer_version}.{extension}")
+
+    def get(self, path):
+        """Return the cached artifact bytes, or None on a cache miss."""
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, path, data):
+        """Store artifact bytes atomically."""
+        with self.writer(path) as f:
+            f.write(data)
+
+    @contextmanager
+    def writer(self, path):
+        """
+        Open a binary file to write an artifact into, for artifacts too large
+        to build in memory. The artifact is stored atomically when the block
+        exits, and discarded if it raises.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get_or_render(self, path, render):
+        """
+        Return the cached artifact, rendering and storing it on a miss.
+
+        Args:
+            path (str): Artifact path from ArtifactCache.path
+            render (callable): Zero-argument function returning the artifact bytes
+
+        Returns:
+            bytes: The artifact contents
+        """
+        data = self.get(path)
+        if data is None:
+            data = render()
+            self.put(path, data)
+        return data
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+
+from utils.artifact_cache import ArtifactCache
+from utils.compression import ENCODINGS, ENCODING_SUFFIXES, compress
+
+MANIFEST_NAME = 'manifest.json'
+
+# Static files worth precompressing; images and fonts are compressed already
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.txt', '.json', '.map'}
+
+def build_assets(static_dir, output_dir):
+    """
+    Fingerprint and precompress the static files.
+
+    Every file under static_dir (except output_dir) is copied into output_dir
+    with a content hash in its name, along with .gz (and, with brotli
+    installed, .br) variants. Earlier builds are kept, so cached pages that
+    reference them keep working. The manifest maps the original names to
+    the fingerprinted ones.
+
+    Returns:
+        list: (name, fingerprinted name, {encoding or 'identity': size}) per file
+    """
+    store = ArtifactCache(output_dir)
+    manifest = {}
+    report = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != output_dir)
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            stem, extension = os.path.splitext(name)
+            fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+            target = os.path.join(output_dir, fingerprinted)
+            store.put(target, data)
+
+            sizes = {'identity': len(data)}
+            if extension in COMPRESSIBLE_EXTENSIONS:
+                for encoding in ENCODINGS:
+                    compressed = compress(data, encoding, best=True)
+                    if len(compressed) < len(data):
+                        store.put(target + ENCODING_SUFFIXES[encoding], compressed)
+                        sizes[encoding] = len(compressed)
+
+            manifest[name] = fingerprinted
+            report.append((name, fingerprinted, sizes))
+
+    store.put(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return report
+
+class AssetManifest:
+    """Lookup of fingerprinted static file names, read once from the build manifest."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._names = None
+
+    def get(self, name):
+        """Return the fingerprinted name of a static file, or None when it has not been built."""
+        if self._names is None:
+            try:
+                with open(os.path.join(self.directory, MANIFEST_NAME)) as f:
+                    self._names = json.load(f)
+            except (OSError, ValueError):
+                self._names = {}
+        return self._names.get(name)
@@ -0,0 +1,319 @@
+import math
+
+from utils.answer_equivalence import canonicalize
+
+# Machine-readable answer sheets printed after the questions of a test.
+#
+# Each question gets a grid-in block: GRID_COLUMNS columns of bubbles, one
+# per character of the answer, with a bubble row per symbol. Answers with
+# several values are gridded comma-separated ("-2,3" for roots, "1,-2" for
+# x = 1, y = -2); irrational answers as decimals. Four registration marks
+# in the page corners locate the sheet in a scan, and a strip of code boxes
+# carries the version's access code and the page number.
+#
+# Coordinates are PDF points on a letter page, origin bottom-left.
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+
+SYMBOLS = ('-', '.', '/', ',', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9')
+GRID_COLUMNS = 10
+BUBBLE_PITCH = 11
+BUBBLE_RADIUS = 4
+
+# Registration marks: solid squares centered near the corners
+MARK_SIZE = 24
+MARK_CENTERS = ((42, 42), (570, 42), (42, 750), (570, 750))
+
+# Code strip: 32 bits of access code, 4 of page number, 4 of checksum
+CODE_BITS = 32
+PAGE_BITS = 4
+CHECK_BITS = 4
+CODE_X, CODE_Y = 126, 690
+CODE_PITCH = 10
+CODE_BOX = 7
+
+# Question blocks: 4 across, 3 down
+GRID_TOP = 650
+BLOCK_LEFT = 64
+BLOCK_WIDTH = GRID_COLUMNS * BUBBLE_PITCH
+BLOCK_SPACING = 134
+BLOCK_HEIGHT = 180
+BLOCKS_PER_ROW = 4
+QUESTIONS_PER_PAGE = 12
+
+# Darkness (0 white to 1 black) above which a bubble or code box counts as filled
+FILL_THRESHOLD = 0.45
+
+# Corner windows searched for the registration marks, as fractions of the image size
+MARK_WINDOW = (0.15, 0.11)
+
+def sheet_pages(num_questions):
+    """Return the number of answer sheet pages for a test."""
+    return max(1, math.ceil(num_questions / QUESTIONS_PER_PAGE))
+
+def page_questions(num_questions, page):
+    """Return the number of questions on an answer sheet page."""
+    return min(QUESTIONS_PER_PAGE, num_questions - page * QUESTIONS_PER_PAGE)
+
+def bubble_center(slot, column, symbol):
+    """Return the page position of a bubble of a question block."""
+    x = BLOCK_LEFT + (slot % BLOCKS_PER_ROW) * BLOCK_SPACING + (column + 0.5) * BUBBLE_PITCH
+    y = GRID_TOP - (slot // BLOCKS_PER_ROW) * BLOCK_HEIGHT - 16 - (symbol + 0.5) * BUBBLE_PITCH
+    return x, y
+
+def code_box_center(bit):
+    """Return the page position of a code box."""
+    return CODE_X + (bit + 0.5) * CODE_PITCH, CODE_Y
+
+def encode_code(access_code, page):
+    """Return the code strip bits for a version's access code (8 hex digits) and a page index."""
+    value = int(access_code, 16)
+    nibbles = [(value >> shift) & 0xF for shift in range(CODE_BITS - 4, -4, -4)] + [page & 0xF]
+    bits = []
+    for nibble in nibbles + [sum(nibbles) & 0xF]:
+        bits.extend((nibble >> shift) & 1 for shift in (3, 2, 1, 0))
+    return bits
+
+def decode_code(bits):
+    """Return (access_code, page) from code strip bits, or None when the checksum fails."""
+    nibbles = [int(''.join(str(int(bit)) for bit in bits[i:i + 4]), 2) for i in range(0, len(bits), 4)]
+    *data, check = nibbles
+    if sum(data) & 0xF != check:
+        return None
+    access_code = ''.join(f"{nibble:X}" for nibble in data[:-1])
+    return access_code, data[-1]
+
+def grid_answer(answer):
+    """
+    Return how an answer is gridded on the sheet, or None when it does not fit.
+
+    Irrational values are rounded to two decimals; the grader accepts those.
+    """
+    form = canonicalize(answer)
+    if form.kind == 'text':
+        return None
+    parts = []
+    for value in form.values:
+        if value.approximate:
+            parts.append(f"{float(value.number):.2f}")
+        elif value.number.denominator == 1:
+            parts.append(str(value.number.numerator))
+        elif value.places is not None:
+            parts.append(f"{float(value.number):.{value.places}f}")
+        else:
+            parts.append(f"{value.number.numerator}/{value.number.denominator}")
+    gridded = ','.join(parts)
+    return gridded if len(gridded) <= GRID_COLUMNS else None
+
+def answer_fills(slot, gridded):
+    """Return the (slot, column, symbol) bubbles a student fills in to grid an answer."""
+    return [(slot, column, SYMBOLS.index(char)) for column, char in enumerate(gridded)]
+
+def slot_offset(slot):
+    """Return the offset of a question block from the first block of a page."""
+    return (slot % BLOCKS_PER_ROW) * BLOCK_SPACING, -(slot // BLOCKS_PER_ROW) * BLOCK_HEIGHT
+
+def block_shapes():
+    """Describe the grid of the first question block of a page; the others are offset copies (see slot_offset)."""
+    shapes = []
+    left, top = bubble_center(0, 0, 0)
+    left -= BUBBLE_PITCH / 2
+    top += BUBBLE_PITCH / 2
+    for column in range(GRID_COLUMNS):
+        shapes.append(('rect', left + column * BUBBLE_PITCH + 1, top + 1, BUBBLE_PITCH - 2, BUBBLE_PITCH - 2, False))
+    for symbol, label in enumerate(SYMBOLS):
+        x, y = bubble_center(0, 0, symbol)
+        shapes.append(('text', left - 7, y - 2.5, 7, label))
+        for column in range(GRID_COLUMNS):
+            shapes.append(('circle', *bubble_center(0, column, symbol), BUBBLE_RADIUS))
+    return shapes
+
+def sheet_shapes(title, access_code, num_questions, page, blocks=True, multiple_choice=False):
+    """
+    Describe one answer sheet page as drawing primitives.
+
+    Both the PDF renderer and the synthetic scan renderer draw these, so a
+    synthetic scan shows exactly what the printed sheet does.
+
+    Args:
+        blocks (bool): Whether to include the question block grids; the PDF
+            renderer draws one shared copy of block_shapes per question
+            instead
+        multiple_choice (bool): Whether the test is multiple choice; its
+            answers are gridded as the number of the choice
+
+    Returns:
+        list: ('rect', x, y, width, height, filled), ('circle', x, y,
+            radius) and ('text', x, y, size, string) tuples, with x and y
+            the lower left corner of rects and the baseline start of text
+    """
+    shapes = []
+    for x, y in MARK_CENTERS:
+        shapes.append(('rect', x - MARK_SIZE / 2, y - MARK_SIZE / 2, MARK_SIZE, MARK_SIZE, True))
+
+    pages = sheet_pages(num_questions)
+    shapes.append(('text', 130, 738, 11, f"{title} - Answer Sheet {page + 1} of {pages}"))
+    shapes.append(('text', 130, 716, 10, "Name: ______________________________    Test Version ID: " + access_code))
+    for bit, value in enumerate(encode_code(access_code, page)):
+        x, y = code_box_center(bit)
+        shapes.append(('rect', x - CODE_BOX / 2, y - CODE_BOX / 2, CODE_BOX, CODE_BOX, bool(value)))
+    shapes.append(('text', 130, 672, 8, "Write each answer in the boxes, one character per column, then fill in the matching bubbles."))
+    if multiple_choice:
+        shapes.append(('text', 130, 662, 8, "Grid the number of the choice you pick: 1 for A, 2 for B, 3 for C, 4 for D."))
+    else:
+        shapes.append(('text', 130, 662, 8, "Separate several values with a comma (x = 1, y = -2 is gridded 1,-2); round decimals to two places."))
+
+    first = page * QUESTIONS_PER_PAGE
+    grid = block_shapes() if blocks else []
+    left, top = bubble_center(0, 0, 0)
+    for slot in range(page_questions(num_questions, page)):
+        dx, dy = slot_offset(slot)
+        shapes.append(('text', left - BUBBLE_PITCH / 2 - 14 + dx, top + BUBBLE_PITCH / 2 + 5 + dy, 9, f"{first + slot + 1}."))
+        for kind, x, y, *rest in grid:
+            shapes.append((kind, x + dx, y + dy, *rest))
+    return shapes
+
+def render_sheet_image(shapes, dpi=150):
+    """
+    Rasterize answer sheet shapes to a grayscale Pillow image, like a scan.
+
+    Args:
+        shapes (list): Primitives from sheet_shapes
+        dpi (int): Resolution of the image
+
+    Returns:
+        PIL.Image.Image: The page image
+    """
+    from PIL import Image, ImageDraw  # loads with the scan tools only
+
+    scale = dpi / 72
+    image = Image.new('L', (round(PAGE_WIDTH * scale), round(PAGE_HEIGHT * scale)), 255)
+    draw = ImageDraw.Draw(image)
+
+    def point(x, y):
+        return x * scale, (PAGE_HEIGHT - y) * scale
+
+    for shape in shapes:
+        if shape[0] == 'rect':
+            _, x, y, width, height, filled = shape
+            (x0, y1), (x1, y0) = point(x, y), point(x + width, y + height)
+            draw.rectangle((x0, y0, x1, y1), fill=0 if filled else None, outline=0, width=max(1, round(0.5 * scale)))
+        elif shape[0] == 'circle':
+            _, x, y, radius = shape
+            cx, cy = point(x, y)
+            r = radius * scale
+            draw.ellipse((cx - r, cy - r, cx + r, cy + r), outline=0, width=max(1, round(0.5 * scale)))
+        else:
+            _, x, y, size, text = shape
+            cx, cy = point(x, y + size * 0.8)
+            draw.text((cx, cy), text, fill=0)
+    return image
+
+def fill_bubbles(image, fills, fill_gray=70):
+    """
+    Fill in bubbles on a rendered sheet image, as a student would.
+
+    Args:
+        image (PIL.Image.Image): Page image from render_sheet_image; a filled-in copy is returned
+        fills (iterable): (slot, column, symbol) bubbles to fill in
+        fill_gray (int): Gray level of the pencil marks (0 is black)
+    """
+    from PIL import ImageDraw
+
+    image = image.copy()
+    draw = ImageDraw.Draw(image)
+    scale = image.width / PAGE_WIDTH
+    for slot, column, symbol in fills:
+        x, y = bubble_center(slot, column, symbol)
+        cx, cy = x * scale, (PAGE_HEIGHT - y) * scale
+        r = BUBBLE_RADIUS * scale * 0.9
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=fill_gray)
+    return image
+
+def read_scan(path):
+    """
+    Read an answer sheet page from a scanned image.
+
+    Finds the registration marks, maps the sheet layout onto the image with
+    a least-squares affine transform (which absorbs scan offset, scale and
+    skew), and measures every code box and bubble at once from an integral
+    image. Runs in process pool workers.
+
+    Returns:
+        dict: path, access_code, page, answers (question number to the
+            gridded text of every block with a filled bubble), ambiguous
+            (question numbers with two filled bubbles in a column) and error
+            (None, or why the page could not be read)
+    """
+    import numpy as np
+    from PIL import Image
+
+    result = {'path': path, 'access_code': None, 'page': None, 'answers': {}, 'ambiguous': [], 'error': None}
+    with Image.open(path) as image:
+        darkness = 255 - np.asarray(image.convert('L'))
+    # Integer sums of 0-255 darkness: exact, and half the memory traffic of floats
+    height, width = darkness.shape
+    integral = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.cumsum(darkness, axis=0, dtype=np.int32, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+
+    def box_means(xs, ys, half):
+        x0 = np.clip(np.rint(xs - half).astype(int), 0, width)
+        x1 = np.clip(np.rint(xs + half).astype(int) + 1, 0, width)
+        y0 = np.clip(np.rint(ys - half).astype(int), 0, height)
+        y1 = np.clip(np.rint(ys + half).astype(int) + 1, 0, height)
+        area = np.maximum((x1 - x0) * (y1 - y0), 1)
+        return (integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]) / (area * 255.0)
+
+    # Registration marks: centroid of the solidly dark pixels in each corner window
+    scale_guess = width / PAGE_WIDTH
+    window_width, window_height = int(width * MARK_WINDOW[0]), int(height * MARK_WINDOW[1])
+    found = []
+    for mark_x, mark_y in MARK_CENTERS:
+        left = 0 if mark_x < PAGE_WIDTH / 2 else width - window_width
+        top = 0 if mark_y > PAGE_HEIGHT / 2 else height - window_height
+        ys, xs = np.mgrid[top:top + window_height, left:left + window_width]
+        # A box blur of a third of the mark size leaves only the marks solidly dark
+        solid = box_means(xs.ravel(), ys.ravel(), MARK_SIZE * scale_guess / 6) > 0.8
+        if not solid.any():
+            result['error'] = 'registration marks not found'
+            return result
+        found.append((xs.ravel()[solid].mean(), ys.ravel()[solid].mean()))
+
+    # Affine map from page points (y down) to image pixels
+    page_points = np.array([[x, PAGE_HEIGHT - y, 1.0] for x, y in MARK_CENTERS])
+    transform, *_ = np.linalg.lstsq(page_points, np.array(found), rcond=None)
+    scale = math.hypot(*transform[0])
+
+    def measure(points, half):
+        points = np.asarray(points, dtype=np.float64)
+        pixels = np.column_stack([points[:, 0], PAGE_HEIGHT - points[:, 1], np.ones(len(points))]) @ transform
+        return box_means(pixels[:, 0], pixels[:, 1], half * scale)
+
+    bits = measure([code_box_center(bit) for bit in range(CODE_BITS + PAGE_BITS + CHECK_BITS)], CODE_BOX * 0.3)
+    decoded = decode_code(bits > FILL_THRESHOLD)
+    if decoded is None:
+        result['error'] = 'version code unreadable'
+        return result
+    result['access_code'], result['page'] = decoded
+
+    # Every bubble of the page at once: (slot, column, symbol)
+    centers = [
+        bubble_center(slot, column, symbol)
+        for slot in range(QUESTIONS_PER_PAGE)
+        for column in range(GRID_COLUMNS)
+        for symbol in range(len(SYMBOLS))
+    ]
+    fill = measure(centers, BUBBLE_RADIUS * 0.55).reshape(QUESTIONS_PER_PAGE, GRID_COLUMNS, len(SYMBOLS))
+    filled = fill > FILL_THRESHOLD
+    darkest = fill.argmax(axis=2)
+    marked = filled.any(axis=2)
+    ambiguous = filled.sum(axis=2) > 1
+
+    first = result['page'] * QUESTIONS_PER_PAGE
+    for slot in np.flatnonzero(marked.any(axis=1)):
+        columns = np.flatnonzero(marked[slot])
+        result['answers'][first + int(slot) + 1] = ''.join(SYMBOLS[darkest[slot, column]] for column in columns)
+        if ambiguous[slot].any():
+            result['ambiguous'].append(first + int(slot) + 1)
+    return result
@@ -0,0 +1,36 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional: without it responses are gzip-compressed only
+    brotli = None
+
+# Content codings this process can produce, most preferred first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# File suffixes of precompressed static assets, by content coding
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def compress(data, encoding, best=False):
+    """
+    Compress bytes with a content coding.
+
+    Args:
+        data (bytes): Data to compress
+        encoding (str): 'br' or 'gzip'
+        best (bool): Use the slowest, smallest setting (for build-time precompression)
+
+    Returns:
+        bytes: The compressed data
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    # A fixed mtime keeps the output, and so its ETag, stable
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+def choose_encoding(accept_encodings, available=ENCODINGS):
+    """Return the most preferred available content coding the client accepts, or None."""
+    for encoding in available:
+        if accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
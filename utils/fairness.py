@@ -0,0 +1,196 @@
+import re
+
+# Fairness of the versions of a test.
+#
+# Question N of every version comes from the same question template, so the
+# versions are compared position by position. Each generated question gets a
+# vector of difficulty features; at each position the features are scored
+# against the median version, and a version's difficulty is the mean score
+# of its questions. A version far from the others (a robust z-score above
+# the threshold) is an outlier: harder or easier than the rest.
+
+FEATURES = ('operand_digits', 'operands', 'regroupings', 'non_integer', 'steps', 'answer_digits')
+
+# Weight of each feature in a question's difficulty score
+WEIGHTS = (1.0, 0.5, 1.0, 1.5, 1.0, 0.5)
+
+# Feature scores are clipped, so one odd feature cannot outweigh a whole test
+SCORE_CLIP = 4.0
+
+# Robust z-score of a version's difficulty above which it is an outlier
+DEFAULT_THRESHOLD = 3.0
+
+# Fewest versions an outlier can be told apart in
+MIN_VERSIONS = 5
+
+# Questions redrawn per outlier version, and new draws tried per question
+MAX_REDRAWS = 5
+DRAWS_PER_QUESTION = 4
+
+# Longest answer counted, in digits; long repeating decimals are not harder for being longer
+MAX_ANSWER_DIGITS = 6
+
+NUMBER = re.compile(r'(?<![\d.])\d+(?:\.\d+)?')
+SUBTRACTION = re.compile(r'\d\s*-\s*\d|subtract|difference|decreased', re.IGNORECASE)
+ADDITION = re.compile(r'\d\s*\+\s*\d|\bsum\b|\badd\b|increased', re.IGNORECASE)
+
+def question_features(question_text, answer, solution_steps):
+    """
+    Return the difficulty features of a generated question (see FEATURES).
+
+    - operand_digits: mean number of digits of the numbers in the question
+    - operands: how many numbers the question has
+    - regroupings: carries of a sum, or borrows of a difference, of its two
+      largest numbers, column by column
+    - non_integer: 0 for whole-number answers, 1 for fractions and short
+      decimals, 2 for surds and long decimals
+    - steps: equations and lines in the worked solution
+    - answer_digits: digits in the answer
+    """
+    numbers = NUMBER.findall(question_text)
+    digits = [len(number.replace('.', '')) for number in numbers]
+
+    regroupings = 0
+    if len(numbers) >= 2:
+        if SUBTRACTION.search(question_text):
+            regroupings = _regroupings(numbers, borrow=True)
+        elif ADDITION.search(question_text):
+            regroupings = _regroupings(numbers, borrow=False)
+
+    if 'sqrt' in answer or '√' in answer or re.search(r'\.\d{3,}', answer):
+        non_integer = 2
+    elif '/' in answer or re.search(r'\.\d*[1-9]', answer):
+        non_integer = 1
+    else:
+        non_integer = 0
+
+    return (
+        sum(digits) / len(digits) if digits else 0.0,
+        len(numbers),
+        regroupings,
+        non_integer,
+        (solution_steps or '').count('=') + (solution_steps or '').count('\n'),
+        min(sum(char.isdigit() for char in answer), MAX_ANSWER_DIGITS),
+    )
+
+def _regroupings(numbers, borrow):
+    """Count the carries (or borrows) of column addition (or subtraction) of the two largest numbers."""
+    places = max(len(number.partition('.')[2]) for number in numbers)
+    values = sorted((int(round(float(number) * 10 ** places)) for number in numbers), reverse=True)
+    first, second = values[0], values[1]
+    count = 0
+    carry = 0
+    while first or second:
+        column = (first % 10 - second % 10 - carry) if borrow else (first % 10 + second % 10 + carry)
+        carry = int(column < 0) if borrow else int(column > 9)
+        count += carry
+        first //= 10
+        second //= 10
+    return count
+
+def feature_array(versions):
+    """Return the features of the questions of each version as a (versions, questions, FEATURES) array."""
+    import numpy as np
+
+    return np.array([
+        [question_features(q['question_text'], q['answer'], q['solution_steps']) for q in questions]
+        for questions in versions
+    ], dtype=np.float64).reshape(len(versions), -1, len(FEATURES))
+
+def analyze(features, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the difficulty of the versions of a test.
+
+    Args:
+        features: Feature vectors as a (versions, questions, FEATURES) array
+            or nested lists, questions in the same order in every version
+        threshold (float): Robust z-score above which a version is flagged
+
+    Returns:
+        dict: difficulty (versions x questions array of question scores),
+            scores (mean question score per version), deviation (robust
+            z-score of each version's score), flagged (indices of outlier
+            versions) and the per-position center and spread the question
+            scores were computed with
+    """
+    import numpy as np
+
+    features = np.asarray(features, dtype=np.float64)
+    weights = np.asarray(WEIGHTS)
+    center = np.median(features, axis=0)
+    spread = features.std(axis=0)
+    # A feature that is the same in every version scores 0 there
+    spread[spread == 0] = 1.0
+    difficulty = np.clip((features - center) / spread, -SCORE_CLIP, SCORE_CLIP) @ weights / weights.sum()
+    scores = difficulty.mean(axis=1)
+
+    deviation = np.zeros_like(scores)
+    if len(scores) >= MIN_VERSIONS:
+        scale = 1.4826 * np.median(np.abs(scores - np.median(scores))) or scores.std()
+        if scale > 0:
+            deviation = (scores - np.median(scores)) / scale
+    return {
+        'difficulty': difficulty,
+        'scores': scores,
+        'deviation': deviation,
+        'flagged': [int(index) for index in np.flatnonzero(np.abs(deviation) > threshold)],
+        'center': center,
+        'spread': spread,
+    }
+
+def rebalance(versions, redraw, threshold=DEFAULT_THRESHOLD):
+    """
+    Redraw questions of outlier versions until they are in line with the rest.
+
+    Each round, every flagged version has the question that pulls it
+    furthest from the others redrawn: a few new draws are generated and the
+    most typical one kept. At most MAX_REDRAWS questions of a version are
+    redrawn.
+
+    Args:
+        versions (list): Per version, the list of its question dicts
+            (question_text, answer, solution_steps); updated in place
+        redraw (callable): redraw(version index, question index, draw)
+            returns a new question dict for that position
+        threshold (float): Robust z-score above which a version is flagged
+
+    Returns:
+        list: (version index, question index) of each question replaced
+    """
+    import numpy as np
+
+    if len(versions) < MIN_VERSIONS:
+        return []
+    features = feature_array(versions)
+    weights = np.asarray(WEIGHTS)
+
+    replaced = []
+    redrawn = set()
+    for _ in range(MAX_REDRAWS):
+        analysis = analyze(features, threshold)
+        if not analysis['flagged']:
+            break
+        for version in analysis['flagged']:
+            direction = np.sign(analysis['deviation'][version])
+            order = np.argsort(-direction * analysis['difficulty'][version])
+            question = next((int(q) for q in order if (version, int(q)) not in redrawn), None)
+            if question is None:
+                continue
+            redrawn.add((version, question))
+
+            center, spread = analysis['center'][question], analysis['spread'][question]
+            best, best_features = None, features[version, question]
+            best_score = abs(np.clip((best_features - center) / spread, -SCORE_CLIP, SCORE_CLIP) @ weights)
+            for draw in range(1, DRAWS_PER_QUESTION + 1):
+                candidate = redraw(version, question, draw)
+                candidate_features = np.asarray(question_features(
+                    candidate['question_text'], candidate['answer'], candidate['solution_steps']
+                ))
+                score = abs(np.clip((candidate_features - center) / spread, -SCORE_CLIP, SCORE_CLIP) @ weights)
+                if score < best_score:
+                    best, best_features, best_score = candidate, candidate_features, score
+            if best is not None:
+                versions[version][question] = best
+                features[version, question] = best_features
+                replaced.append((version, question))
+    return replaced
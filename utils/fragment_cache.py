@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+from utils.artifact_cache import ArtifactCache
+from utils.metrics import FRAGMENT_CACHE_LOOKUPS
+
+class FragmentCache:
+    """
+    Cache for rendered HTML fragments of immutable test templates and versions.
+
+    Fragments are keyed by name, the UUID of the record they show and the
+    page renderer version, so like rendered PDFs they never need
+    invalidation. Each process keeps the most recently used fragments in
+    memory; with a directory, fragments are also stored on disk, where the
+    worker processes of a host share them.
+    """
+
+    def __init__(self, max_entries=1024, directory=None):
+        self.max_entries = max_entries
+        self.disk = ArtifactCache(directory) if directory else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, name, uuid, renderer_version, render):
+        """
+        Return a cached fragment, rendering and storing it on a miss.
+
+        Args:
+            name (str): Fragment name
+            uuid (str): UUID of the immutable record the fragment shows
+            renderer_version (int): Version of the templates rendering it
+            render (callable): Zero-argument function returning the fragment HTML
+
+        Returns:
+            Markup: The fragment HTML
+        """
+        key = (name, uuid, renderer_version)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+        if html is not None:
+            FRAGMENT_CACHE_LOOKUPS.inc(fragment=name, result='memory')
+            return html
+
+        path = self.disk.path(name, uuid, renderer_version, extension='html') if self.disk else None
+        data = self.disk.get(path) if path else None
+        if data is not None:
+            FRAGMENT_CACHE_LOOKUPS.inc(fragment=name, result='disk')
+            html = Markup(data.decode('utf-8'))
+        else:
+            FRAGMENT_CACHE_LOOKUPS.inc(fragment=name, result='miss')
+            html = Markup(render())
+            if path:
+                self.disk.put(path, html.encode('utf-8'))
+
+        self._store(key, html)
+        return html
+
+    def _store(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop the in-memory fragments of this process (the disk tier is kept)."""
+        with self._lock:
+            self._entries.clear()
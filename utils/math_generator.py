@@ -1,7 +1,12 @@
+import math
 import random
-import sympy as sp
-from sympy.parsing.sympy_parser import parse_expr
-from sympy import symbols, solve, Eq
+
+from utils.fairness import rebalance
+from utils.metrics import QUESTION_GENERATION_SECONDS
+from utils.multiple_choice import build_choices, pack_choices
+
+# SymPy takes about half a second to import, so the generators that need it
+# import it on first use instead of at module load
 
 def generate_question_templates(topics, difficulty, num_questions):
     """
@@ -62,65 +67,129 @@ def generate_question_from_template(question_type, difficulty, seed=None):
         random.seed(seed)
     
     # Generate question based on type
-    if question_type == 'addition':
-        q = generate_addition_question(difficulty)
-    elif question_type == 'subtraction':
-        q = generate_subtraction_question(difficulty)
-    elif question_type == 'multiplication':
-        q = generate_multiplication_question(difficulty)
-    elif question_type == 'division':
-        q = generate_division_question(difficulty)
-    elif question_type == 'fractions':
-        q = generate_fraction_question(difficulty)
-    elif question_type == 'decimals':
-        q = generate_decimal_question(difficulty)
-    elif question_type == 'percentages':
-        q = generate_percentage_question(difficulty)
-    elif question_type == 'algebra':
-        q = generate_algebra_question(difficulty)
-    elif question_type == 'geometry':
-        q = generate_geometry_question(difficulty)
-    elif question_type == 'statistics':
-        q = generate_statistics_question(difficulty)
-    else:
-        q = generate_addition_question(difficulty)  # Default fallback
+    with QUESTION_GENERATION_SECONDS.time(topic=question_type, difficulty=difficulty):
+        if question_type == 'addition':
+            q = generate_addition_question(difficulty)
+        elif question_type == 'subtraction':
+            q = generate_subtraction_question(difficulty)
+        elif question_type == 'multiplication':
+            q = generate_multiplication_question(difficulty)
+        elif question_type == 'division':
+            q = generate_division_question(difficulty)
+        elif question_type == 'fractions':
+            q = generate_fraction_question(difficulty)
+        elif question_type == 'decimals':
+            q = generate_decimal_question(difficulty)
+        elif question_type == 'percentages':
+            q = generate_percentage_question(difficulty)
+        elif question_type == 'algebra':
+            q = generate_algebra_question(difficulty)
+        elif question_type == 'geometry':
+            q = generate_geometry_question(difficulty)
+        elif question_type == 'statistics':
+            q = generate_statistics_question(difficulty)
+        else:
+            q = generate_addition_question(difficulty)  # Default fallback
     
     return q
 
-def generate_test_version_questions(question_templates, version_number):
+def generate_test_version_questions(question_templates, version_number, multiple_choice=False):
     """
     Generate a unique set of questions for a specific test version.
     
     Args:
         question_templates (list): List of QuestionTemplate objects
         version_number (int): The version number of the test
+        multiple_choice (bool): Whether to add choices to each question
     
     Returns:
-        list: List of dictionaries containing question, answer, and solution
+        list: List of dictionaries containing question, answer, and solution;
+            multiple-choice questions also have choices (packed distractors)
+            and answer_position (see utils.multiple_choice)
     """
-    questions = []
+    return [
+        generate_version_question(template, version_number, multiple_choice)
+        for template in question_templates
+    ]
+
+def generate_version_question(template, version_number, multiple_choice=False, draw=0):
+    """
+    Generate the question of a test version for one question template.
     
-    # Generate a unique question for each template using template ID + version number as seed
-    for template in question_templates:
-        # Create a seed from template ID and version number for reproducibility
-        seed_value = template.id * 1000 + version_number
-        
-        # Generate the question
-        question_data = generate_question_from_template(
-            template.question_type, 
-            template.difficulty,
-            seed=seed_value
-        )
-        
-        questions.append({
-            'question_template_id': template.id,
-            'question_text': question_data['question'],
-            'answer': question_data['answer'],
-            'solution_steps': question_data.get('solution', ''),
-            'order': template.order
-        })
+    Args:
+        template: QuestionTemplate (or an object with the same attributes)
+        version_number (int): The version number of the test
+        multiple_choice (bool): Whether to add choices to the question
+        draw (int): Redraw number; 0 is the version's own question, later
+            draws are alternatives (see utils.fairness.rebalance)
     
-    return questions
+    Returns:
+        dict: The question (see generate_test_version_questions)
+    """
+    # Create a seed from template ID and version number for reproducibility
+    seed_value = template.id * 1000 + version_number
+    if draw:
+        seed_value = f"{seed_value}:{draw}"
+    
+    # Generate the question
+    question_data = generate_question_from_template(
+        template.question_type, 
+        template.difficulty,
+        seed=seed_value
+    )
+    
+    question = {
+        'question_template_id': template.id,
+        'question_text': question_data['question'],
+        'answer': question_data['answer'],
+        'solution_steps': question_data.get('solution', ''),
+        'order': template.order
+    }
+    
+    # Choices come from the generator's distractors; shuffling them is seeded
+    # like the question, so each version has its own, reproducible order
+    if multiple_choice:
+        distractors, position = build_choices(question['answer'], question_data.get('distractors', []), seed_value)
+        question['choices'] = pack_choices(distractors)
+        question['answer_position'] = position
+    
+    return question
+
+def generate_test_versions(question_templates, num_versions, multiple_choice=False, fairness_threshold=None, progress=None):
+    """
+    Generate the questions of every version of a test.
+    
+    Versions much harder or easier than the others have the questions that
+    set them apart redrawn (see utils.fairness).
+    
+    Args:
+        question_templates (list): List of QuestionTemplate objects
+        num_versions (int): Number of versions
+        multiple_choice (bool): Whether to add choices to each question
+        fairness_threshold (float, optional): Robust z-score of a version's
+            difficulty above which it is rebalanced; None or 0 keeps every
+            version as drawn
+        progress (callable, optional): Called as progress(done, total) after
+            each version is generated
+    
+    Returns:
+        list: The questions of each version (see generate_test_version_questions)
+    """
+    versions = []
+    for version_number in range(1, num_versions + 1):
+        versions.append(generate_test_version_questions(question_templates, version_number, multiple_choice))
+        if progress is not None:
+            progress(version_number, num_versions)
+    
+    if fairness_threshold:
+        rebalance(
+            versions,
+            lambda version, question, draw: generate_version_question(
+                question_templates[question], version + 1, multiple_choice, draw
+            ),
+            fairness_threshold
+        )
+    return versions
 
 def generate_math_questions(topics, difficulty, num_questions):
     """
@@ -162,6 +231,37 @@ def generate_math_questions(topics, difficulty, num_questions):
     
     return questions
 
+def _fraction(numerator, denominator):
+    """Format a fraction in lowest terms, whole numbers as such; None for a zero denominator."""
+    if denominator == 0:
+        return None
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    gcd = math.gcd(numerator, denominator)
+    if denominator == gcd:
+        return str(numerator // gcd)
+    return f"{numerator // gcd}/{denominator // gcd}"
+
+def _pair(first, second):
+    """Format two values as an unordered answer, smaller first."""
+    return f"{first}, {second}" if first < second else f"{second}, {first}"
+
+def _no_carry_sum(a, b):
+    """Add digit by digit, dropping the carries."""
+    total, place = 0, 1
+    while a or b:
+        total += (a % 10 + b % 10) % 10 * place
+        a, b, place = a // 10, b // 10, place * 10
+    return total
+
+def _no_borrow_difference(a, b):
+    """Subtract digit by digit, taking the smaller digit from the larger instead of borrowing."""
+    total, place = 0, 1
+    while a or b:
+        total += abs(a % 10 - b % 10) * place
+        a, b, place = a // 10, b // 10, place * 10
+    return total
+
 def generate_addition_question(difficulty):
     """Generate an addition problem based on the specified difficulty."""
     if difficulty == 'easy':
@@ -170,12 +270,14 @@ def generate_addition_question(difficulty):
         answer = a + b
         question = f"What is {a} + {b}?"
         solution = f"{a} + {b} = {answer}"
+        distractors = [_no_carry_sum(a, b), answer - 1, answer + 1, abs(a - b)]
     elif difficulty == 'medium':
         a = random.randint(10, 100)
         b = random.randint(10, 100)
         answer = a + b
         question = f"Calculate {a} + {b}."
         solution = f"{a} + {b} = {answer}"
+        distractors = [_no_carry_sum(a, b), answer + 10, answer - 10, answer + 1]
     else:  # hard
         a = random.randint(100, 1000)
         b = random.randint(100, 1000)
@@ -183,11 +285,13 @@ def generate_addition_question(difficulty):
         answer = a + b + c
         question = f"Find the sum of {a}, {b}, and {c}."
         solution = f"{a} + {b} + {c} = {answer}"
+        distractors = [a + b, _no_carry_sum(_no_carry_sum(a, b), c), answer + 10, answer - 100]
     
     return {
         'question': question,
         'answer': str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_subtraction_question(difficulty):
@@ -198,23 +302,27 @@ def generate_subtraction_question(difficulty):
         answer = a - b
         question = f"What is {a} - {b}?"
         solution = f"{a} - {b} = {answer}"
+        distractors = [_no_borrow_difference(a, b), a + b, answer + 1, answer - 1]
     elif difficulty == 'medium':
         b = random.randint(10, 50)
         a = random.randint(b, 100)
         answer = a - b
         question = f"Calculate {a} - {b}."
         solution = f"{a} - {b} = {answer}"
+        distractors = [_no_borrow_difference(a, b), a + b, answer + 1, answer - 1]
     else:  # hard
         b = random.randint(100, 500)
         a = random.randint(b, 1000)
         answer = a - b
         question = f"Subtract {b} from {a}."
         solution = f"{a} - {b} = {answer}"
+        distractors = [_no_borrow_difference(a, b), a + b, answer + 1, answer - 1]
     
     return {
         'question': question,
         'answer': str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_multiplication_question(difficulty):
@@ -225,23 +333,28 @@ def generate_multiplication_question(difficulty):
         answer = a * b
         question = f"What is {a} × {b}?"
         solution = f"{a} × {b} = {answer}"
+        distractors = [a + b, a * (b + 1), (a + 1) * b, a * (b - 1)]
     elif difficulty == 'medium':
         a = random.randint(10, 20)
         b = random.randint(1, 10)
         answer = a * b
         question = f"Calculate {a} × {b}."
         solution = f"{a} × {b} = {answer}"
+        distractors = [a + b, a * (b + 1), (a + 1) * b, a * (b - 1)]
     else:  # hard
         a = random.randint(11, 30)
         b = random.randint(11, 20)
         answer = a * b
         question = f"Find the product of {a} and {b}."
         solution = f"{a} × {b} = {answer}"
+        # Forgetting to shift the tens partial product
+        distractors = [a * (b % 10) + a * (b // 10), a * (b + 1), (a + 1) * b, a * b + 10]
     
     return {
         'question': question,
         'answer': str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_division_question(difficulty):
@@ -252,27 +365,33 @@ def generate_division_question(difficulty):
         answer = a // b
         question = f"What is {a} ÷ {b}?"
         solution = f"{a} ÷ {b} = {answer}"
+        distractors = [a - b, answer + 1, answer - 1, answer * 10]
     elif difficulty == 'medium':
         b = random.randint(2, 12)
         a = b * random.randint(5, 15)
         answer = a // b
         question = f"Calculate {a} ÷ {b}."
         solution = f"{a} ÷ {b} = {answer}"
+        distractors = [a - b, answer + 1, answer - 1, answer * 10]
     else:  # hard
         b = random.randint(5, 20)
         a = b * random.randint(10, 30)
         answer = a // b
         question = f"Divide {a} by {b}."
         solution = f"{a} ÷ {b} = {answer}"
+        distractors = [a - b, answer + 1, answer - 1, answer * 10]
     
     return {
         'question': question,
         'answer': str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_fraction_question(difficulty):
     """Generate a fraction problem based on the specified difficulty."""
+    import sympy as sp
+    
     if difficulty == 'easy':
         a = random.randint(1, 5)
         b = random.randint(a+1, 10)
@@ -289,11 +408,15 @@ def generate_fraction_question(difficulty):
             solution = f"{a}/{b} + {c}/{b} = {num}/{denom}"
             if gcd > 1:
                 solution += f" = {num//gcd}/{denom//gcd}"
+            # Adding the denominators too, not simplifying, subtracting
+            distractors = [_fraction(a + c, b + b), f"{num}/{denom}", _fraction(abs(a - c), b), _fraction(denom, num)]
         else:
             question = f"What is the simplified form of {a*2}/{b*2}?"
             gcd = sp.gcd(a*2, b*2)
             answer = f"{(a*2)//gcd}/{(b*2)//gcd}"
             solution = f"{a*2}/{b*2} = {(a*2)//gcd}/{(b*2)//gcd}"
+            # Simplifying only one part, inverting, subtracting instead of dividing
+            distractors = [f"{a}/{b*2}", f"{a*2}/{b}", _fraction(b, a), _fraction(a * 2 - 2, b * 2 - 2)]
     
     elif difficulty == 'medium':
         a = random.randint(1, 5)
@@ -328,6 +451,14 @@ def generate_fraction_question(difficulty):
                 solution += f" = {result//gcd}/{lcm//gcd}"
             else:
                 answer = f"{result}/{lcm}"
+            # Combining numerators and denominators, not scaling the numerators, not simplifying
+            sign = 1 if operation == 'add' else -1
+            distractors = [
+                _fraction(a + sign * c, b + sign * d),
+                _fraction(a + sign * c, lcm),
+                f"{result}/{lcm}",
+                _fraction(a * d - sign * b * c, b * d),
+            ]
         
         else:  # multiply
             question = f"Multiply the fractions: {a}/{b} × {c}/{d}"
@@ -339,6 +470,8 @@ def generate_fraction_question(difficulty):
             solution = f"{a}/{b} × {c}/{d} = {a*c}/{b*d}"
             if gcd > 1:
                 solution += f" = {num//gcd}/{denom//gcd}"
+            # Cross-multiplying as in division, adding the denominators, not simplifying
+            distractors = [_fraction(a * d, b * c), _fraction(a * c, b + d), f"{num}/{denom}", _fraction(a + c, b + d)]
     
     else:  # hard
         a = random.randint(1, 10)
@@ -369,6 +502,14 @@ def generate_fraction_question(difficulty):
                 solution += f" = {result//gcd}/{lcm//gcd}"
             else:
                 answer = f"{result}/{lcm}"
+            # Combining numerators and denominators, not scaling the numerators, not simplifying
+            sign = 1 if operation == 'add' else -1
+            distractors = [
+                _fraction(a + sign * c, b + sign * d),
+                _fraction(a + sign * c, lcm),
+                f"{result}/{lcm}",
+                _fraction(a * d - sign * b * c, b * d),
+            ]
         
         elif operation == 'multiply':
             question = f"Multiply the fractions: {a}/{b} × {c}/{d}"
@@ -380,6 +521,8 @@ def generate_fraction_question(difficulty):
             solution = f"{a}/{b} × {c}/{d} = {a*c}/{b*d}"
             if gcd > 1:
                 solution += f" = {num//gcd}/{denom//gcd}"
+            # Cross-multiplying as in division, adding the denominators, not simplifying
+            distractors = [_fraction(a * d, b * c), _fraction(a * c, b + d), f"{num}/{denom}", _fraction(a + c, b + d)]
         
         else:  # divide
             question = f"Divide the fractions: {a}/{b} ÷ {c}/{d}"
@@ -391,11 +534,14 @@ def generate_fraction_question(difficulty):
             solution = f"{a}/{b} ÷ {c}/{d} = {a}/{b} × {d}/{c} = {a*d}/{b*c}"
             if gcd > 1:
                 solution += f" = {num//gcd}/{denom//gcd}"
+            # Multiplying instead, inverting the wrong fraction, not simplifying
+            distractors = [_fraction(a * c, b * d), _fraction(b * c, a * d), f"{num}/{denom}", _fraction(a * d, b)]
     
     return {
         'question': question,
         'answer': answer,
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_decimal_question(difficulty):
@@ -409,6 +555,7 @@ def generate_decimal_question(difficulty):
             answer = round(a + b, 1)
             question = f"What is {a} + {b}?"
             solution = f"{a} + {b} = {answer}"
+            distractors = [round(answer + 1, 1), round(answer - 0.1, 1), round(abs(a - b), 1), round(answer * 10, 1)]
         else:
             # Ensure a > b to avoid negative answers
             if a < b:
@@ -416,6 +563,7 @@ def generate_decimal_question(difficulty):
             answer = round(a - b, 1)
             question = f"What is {a} - {b}?"
             solution = f"{a} - {b} = {answer}"
+            distractors = [round(a + b, 1), round(answer + 1, 1), round(answer - 0.1, 1), round(answer * 10, 1)]
     
     elif difficulty == 'medium':
         a = round(random.uniform(0.1, 20.0), 2)
@@ -426,6 +574,7 @@ def generate_decimal_question(difficulty):
             answer = round(a + b, 2)
             question = f"Calculate {a} + {b}."
             solution = f"{a} + {b} = {answer}"
+            distractors = [round(answer + 1, 2), round(answer - 0.1, 2), round(abs(a - b), 2), round(answer * 10, 2)]
         elif operation == '-':
             # Ensure a > b to avoid negative answers
             if a < b:
@@ -433,6 +582,7 @@ def generate_decimal_question(difficulty):
             answer = round(a - b, 2)
             question = f"Calculate {a} - {b}."
             solution = f"{a} - {b} = {answer}"
+            distractors = [round(answer + 1, 2), round(answer - 0.1, 2), round(abs(a + b), 2), round(answer * 10, 2)]
         else:  # multiplication
             # Use smaller numbers for multiplication
             a = round(random.uniform(0.1, 10.0), 1)
@@ -440,6 +590,8 @@ def generate_decimal_question(difficulty):
             answer = round(a * b, 2)
             question = f"Calculate {a} × {b}."
             solution = f"{a} × {b} = {answer}"
+            # Misplacing the decimal point, adding instead
+            distractors = [round(a * b * 10, 2), round(a * b / 10, 2), round(a + b, 2), round(answer + 1, 2)]
     
     else:  # hard
         operation = random.choice(['+', '-', '*', '/'])
@@ -452,6 +604,7 @@ def generate_decimal_question(difficulty):
                 answer = round(a + b, 2)
                 question = f"Calculate {a} + {b}."
                 solution = f"{a} + {b} = {answer}"
+                distractors = [round(answer + 1, 2), round(answer - 0.1, 2), round(abs(a - b), 2), round(answer * 10, 2)]
             else:
                 # Ensure a > b to avoid negative answers
                 if a < b:
@@ -459,6 +612,7 @@ def generate_decimal_question(difficulty):
                 answer = round(a - b, 2)
                 question = f"Calculate {a} - {b}."
                 solution = f"{a} - {b} = {answer}"
+                distractors = [round(answer + 1, 2), round(answer - 0.1, 2), round(abs(a + b), 2), round(answer * 10, 2)]
         
         elif operation == '*':
             a = round(random.uniform(0.1, 10.0), 2)
@@ -466,6 +620,8 @@ def generate_decimal_question(difficulty):
             answer = round(a * b, 2)
             question = f"Calculate {a} × {b}."
             solution = f"{a} × {b} = {answer}"
+            # Misplacing the decimal point, adding instead
+            distractors = [round(a * b * 10, 2), round(a * b / 10, 2), round(a + b, 2), round(answer + 1, 2)]
         
         else:  # division
             b = round(random.uniform(0.5, 5.0), 1)
@@ -474,11 +630,13 @@ def generate_decimal_question(difficulty):
             answer = round(a / b, 2)
             question = f"Calculate {a} ÷ {b}."
             solution = f"{a} ÷ {b} = {answer}"
+            distractors = [round(answer * 10, 2), round(answer / 10, 2), round(a * b, 2), round(answer + 1, 2)]
     
     return {
         'question': question,
         'answer': str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_percentage_question(difficulty):
@@ -490,6 +648,8 @@ def generate_percentage_question(difficulty):
         answer = (percentage / 100) * number
         question = f"What is {percentage}% of {number}?"
         solution = f"{percentage}% of {number} = {percentage/100} × {number} = {answer}"
+        # Misplacing the decimal point, the remaining part, dividing instead
+        distractors = [answer * 10, number - answer, answer / 10, number / percentage]
     
     elif difficulty == 'medium':
         question_type = random.choice(['find_percentage', 'find_number'])
@@ -502,6 +662,8 @@ def generate_percentage_question(difficulty):
             answer = percentage
             question = f"{a} is what percentage of {b}?"
             solution = f"{a} ÷ {b} × 100 = {a/b:.2f} × 100 = {percentage}%"
+            # Inverting the ratio, the remaining percentage, forgetting to multiply by 100
+            distractors = [round(b / a * 100) if a else None, 100 - percentage, round(a / b, 2), percentage * 2]
         
         else:  # find_number
             # Find the original number when given a percentage of it
@@ -511,6 +673,8 @@ def generate_percentage_question(difficulty):
             answer = original
             question = f"If {percentage}% of a number is {result}, what is the original number?"
             solution = f"Let x be the original number.\n{percentage}% of x = {result}\n{percentage/100} × x = {result}\nx = {result} ÷ {percentage/100} = {result} × {100/percentage} = {original}"
+            # Taking the percentage instead, adding it, the remaining part
+            distractors = [result * percentage / 100, result + percentage, result * (100 - percentage) / 100, original / 10]
     
     else:  # hard
         question_type = random.choice(['increase_decrease', 'complex'])
@@ -526,11 +690,14 @@ def generate_percentage_question(difficulty):
                 answer = new_value
                 question = f"If {original} is increased by {percentage}%, what is the new value?"
                 solution = f"New value = {original} × (1 + {percentage}/100) = {original} × {1 + percentage/100} = {new_value}"
+                # The change alone, adding the percentage as a number, decreasing instead
+                distractors = [original * percentage / 100, original + percentage, original * (1 - percentage/100)]
             else:
                 new_value = original * (1 - percentage/100)
                 answer = new_value
                 question = f"If {original} is decreased by {percentage}%, what is the new value?"
                 solution = f"New value = {original} × (1 - {percentage}/100) = {original} × {1 - percentage/100} = {new_value}"
+                distractors = [original * percentage / 100, original - percentage, original * (1 + percentage/100)]
         
         else:  # complex
             # Multi-step percentage problem
@@ -542,16 +709,22 @@ def generate_percentage_question(difficulty):
             final = intermediate * (1 - percent2/100)
             answer = final
             question = f"A value of {original} is increased by {percent1}% and then decreased by {percent2}%. What is the final value?"
+            # Netting the percentages, stopping after one step, decreasing first by the wrong base
+            distractors = [original * (1 + (percent1 - percent2)/100), intermediate, original * (1 - percent2/100), original]
             solution = f"First increase: {original} × (1 + {percent1}/100) = {original} × {1 + percent1/100} = {intermediate}\nThen decrease: {intermediate} × (1 - {percent2}/100) = {intermediate} × {1 - percent2/100} = {final}"
     
     return {
         'question': question,
         'answer': str(round(answer, 2)) if isinstance(answer, float) else str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': [round(distractor, 2) if isinstance(distractor, float) else distractor for distractor in distractors]
     }
 
 def generate_algebra_question(difficulty):
     """Generate an algebra problem based on the specified difficulty."""
+    import sympy as sp
+    from sympy import symbols
+    
     x = symbols('x')
     
     if difficulty == 'easy':
@@ -564,6 +737,8 @@ def generate_algebra_question(difficulty):
         
         question = f"Solve for x: {equation}"
         solution = f"{equation}\n{a}x = {c} - {b}\n{a}x = {c-b}\nx = {solution_value}"
+        # Adding b instead of subtracting, forgetting to divide, dividing only c
+        distractors = [(c + b) / a, c - b, (b - c) / a, c / a - b]
         
         if solution_value.is_integer():
             answer = str(int(solution_value))
@@ -586,6 +761,8 @@ def generate_algebra_question(difficulty):
             
             question = f"Solve for x: {equation}"
             solution = f"{equation}\n{a}x - {c}x = {d} - {b}\n{a-c}x = {d-b}\nx = {solution_value}"
+            # Sign errors moving terms across
+            distractors = [(d + b) / (a - c), (d - b) / (a + c), (b - d) / (a - c), d - b]
             
             if solution_value.is_integer():
                 answer = str(int(solution_value))
@@ -607,6 +784,8 @@ def generate_algebra_question(difficulty):
             question = f"Find the roots of the quadratic equation: {equation}"
             solution = f"{equation}\nUsing the quadratic formula or factoring:\n(x - {a})(x - {b}) = 0\nx = {a} or x = {b}"
             answer = f"{a}, {b}" if a < b else f"{b}, {a}"
+            # Sign error in the factors, the coefficients, one sign flipped
+            distractors = [_pair(-a, -b), _pair(a + b, a * b), _pair(a, -b), _pair(-a, b)]
     
     else:  # hard
         question_type = random.choice(['quadratic', 'system', 'word_problem'])
@@ -631,10 +810,16 @@ def generate_algebra_question(difficulty):
             solution = f"{equation}\nUsing the quadratic formula:\nx = (-{b} ± √({b}² - 4 × {a} × {c})) / (2 × {a})\nx = ({-b} ± √{discriminant}) / {2*a}\nx₁ = {sol1}\nx₂ = {sol2}"
             
             # Format the answer nicely
-            if sol1.is_integer() and sol2.is_integer():
+            if sol1.is_integer and sol2.is_integer:
                 answer = f"{int(sol1)}, {int(sol2)}" if sol1 < sol2 else f"{int(sol2)}, {int(sol1)}"
             else:
                 answer = f"{sol1}, {sol2}" if sol1 < sol2 else f"{sol2}, {sol1}"
+            # Dropping the sign of b, dividing by a instead of 2a, forgetting the square root
+            distractors = [
+                _pair(-sol1, -sol2),
+                _pair(sol1 * 2, sol2 * 2),
+                _pair(sp.Rational(-b + discriminant, 2*a), sp.Rational(-b - discriminant, 2*a)),
+            ]
         
         elif question_type == 'system':
             # System of two linear equations with integer solutions
@@ -662,6 +847,8 @@ def generate_algebra_question(difficulty):
             question = f"Solve the system of equations:\n{a1}x + {b1}y = {c1}\n{a2}x + {b2}y = {c2}"
             solution = f"Using substitution or elimination:\nFrom the first equation: {a1}x + {b1}y = {c1}\nFrom the second equation: {a2}x + {b2}y = {c2}\nSolving the system gives x = {x_val}, y = {y_val}"
             answer = f"x = {x_val}, y = {y_val}"
+            # Swapping the values, sign errors
+            distractors = [f"x = {y_val}, y = {x_val}", f"x = {-x_val}, y = {-y_val}", f"x = {x_val}, y = {-y_val}", f"x = {-x_val}, y = {y_val}"]
         
         else:  # word_problem
             # Age problem: current sum is a, in b years sum will be c
@@ -677,11 +864,18 @@ def generate_algebra_question(difficulty):
             question = f"A person is {sum_now - current_age2} years older than another person. The sum of their ages is {sum_now}. In {years_later} years, the ratio of their ages will be {ratio_later}. Find their current ages."
             solution = f"Let x be the age of the older person and y be the age of the younger person.\nWe know x - y = {sum_now - current_age2} and x + y = {sum_now}.\nFrom the first equation: x = y + {sum_now - current_age2}\nSubstituting into the second equation: (y + {sum_now - current_age2}) + y = {sum_now}\n2y + {sum_now - current_age2} = {sum_now}\n2y = {current_age2}\ny = {current_age2}\nTherefore, x = {current_age1} and y = {current_age2}"
             answer = f"{current_age1}, {current_age2}"
+            # The ages in the future, the sum in place of an age
+            distractors = [
+                f"{current_age1 + years_later}, {current_age2 + years_later}",
+                f"{sum_now}, {current_age2}",
+                f"{current_age1 - current_age2}, {current_age2}",
+            ]
     
     return {
         'question': question,
         'answer': answer,
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_geometry_question(difficulty):
@@ -699,10 +893,14 @@ def generate_geometry_question(difficulty):
                 answer = length * width
                 question = f"What is the area of a rectangle with length {length} units and width {width} units?"
                 solution = f"Area of a rectangle = length × width = {length} × {width} = {answer} square units"
+                # The perimeter, adding the sides
+                distractors = [2 * (length + width), length + width, 2 * length * width]
             else:
                 answer = 2 * (length + width)
                 question = f"What is the perimeter of a rectangle with length {length} units and width {width} units?"
                 solution = f"Perimeter of a rectangle = 2 × (length + width) = 2 × ({length} + {width}) = 2 × {length + width} = {answer} units"
+                # The area, one of each side only
+                distractors = [length * width, length + width, 2 * length + width]
         
         elif shape == 'square':
             side = random.randint(2, 15)
@@ -712,10 +910,14 @@ def generate_geometry_question(difficulty):
                 answer = side ** 2
                 question = f"What is the area of a square with side length {side} units?"
                 solution = f"Area of a square = side² = {side}² = {answer} square units"
+                # The perimeter, doubling instead of squaring
+                distractors = [4 * side, 2 * side, side ** 3]
             else:
                 answer = 4 * side
                 question = f"What is the perimeter of a square with side length {side} units?"
                 solution = f"Perimeter of a square = 4 × side = 4 × {side} = {answer} units"
+                # The area, counting two sides
+                distractors = [side ** 2, 2 * side, 3 * side]
         
         else:  # triangle
             base = random.randint(3, 15)
@@ -724,6 +926,8 @@ def generate_geometry_question(difficulty):
             answer = (base * height) / 2
             question = f"What is the area of a triangle with base {base} units and height {height} units?"
             solution = f"Area of a triangle = ½ × base × height = ½ × {base} × {height} = {answer} square units"
+            # Forgetting the half, adding
+            distractors = [base * height, base + height, (base + height) / 2]
     
     elif difficulty == 'medium':
         # More complex shapes or Pythagorean theorem
@@ -737,10 +941,14 @@ def generate_geometry_question(difficulty):
                 answer = round(3.14159 * (radius ** 2), 2)
                 question = f"What is the area of a circle with radius {radius} units? (Use π ≈ 3.14159)"
                 solution = f"Area of a circle = πr² = 3.14159 × {radius}² = 3.14159 × {radius**2} = {answer} square units"
+                # The circumference, using the diameter, doubling instead of squaring
+                distractors = [round(2 * 3.14159 * radius, 2), round(3.14159 * (2 * radius) ** 2, 2), round(3.14159 * radius, 2)]
             else:
                 answer = round(2 * 3.14159 * radius, 2)
                 question = f"What is the circumference of a circle with radius {radius} units? (Use π ≈ 3.14159)"
                 solution = f"Circumference of a circle = 2πr = 2 × 3.14159 × {radius} = {answer} units"
+                # The area, forgetting the 2, using the diameter as the radius
+                distractors = [round(3.14159 * (radius ** 2), 2), round(3.14159 * radius, 2), round(4 * 3.14159 * radius, 2)]
         
         elif shape == 'trapezoid':
             base1 = random.randint(5, 15)
@@ -750,6 +958,8 @@ def generate_geometry_question(difficulty):
             answer = (base1 + base2) * height / 2
             question = f"What is the area of a trapezoid with parallel sides of lengths {base1} units and {base2} units, and height {height} units?"
             solution = f"Area of a trapezoid = ½ × (sum of parallel sides) × height = ½ × ({base1} + {base2}) × {height} = ½ × {base1 + base2} × {height} = {answer} square units"
+            # Forgetting the half, multiplying the sides
+            distractors = [(base1 + base2) * height, base1 * base2 * height / 2, (base1 + base2 + height) / 2]
         
         else:  # right_triangle (Pythagorean theorem)
             # Use Pythagorean triples for clean answers
@@ -766,16 +976,21 @@ def generate_geometry_question(difficulty):
             if unknown == 'a':
                 answer = a
                 question = f"In a right triangle, if one leg is {b} units and the hypotenuse is {c} units, what is the length of the other leg?"
+                # Adding the squares, subtracting the sides
+                distractors = [round((b ** 2 + c ** 2) ** 0.5, 2), c - b, c ** 2 - b ** 2]
                 solution = f"Using the Pythagorean theorem: a² + b² = c²\na² + {b}² = {c}²\na² + {b**2} = {c**2}\na² = {c**2} - {b**2}\na² = {c**2 - b**2}\na = √{c**2 - b**2} = {answer} units"
             
             elif unknown == 'b':
                 answer = b
                 question = f"In a right triangle, if one leg is {a} units and the hypotenuse is {c} units, what is the length of the other leg?"
+                distractors = [round((a ** 2 + c ** 2) ** 0.5, 2), c - a, c ** 2 - a ** 2]
                 solution = f"Using the Pythagorean theorem: a² + b² = c²\n{a}² + b² = {c}²\n{a**2} + b² = {c**2}\nb² = {c**2} - {a**2}\nb² = {c**2 - a**2}\nb = √{c**2 - a**2} = {answer} units"
             
             else:  # unknown == 'c'
                 answer = c
                 question = f"In a right triangle with legs of lengths {a} units and {b} units, what is the length of the hypotenuse?"
+                # Adding the legs, forgetting the square root
+                distractors = [a + b, a ** 2 + b ** 2, round(abs(b ** 2 - a ** 2) ** 0.5, 2)]
                 solution = f"Using the Pythagorean theorem: a² + b² = c²\n{a}² + {b}² = c²\n{a**2} + {b**2} = c²\nc² = {a**2 + b**2}\nc = √{a**2 + b**2} = {answer} units"
     
     else:  # hard
@@ -790,6 +1005,8 @@ def generate_geometry_question(difficulty):
                 answer = side ** 3
                 question = f"What is the volume of a cube with side length {side} units?"
                 solution = f"Volume of a cube = side³ = {side}³ = {answer} cubic units"
+                # Squaring, the surface area, tripling
+                distractors = [side ** 2, 6 * side ** 2, 3 * side]
             
             elif shape == 'cylinder':
                 radius = random.randint(2, 8)
@@ -797,12 +1014,16 @@ def generate_geometry_question(difficulty):
                 answer = round(3.14159 * (radius ** 2) * height, 2)
                 question = f"What is the volume of a cylinder with radius {radius} units and height {height} units? (Use π ≈ 3.14159)"
                 solution = f"Volume of a cylinder = πr²h = 3.14159 × {radius}² × {height} = 3.14159 × {radius**2} × {height} = {answer} cubic units"
+                # Not squaring the radius, using the diameter, the lateral area
+                distractors = [round(3.14159 * radius * height, 2), round(3.14159 * (2 * radius) ** 2 * height, 2), round(2 * 3.14159 * radius * height, 2)]
             
             else:  # sphere
                 radius = random.randint(2, 10)
                 answer = round((4/3) * 3.14159 * (radius ** 3), 2)
                 question = f"What is the volume of a sphere with radius {radius} units? (Use π ≈ 3.14159)"
                 solution = f"Volume of a sphere = (4/3)πr³ = (4/3) × 3.14159 × {radius}³ = (4/3) × 3.14159 × {radius**3} = {answer} cubic units"
+                # The surface area, forgetting 4/3, squaring
+                distractors = [round(4 * 3.14159 * radius ** 2, 2), round(3.14159 * radius ** 3, 2), round((4/3) * 3.14159 * radius ** 2, 2)]
         
         elif problem_type == 'similar_triangles':
             # Similar triangles problem
@@ -817,6 +1038,8 @@ def generate_geometry_question(difficulty):
             question = f"Two triangles are similar. In the smaller triangle, one side is {side1} units and another side is {unknown_side_small} units. In the larger triangle, the corresponding side to the {side1}-unit side is {side2} units. What is the length of the corresponding side to the {unknown_side_small}-unit side in the larger triangle?"
             solution = f"For similar triangles, the ratio of corresponding sides is constant.\nRatio = {side2}/{side1} = {scale}\nSo, the unknown side = {unknown_side_small} × {scale} = {unknown_side_large} units"
             answer = unknown_side_large
+            # Adding the difference instead of scaling, scaling the wrong way
+            distractors = [unknown_side_small + side2 - side1, side1 * scale + unknown_side_small, unknown_side_small * (scale + 1)]
         
         else:  # coordinate_geometry
             # Distance between two points or midpoint
@@ -832,6 +1055,8 @@ def generate_geometry_question(difficulty):
                 answer = round(((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5, 2)
                 question = f"What is the distance between the points ({x1}, {y1}) and ({x2}, {y2})?"
                 solution = f"Distance = √[(x₂ - x₁)² + (y₂ - y₁)²] = √[({x2} - {x1})² + ({y2} - {y1})²] = √[{(x2-x1)**2} + {(y2-y1)**2}] = √{(x2-x1)**2 + (y2-y1)**2} = {answer} units"
+                # Forgetting the square root, adding the differences, adding the coordinates
+                distractors = [(x2 - x1) ** 2 + (y2 - y1) ** 2, abs(x2 - x1) + abs(y2 - y1), round(((x2 + x1) ** 2 + (y2 + y1) ** 2) ** 0.5, 2)]
             
             else:  # midpoint
                 mid_x = (x1 + x2) / 2
@@ -846,15 +1071,24 @@ def generate_geometry_question(difficulty):
                 question = f"What is the midpoint of the line segment connecting the points ({x1}, {y1}) and ({x2}, {y2})?"
                 solution = f"Midpoint = ((x₁ + x₂)/2, (y₁ + y₂)/2) = (({x1} + {x2})/2, ({y1} + {y2})/2) = ({mid_x}, {mid_y})"
                 answer = f"({mid_x}, {mid_y})"
+                # Halving the differences, forgetting to halve, swapping the coordinates
+                distractors = [
+                    f"({(x2 - x1) / 2:g}, {(y2 - y1) / 2:g})",
+                    f"({x1 + x2}, {y1 + y2})",
+                    f"({mid_y}, {mid_x})",
+                ]
     
     return {
         'question': question,
         'answer': str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
 
 def generate_statistics_question(difficulty):
     """Generate a statistics problem based on the specified difficulty."""
+    import sympy as sp
+    
     if difficulty == 'easy':
         # Mean, median, mode of a small dataset
         stat_type = random.choice(['mean', 'median', 'mode'])
@@ -876,6 +1110,8 @@ def generate_statistics_question(difficulty):
             question = f"What is the mean (average) of the following numbers: {data_str}?"
             solution = f"Mean = (sum of all values) ÷ (number of values) = ({sum(data)}) ÷ {len(data)} = {mean}"
             answer = mean
+            # The sum, dividing by one too few, the middle value
+            distractors = [sum(data), round(sum(data) / (len(data) - 1), 2), sorted(data)[len(data) // 2]]
         
         elif stat_type == 'median':
             # Create data where finding the median is straightforward
@@ -906,6 +1142,8 @@ def generate_statistics_question(difficulty):
                 solution = f"First, arrange the numbers in ascending order: {sorted_data_str}\nFor an odd number of values, the median is the middle value.\nMedian = {sorted(data)[middle]}"
             
             answer = median
+            # The unsorted middle value, the mean, one middle value only
+            distractors = [data[len(data) // 2], round(sum(data) / len(data), 2), sorted(data)[len(data) // 2]]
         
         else:  # mode
             # Create data with a clear mode
@@ -936,6 +1174,8 @@ def generate_statistics_question(difficulty):
             solution += f"Therefore, {mode_value} is the mode with {mode_count} occurrences."
             
             answer = mode_value
+            # The mode's count, the middle value, the largest value
+            distractors = [mode_count, sorted(data)[len(data) // 2], max(data)]
     
     elif difficulty == 'medium':
         # Range, variance, or probability
@@ -957,6 +1197,8 @@ def generate_statistics_question(difficulty):
             question = f"What is the range of the following dataset: {data_str}?"
             solution = f"Range = maximum value - minimum value = {max_val} - {min_val} = {range_val}"
             answer = range_val
+            # The maximum, the sum of the extremes, the difference of the first and last listed
+            distractors = [max_val, max_val + min_val, abs(data[-1] - data[0])]
         
         elif stat_type == 'variance':
             # Generate data for simple variance calculation
@@ -986,6 +1228,12 @@ def generate_statistics_question(difficulty):
             solution += f"\nStep 3: Find the average of the squared deviations:\nVariance = ({' + '.join(map(str, squared_deviations))}) ÷ {len(data)} = {sum(squared_deviations)} ÷ {len(data)} = {variance:.2f}"
             
             answer = round(variance, 2)
+            # The standard deviation, dividing by n - 1, forgetting to square
+            distractors = [
+                round(variance ** 0.5, 2),
+                round(sum(squared_deviations) / (len(data) - 1), 2),
+                round(sum(abs(x - mean) for x in data) / len(data), 2),
+            ]
         
         else:  # probability
             # Simple probability problems
@@ -1107,6 +1355,14 @@ def generate_statistics_question(difficulty):
                     answer = f"{favorable//gcd}/{total//gcd}"
                 else:
                     answer = f"{favorable}/{total}"
+            
+            # The complement, outcomes against each other, not simplified
+            numerator, denominator = (int(part) for part in answer.split('/'))
+            distractors = [
+                _fraction(denominator - numerator, denominator),
+                _fraction(numerator, denominator - numerator),
+                _fraction(numerator, denominator * 2),
+            ]
     
     else:  # hard
         # Standard deviation, normal distribution, or complex probability
@@ -1142,6 +1398,12 @@ def generate_statistics_question(difficulty):
             solution += f"Step 4: Take the square root of the variance to find the standard deviation:\nStandard deviation = √{variance:.4f} = {std_dev:.2f}"
             
             answer = round(std_dev, 2)
+            # The variance, dividing by n - 1, the mean absolute deviation
+            distractors = [
+                round(variance, 2),
+                round((sum(squared_deviations) / (len(data) - 1)) ** 0.5, 2),
+                round(sum(abs(x - mean) for x in data) / len(data), 2),
+            ]
         
         elif stat_type == 'normal_dist':
             # Problem involving normal distribution
@@ -1179,6 +1441,9 @@ def generate_statistics_question(difficulty):
                 solution = f"Step 1: Find the Z-score:\nZ = (x - μ) ÷ σ = ({value} - {mean}) ÷ {std_dev} = {z_score}\n\nStep 2: Find the probability using the standard normal table:\nP(Z < {z_score}) = {probability:.4f}"
             
             answer = round(probability, 4)
+            # The other tail, the area between the mean and the value (as
+            # tables that start at z = 0 give it), half of it
+            distractors = [round(1 - probability, 4), round(abs(probability - 0.5), 4), round(probability / 2, 4)]
         
         else:  # conditional_prob
             # Conditional probability problems
@@ -1273,6 +1538,12 @@ def generate_statistics_question(difficulty):
                     answer = f"{second_favorable//gcd}/{total_remain//gcd}"
                 else:
                     answer = f"{second_favorable}/{total_remain}"
+                # Forgetting the first card is gone, the joint probability, the first draw's probability
+                distractors = [
+                    _fraction(second_favorable + (1 if first_condition == second_condition else 0), 52),
+                    _fraction(first_favorable * second_favorable, 52 * 51),
+                    _fraction(first_favorable, 52),
+                ]
             
             else:
                 # Disease testing problem (sensitivity and specificity)
@@ -1304,9 +1575,12 @@ def generate_statistics_question(difficulty):
                 solution += f"P(Disease|Positive) = ({test_sensitivity:.4f} × {disease_prevalence:.4f}) ÷ {p_positive:.4f} = {p_disease_given_positive:.4f}"
                 
                 answer = round(p_disease_given_positive, 4)
+                # Confusing the conditional with the sensitivity, the base rate or P(positive)
+                distractors = [test_sensitivity, disease_prevalence, round(p_positive, 4)]
     
     return {
         'question': question,
         'answer': str(answer),
-        'solution': solution
+        'solution': solution,
+        'distractors': distractors
     }
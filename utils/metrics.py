@@ -0,0 +1,219 @@
+import threading
+import time
+
+# Metrics are off until enable_metrics() is called; while off, every
+# recording call returns after a single flag check
+_enabled = False
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def enable_metrics(enabled=True):
+    """Turn metric recording on or off for this process."""
+    global _enabled
+    _enabled = enabled
+
+def metrics_enabled():
+    return _enabled
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class _NullTimer:
+    """Timer returned while metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    """Context manager that observes its elapsed time into a histogram."""
+
+    __slots__ = ('histogram', 'key', 'started')
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram._observe(self.key, time.perf_counter() - self.started)
+        return False
+
+class Metric:
+    """Base class for labelled metrics."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def _label_pairs(self, key):
+        return list(zip(self.labelnames, key))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        """Return the metric in Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{_format_labels(self._label_pairs(key))} {value}"
+
+class Gauge(Metric):
+    """Value that goes up and down (for example requests in flight)."""
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        if not _enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _render_value(self, key, value):
+        yield f"{self.name}{_format_labels(self._label_pairs(key))} {value}"
+
+class Histogram(Metric):
+    """Distribution of observed values (typically durations in seconds)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        self._observe(self._key(labels), value)
+
+    def time(self, **labels):
+        """Return a context manager that observes the duration of its block."""
+        if not _enabled:
+            return _NULL_TIMER
+        return _Timer(self, self._key(labels))
+
+    def _observe(self, key, value):
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        pairs = self._label_pairs(key)
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield f"{self.name}_bucket{_format_labels(pairs + [('le', repr(float(bound)))])} {cumulative}"
+        yield f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}"
+        yield f"{self.name}_sum{_format_labels(pairs)} {total}"
+        yield f"{self.name}_count{_format_labels(pairs)} {count}"
+
+# Every metric created, in definition order
+REGISTRY = []
+
+def render_metrics():
+    """Render all metrics in Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+# Hot-path metrics shared by the app and the utils modules
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time spent handling requests.', ('endpoint', 'method', 'status')
+)
+DB_QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds', 'Time spent executing database statements.', ('operation',)
+)
+QUESTION_GENERATION_SECONDS = Histogram(
+    'question_generation_duration_seconds', 'Time spent generating one question.', ('topic', 'difficulty')
+)
+QR_ENCODE_SECONDS = Histogram(
+    'qr_encode_duration_seconds', 'Time spent encoding QR codes (cache misses only).'
+)
+PDF_BUILD_SECONDS = Histogram(
+    'pdf_build_duration_seconds', 'Time spent building PDFs.', ('kind',)
+)
+TESTS_CREATED = Counter('tests_created_total', 'Test templates created.')
+VERSIONS_CREATED = Counter('test_versions_created_total', 'Test versions created.')
+QUESTIONS_CREATED = Counter('questions_created_total', 'Questions created.')
+ADMISSION_DECISIONS = Counter(
+    'admission_decisions_total', 'Admission decisions for rate-limited endpoint classes.', ('gate', 'outcome')
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    'admission_wait_duration_seconds', 'Time admitted requests spent waiting for a slot.', ('gate',)
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    'admission_in_flight', 'Admitted requests currently running in this process.', ('gate',)
+)
+FRAGMENT_CACHE_LOOKUPS = Counter(
+    'fragment_cache_lookups_total', 'Rendered-fragment cache lookups by result (memory, disk or miss).',
+    ('fragment', 'result')
+)
+SUBMISSIONS_RECEIVED = Counter(
+    'submissions_received_total', 'Student submissions received, by outcome (accepted or duplicate).', ('outcome',)
+)
+SUBMISSIONS_WRITTEN = Counter('submissions_written_total', 'Student submissions written to the database.')
+SUBMISSIONS_FAILED = Counter(
+    'submissions_failed_total', 'Student submissions set aside in the dead-letter file after failed writes.'
+)
+SUBMISSION_FLUSH_SECONDS = Histogram(
+    'submission_flush_duration_seconds', 'Time spent writing one batch of buffered submissions.'
+)
+ANSWERS_GRADED = Counter('answers_graded_total', 'Student answers graded, by result (correct or incorrect).', ('result',))
@@ -0,0 +1,142 @@
+import random
+from fractions import Fraction
+
+from utils.answer_equivalence import MAX_EXACT_PLACES, canonicalize, is_correct, normalize_response
+
+# Multiple-choice questions offer the answer and NUM_CHOICES - 1 distractors.
+#
+# Distractors come from the question generators, which derive them from the
+# intermediates of the problem (adding denominators, sign errors, forgetting
+# to simplify, perimeter for area, ...). Answers a generator has too few
+# distractors for are padded with generic slips of the answer itself.
+#
+# Choices are stored compactly: the distractors in display order, joined by
+# SEPARATOR, and the position of the answer among the choices.
+
+NUM_CHOICES = 4
+LETTERS = 'ABCD'
+SEPARATOR = '\x1f'
+
+# Last-resort distractor when an answer cannot be varied (e.g. a text answer)
+NONE_OF_THESE = 'None of these'
+
+def build_choices(answer, distractors, seed):
+    """
+    Pick and order the choices of a multiple-choice question.
+
+    Candidates equivalent to the answer or to an earlier candidate are
+    skipped, so the choices are always distinct. The order is shuffled with
+    a generator seeded by the question's own seed, so every version of a
+    test gets its own, reproducible order.
+
+    Args:
+        answer (str): The question's answer
+        distractors (list): Candidate wrong answers from the generator, most
+            plausible first; numbers are formatted like the answer and None
+            entries are skipped
+        seed: The question's generation seed
+
+    Returns:
+        tuple: (distractors in display order, position of the answer)
+    """
+    expected = canonicalize(answer)
+    seen = {_key(answer)}
+    picked = []
+    for candidate in list(distractors) + _slips(answer):
+        if candidate is None:
+            continue
+        text = format_like(candidate, answer)
+        key = _key(text)
+        # A choice the grader would accept (e.g. the answer rounded) is not a distractor
+        if key in seen or is_correct(expected, normalize_response(text)):
+            continue
+        seen.add(key)
+        picked.append(text)
+        if len(picked) == NUM_CHOICES - 1:
+            break
+    if len(picked) < NUM_CHOICES - 1:
+        picked.append(NONE_OF_THESE)
+
+    rng = random.Random(f"choices:{seed}")
+    rng.shuffle(picked)
+    return picked, rng.randrange(len(picked) + 1)
+
+def pack_choices(distractors):
+    """Join distractors for storage."""
+    return SEPARATOR.join(distractors)
+
+def unpack_choices(answer, packed, position):
+    """Return the choices of a question in display order from its stored form."""
+    choices = packed.split(SEPARATOR)
+    choices.insert(position, answer)
+    return choices
+
+def answer_letter(position):
+    """Return the letter of the choice at a position."""
+    return LETTERS[position]
+
+def grid_letter(gridded):
+    """Return the letter a choice number gridded on an answer sheet stands for ("2" is B), or None."""
+    if len(gridded) == 1 and '1' <= gridded <= str(NUM_CHOICES):
+        return LETTERS[int(gridded) - 1]
+    return None
+
+def format_like(value, answer):
+    """
+    Format a distractor value like the answer it stands next to.
+
+    Strings are taken as they are. Numbers get as many decimal places as
+    the answer has, so a distractor does not stand out by its format.
+    """
+    if isinstance(value, str):
+        return value
+    places = len(answer.rsplit('.', 1)[1]) if '.' in answer and answer.replace('.', '', 1).lstrip('-').isdigit() else 0
+    if places > MAX_EXACT_PLACES:
+        return str(float(value))
+    if places:
+        return f"{float(value):.{places}f}"
+    if Fraction(value).denominator == 1:
+        return str(int(value))
+    return str(round(float(value), 2))
+
+def _key(text):
+    """Comparison key: equal for choices that grade as the same answer."""
+    form = canonicalize(text)
+    if form.kind == 'text':
+        return ('text', form.text)
+    return (form.kind == 'tuple', form.names, tuple(round(float(value.number), 6) for value in form.values))
+
+def _slips(answer):
+    """Generic wrong answers near the answer: off by one, sign, place value, reciprocal."""
+    form = canonicalize(answer)
+    if form.kind == 'text':
+        return []
+    numbers = [value.number for value in form.values]
+    if len(numbers) == 1:
+        number = numbers[0]
+        if number and number.denominator != 1 and '/' in answer:
+            return [
+                f"{slip.numerator}/{slip.denominator}" if slip.denominator != 1 else str(slip.numerator)
+                for slip in (1 / number, number + 1, number * 2, number / 2)
+            ]
+        slips = [number + 1, number - 1, number * 10, number / 10, number * 2, number + 2, -number]
+        # Quantities that cannot be negative get no negative distractors
+        return [slip for slip in slips if slip >= 0 or number < 0]
+    if form.kind == 'vars':
+        return [', '.join(f"{name} = {_number(n)}" for name, n in zip(form.names, variant))
+                for variant in _variants(numbers)]
+    if form.kind == 'tuple':
+        return [f"({', '.join(_number(n) for n in variant)})" for variant in _variants(numbers)]
+    return [', '.join(_number(n) for n in sorted(variant)) for variant in _variants(numbers)]
+
+def _variants(numbers):
+    yield [-n for n in numbers]
+    yield list(reversed(numbers))
+    yield [numbers[0], -numbers[1]] + numbers[2:]
+    yield [n + 1 for n in numbers]
+    yield [n - 1 for n in numbers]
+
+def _number(number):
+    if number.denominator == 1:
+        return str(number.numerator)
+    return str(round(float(number), 2))
@@ -1,43 +1,386 @@
 import io
-from reportlab.lib.pagesizes import letter
+import os
+from collections import namedtuple
+from xml.sax.saxutils import escape
+from reportlab.lib.pagesizes import letter, landscape
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import (
     SimpleDocTemplate, Paragraph, Spacer, Table, 
-    TableStyle, Image, PageBreak, FrameBreak, Frame
+    TableStyle, Image, PageBreak, FrameBreak, Frame, Flowable
 )
+from reportlab import rl_config
 from reportlab.lib.units import inch
-from utils.qr_generator import generate_qr_code
+from reportlab.lib.fonts import addMapping
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+from utils.qr_generator import QR_BORDER, encode_qr_matrix, iter_qr_runs
+from utils.multiple_choice import LETTERS
+from utils.bubble_sheet import (
+    PAGE_WIDTH, PAGE_HEIGHT, block_shapes, page_questions, sheet_pages, sheet_shapes, slot_offset
+)
+from utils.pdf_stamp import HEADER_FORM, HEADER_X, HEADER_Y, HEADER_FONT, HEADER_FONT_SIZE
+from utils.pdf_version import PDF_RENDERER_VERSION  # noqa: F401
+from utils.metrics import PDF_BUILD_SECONDS
+
+# Write binary streams; ASCII85 encoding inflates compressed streams by 25%
+rl_config.useA85 = 0
+
+# Unicode fonts embedded (as subsets) in optimized output, first match wins.
+# The standard PDF fonts lack symbols such as √ and π; Vera ships with ReportLab.
+# Bold text (headings) keeps the standard Helvetica-Bold to avoid embedding a
+# second font program in every file.
+PDF_FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    'Vera.ttf',
+]
+
+PDF_FONT_NAME = 'MathSans'
 
-def generate_test_pdf(test_version, questions, answer_key_url=None, version_number=None, include_answers=False):
+_font_registered = False
+
+def register_pdf_fonts(font_path=None):
     """
-    Generate a PDF for a math test.
+    Register the Unicode font used by optimized PDFs.
     
     Args:
-        test_version: The TestVersion model object (or Test model for legacy support)
-        questions: List of Question model objects
-        answer_key_url: URL to the answer key (for QR code generation)
-        version_number: Optional version number to display
-        include_answers: Whether to include answers in the PDF
+        font_path (str, optional): TrueType font file to prefer over the
+            built-in candidates; defaults to the PDF_FONT_PATH environment
+            variable
     
     Returns:
-        io.BytesIO: A buffer containing the generated PDF
+        bool: Whether a font could be registered
     """
-    # Create a buffer to store the PDF
-    buffer = io.BytesIO()
+    global _font_registered
+    font_path = font_path or os.environ.get('PDF_FONT_PATH')
+    candidates = ([font_path] if font_path else []) + PDF_FONT_CANDIDATES
+    
+    for path in candidates:
+        try:
+            font = TTFont(PDF_FONT_NAME, path)
+        except Exception:
+            continue
+        pdfmetrics.registerFont(font)
+        
+        # Map <b>/<i> markup in paragraphs onto available faces
+        addMapping(PDF_FONT_NAME, 0, 0, PDF_FONT_NAME)
+        addMapping(PDF_FONT_NAME, 1, 0, 'Helvetica-Bold')
+        addMapping(PDF_FONT_NAME, 0, 1, PDF_FONT_NAME)
+        addMapping(PDF_FONT_NAME, 1, 1, 'Helvetica-Bold')
+        _font_registered = True
+        break
+    
+    return _font_registered
+
+def get_stylesheet(optimize=True):
+    """
+    Return the paragraph stylesheet for generated PDFs.
     
-    # Create the PDF document
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=letter,
-        rightMargin=0.5*inch,
-        leftMargin=0.5*inch,
-        topMargin=0.5*inch,
-        bottomMargin=0.5*inch
-    )
+    In optimized mode regular text uses the embedded Unicode font, so math
+    symbols render reliably and only the glyphs used are embedded.
+    """
+    styles = getSampleStyleSheet()
+    if not optimize:
+        return styles
+    
+    if not _font_registered and not register_pdf_fonts():
+        return styles
+    
+    for style in styles.byName.values():
+        if getattr(style, 'fontName', None) == 'Helvetica':
+            style.fontName = PDF_FONT_NAME
+    return styles
+
+def document_options(optimize=True):
+    """
+    Return the document template keyword arguments for an output mode.
+
+    Output is invariant (fixed timestamp and document ID), so rendering the
+    same version twice gives identical bytes and strong ETags hold.
+    """
+    return {'pageCompression': 1 if optimize else 0, 'invariant': 1}
+
+class QRCodeFlowable(Flowable):
+    """Flowable drawing a packed QR matrix as vector rectangles."""
+    
+    def __init__(self, packed, size):
+        super().__init__()
+        self.packed = packed
+        self.width = size
+        self.height = size
+    
+    def draw(self):
+        extent = self.packed[0] + 2 * QR_BORDER
+        module = self.width / extent
+        
+        # One filled rectangle per horizontal run of dark modules
+        path = self.canv.beginPath()
+        for x, y, length in iter_qr_runs(self.packed):
+            path.rect(
+                (x + QR_BORDER) * module,
+                self.height - (y + QR_BORDER + 1) * module,
+                length * module,
+                module
+            )
+        self.canv.setFillColor(colors.black)
+        self.canv.drawPath(path, stroke=0, fill=1)
+
+class SharedBlock(Flowable):
+    """
+    Flowable for static content repeated throughout a document.
+    
+    The wrapped flowables are drawn once into a form XObject on first use;
+    every later occurrence only references it, so instruction blocks and
+    answer lines cost a few bytes per repetition.
+    """
+    
+    def __init__(self, name, flowables):
+        super().__init__()
+        self.name = name
+        self.flowables = flowables
+    
+    def wrap(self, availWidth, availHeight):
+        self._sizes = [f.wrap(availWidth, availHeight) for f in self.flowables]
+        self.width = availWidth
+        self.height = sum(height for _, height in self._sizes)
+        return self.width, self.height
+    
+    def draw(self):
+        form_name = f"Shared{self.name}W{int(self.width)}"
+        if not self.canv.hasForm(form_name):
+            self.canv.beginForm(form_name, 0, 0, self.width, self.height)
+            y = self.height
+            for flowable, (_, height) in zip(self.flowables, self._sizes):
+                y -= height
+                flowable.drawOn(self.canv, 0, y)
+            self.canv.endForm()
+        self.canv.doForm(form_name)
+
+class AnswerSheetPage(Flowable):
+    """
+    Flowable drawing a machine-readable answer sheet page (see utils.bubble_sheet).
+    
+    The sheet is laid out in absolute page coordinates, which the scan
+    reader relies on, so it ignores the frame and draws over the whole page.
+    The bubble grid of a question is drawn once per document as a form and
+    placed for every question, which keeps each sheet page to a few KB.
+    """
+    
+    def __init__(self, title, access_code, num_questions, page, multiple_choice=False):
+        super().__init__()
+        self.title = title
+        self.access_code = access_code
+        self.num_questions = num_questions
+        self.page = page
+        self.multiple_choice = multiple_choice
+    
+    def wrap(self, availWidth, availHeight):
+        return (0, 0)
+    
+    def draw(self):
+        canv = self.canv
+        canv.saveState()
+        x, y = canv.absolutePosition(0, 0)
+        canv.translate(-x, -y)
+        if not canv.hasForm('AnswerSheetBlock'):
+            canv.beginForm('AnswerSheetBlock', 0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+            self._draw_shapes(block_shapes())
+            canv.endForm()
+        self._draw_shapes(sheet_shapes(
+            self.title, self.access_code, self.num_questions, self.page,
+            blocks=False, multiple_choice=self.multiple_choice
+        ))
+        for slot in range(page_questions(self.num_questions, self.page)):
+            canv.saveState()
+            canv.translate(*slot_offset(slot))
+            canv.doForm('AnswerSheetBlock')
+            canv.restoreState()
+        canv.restoreState()
+    
+    def _draw_shapes(self, shapes):
+        canv = self.canv
+        canv.setFillColor(colors.black)
+        canv.setStrokeColor(colors.black)
+        canv.setLineWidth(0.5)
+        for shape in shapes:
+            if shape[0] == 'rect':
+                _, left, bottom, width, height, filled = shape
+                canv.rect(left, bottom, width, height, stroke=1, fill=1 if filled else 0)
+            elif shape[0] == 'circle':
+                _, center_x, center_y, radius = shape
+                canv.circle(center_x, center_y, radius, stroke=1, fill=0)
+            else:
+                _, left, baseline, size, text = shape
+                canv.setFont('Helvetica', size)
+                canv.drawString(left, baseline, text)
+
+class SectionMarker(Flowable):
+    """Zero-size flowable marking the page where a copied section starts."""
+    
+    def wrap(self, availWidth, availHeight):
+        return (0, 0)
+    
+    def draw(self):
+        if isinstance(self.canv, CopiesCanvas):
+            self.canv.mark_section()
+
+class CopiesCanvas(Canvas):
+    """
+    Canvas that prints several copies of a document for the cost of one.
+    
+    Every page drawn during a platypus build is captured as a PDF form
+    XObject instead of being emitted. On save, the captured pages are placed
+    on real pages by reference: pages before the first SectionMarker are
+    printed once, and each marked section is repeated `copies` times. With
+    `duplex` enabled, sections with an odd page count are padded with a
+    blank page so that every copy starts on a fresh sheet.
+    """
     
+    def __init__(self, *args, copies=1, duplex=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.copies = copies
+        self.duplex = duplex
+        self.page_forms = []
+        self.section_starts = []
+        self._begin_page_form()
+    
+    def _begin_page_form(self):
+        name = f"CopiedPage{len(self.page_forms)}"
+        self.beginForm(name)
+        self.page_forms.append(name)
+    
+    def mark_section(self):
+        """Start a new copied section at the current page."""
+        self.section_starts.append(len(self.page_forms) - 1)
+    
+    def showPage(self):
+        self.endForm()
+        self._pageNumber += 1
+        self._begin_page_form()
+    
+    def _place_pages(self, names, pad=None):
+        for name in names:
+            self.doForm(name)
+            Canvas.showPage(self)
+        
+        # Pad odd-length sections so the next one starts on a new sheet
+        if self.duplex and (len(names) if pad is None else pad) % 2:
+            Canvas.showPage(self)
+    
+    def save(self):
+        # Close the (empty) form opened after the last page of the build
+        self.endForm()
+        self.page_forms.pop()
+        
+        starts = self.section_starts or [0]
+        bounds = starts + [len(self.page_forms)]
+        
+        self._place_pages(self.page_forms[:starts[0]])
+        for start, end in zip(bounds, bounds[1:]):
+            for _ in range(self.copies):
+                self._place_pages(self.page_forms[start:end])
+        
+        super().save()
+
+class StudentHeaderSlot(Flowable):
+    """
+    Zero-size flowable placing the per-student header placeholder on the page.
+    
+    The placeholder is an empty form drawn in absolute page coordinates;
+    utils.pdf_stamp.stamp_header fills it in after rendering.
+    """
+    
+    def wrap(self, availWidth, availHeight):
+        return (0, 0)
+    
+    def draw(self):
+        canv = self.canv
+        canv.saveState()
+        x, y = canv.absolutePosition(0, 0)
+        canv.translate(-x, -y)
+        if not canv.hasForm(HEADER_FORM):
+            canv.beginForm(HEADER_FORM, 0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+            # Registers the header font in the document for the stamp
+            canv.setFont(HEADER_FONT, HEADER_FONT_SIZE)
+            canv.endForm()
+        canv.doForm(HEADER_FORM)
+        canv.restoreState()
+
+def draw_student_header(canv, text):
+    """Draw a per-student header where utils.pdf_stamp.stamp_header puts it."""
+    canv.saveState()
+    canv.setFont(HEADER_FONT, HEADER_FONT_SIZE)
+    canv.drawString(HEADER_X, HEADER_Y, text.encode('cp1252', errors='replace').decode('cp1252'))
+    canv.restoreState()
+
+class RosterCanvas(CopiesCanvas):
+    """
+    Canvas that prints a test for every student on a roster.
+    
+    Like CopiesCanvas, the pages are captured as forms; each marked section
+    is a test version. On save, every student gets the pages of their
+    version, with their header drawn over the first page.
+    """
+    
+    def __init__(self, *args, students=(), duplex=False, progress=None, **kwargs):
+        super().__init__(*args, duplex=duplex, **kwargs)
+        self.students = students
+        self.progress = progress
+    
+    def save(self):
+        self.endForm()
+        self.page_forms.pop()
+        
+        bounds = self.section_starts + [len(self.page_forms)]
+        for done, (section, header) in enumerate(self.students, start=1):
+            names = self.page_forms[bounds[section]:bounds[section + 1]]
+            self.doForm(names[0])
+            draw_student_header(self, header)
+            Canvas.showPage(self)
+            self._place_pages(names[1:], pad=len(names))
+            if self.progress is not None:
+                self.progress(done)
+        
+        Canvas.save(self)
+
+def _copies_canvasmaker(copies, duplex):
+    """Return a platypus canvasmaker for the requested copy layout."""
+    if copies <= 1 and not duplex:
+        return Canvas
+    
+    def make_canvas(*args, **kwargs):
+        return CopiesCanvas(*args, copies=copies, duplex=duplex, **kwargs)
+    return make_canvas
+
+def answer_line(style, optimize=True):
+    """Return the blank answer line printed below each question."""
+    paragraph = Paragraph("Answer: _______________________________", style)
+    return SharedBlock('AnswerLine', [paragraph]) if optimize else paragraph
+
+def choice_list(question, style):
+    """Return the lettered choices printed below a multiple-choice question, or None."""
+    choices = question.get_choices() if hasattr(question, 'get_choices') else None
+    if not choices:
+        return None
+    return Paragraph('&nbsp;&nbsp;&nbsp;&nbsp;'.join(
+        f"<b>{letter}.</b> {escape(choice)}" for letter, choice in zip(LETTERS, choices)
+    ), style)
+
+def answer_text(question):
+    """Return a question's answer as printed in answer keys, with its letter for multiple choice."""
+    letter = question.get_answer_letter() if hasattr(question, 'get_answer_letter') else None
+    return f"{letter}. {question.answer}" if letter else question.answer
+
+def qr_instructions(style, optimize=True):
+    """Return the instructions printed below the answer key QR code."""
+    paragraph = Paragraph("Scan the QR code above with a smartphone to access the answer key. A password is required for access.", style)
+    return SharedBlock('QRInstructions', [paragraph]) if optimize else paragraph
+
+def _test_content(test_version, questions, answer_key_url, version_number, include_answers, qr_matrix, optimize, answer_sheet, student_header):
+    """Return the flowables of a test or answer key (see generate_test_pdf)."""
     # Define styles
-    styles = getSampleStyleSheet()
+    styles = get_stylesheet(optimize)
     title_style = styles['Title']
     heading_style = styles['Heading2']
     normal_style = styles['Normal']
@@ -74,7 +417,9 @@ def generate_test_pdf(test_version, questions, answer_key_url=None, version_numb
         description = test_version.description
     
     # Start building the PDF content
-    content = []
+    content = [SectionMarker()]
+    if student_header:
+        content.append(StudentHeaderSlot())
     
     # Add the test title and version
     if version_number is not None:
@@ -108,18 +453,24 @@ def generate_test_pdf(test_version, questions, answer_key_url=None, version_numb
         question_text = f"{i+1}. {question.question_text}"
         content.append(Paragraph(question_text, question_style))
         
+        # Multiple-choice questions list their choices
+        choices = choice_list(question, normal_style)
+        if choices is not None:
+            content.append(choices)
+        
         # Create an answer space or show the answer
         if include_answers:
-            answer_text = f"Answer: {question.answer}"
-            content.append(Paragraph(answer_text, answer_style))
+            content.append(Paragraph(f"Answer: {answer_text(question)}", answer_style))
             
             # Add solution steps if available
             if question.solution_steps:
                 solution_text = f"Solution: {question.solution_steps}"
                 content.append(Paragraph(solution_text, answer_style))
+        elif choices is not None:
+            content.append(Spacer(1, 0.2*inch))
         else:
             # Add blank space for the answer
-            content.append(Paragraph("Answer: _______________________________", normal_style))
+            content.append(answer_line(normal_style, optimize))
             content.append(Spacer(1, 0.3*inch))
     
     # Add QR code to the test (only if not including answers and a URL is provided)
@@ -128,16 +479,17 @@ def generate_test_pdf(test_version, questions, answer_key_url=None, version_numb
         content.append(Paragraph("Secure Answer Key Access", heading_style))
         content.append(Spacer(1, 0.1*inch))
         
-        # Generate QR code
-        qr_img = generate_qr_code(answer_key_url, as_image=True)
+        # Use the precomputed QR code when available
+        if qr_matrix is None:
+            qr_matrix = encode_qr_matrix(answer_key_url)
         qr_width = 2 * inch
         
-        # Add the QR code image
-        content.append(Image(qr_img, width=qr_width, height=qr_width))
+        # Add the QR code as vector graphics
+        content.append(QRCodeFlowable(qr_matrix, qr_width))
         
         # Add instructions
         content.append(Spacer(1, 0.1*inch))
-        content.append(Paragraph("Scan the QR code above with a smartphone to access the answer key. A password is required for access.", normal_style))
+        content.append(qr_instructions(normal_style, optimize))
         
         # If this is a TestVersion, include its access code if available
         if hasattr(test_version, 'get_access_code'):
@@ -150,18 +502,216 @@ def generate_test_pdf(test_version, questions, answer_key_url=None, version_numb
                 alignment=1  # Center alignment
             )))
     
+    # Add the answer sheets last, so they can be detached for scanning
+    if answer_sheet and not include_answers and hasattr(test_version, 'get_access_code'):
+        access_code = test_version.get_access_code()
+        multiple_choice = any(getattr(question, 'choices', None) is not None for question in questions)
+        for page in range(sheet_pages(len(questions))):
+            content.append(PageBreak())
+            content.append(AnswerSheetPage(title, access_code, len(questions), page, multiple_choice))
+    
+    return content
+
+def generate_test_pdf(test_version, questions, answer_key_url=None, version_number=None, include_answers=False, qr_matrix=None, copies=1, duplex=False, optimize=True, answer_sheet=False, student_header=False):
+    """
+    Generate a PDF for a math test.
+    
+    Args:
+        test_version: The TestVersion model object (or Test model for legacy support)
+        questions: List of Question model objects
+        answer_key_url: URL to the answer key (for QR code generation)
+        version_number: Optional version number to display
+        include_answers: Whether to include answers in the PDF
+        qr_matrix: Optional precomputed packed QR matrix for answer_key_url
+        copies: Number of copies of the test to include
+        duplex: Whether to pad each copy to an even page count for two-sided printing
+        optimize: Whether to compress page content, share repeated blocks and
+            embed subsetted Unicode fonts
+        answer_sheet: Whether to append machine-readable answer sheet pages
+            for scanning (test versions only, not answer keys)
+        student_header: Whether to leave a placeholder for a per-student
+            header on the first page (see utils.pdf_stamp)
+    
+    Returns:
+        io.BytesIO: A buffer containing the generated PDF
+    """
+    # Create a buffer to store the PDF
+    buffer = io.BytesIO()
+    
+    # Create the PDF document
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=letter,
+        rightMargin=0.5*inch,
+        leftMargin=0.5*inch,
+        topMargin=0.5*inch,
+        bottomMargin=0.5*inch,
+        **document_options(optimize)
+    )
+    
+    content = _test_content(
+        test_version, questions, answer_key_url, version_number, include_answers, qr_matrix,
+        optimize, answer_sheet, student_header
+    )
+    
     # Build the PDF
-    doc.build(content)
+    with PDF_BUILD_SECONDS.time(kind='answer_key' if include_answers else 'test'):
+        doc.build(content, canvasmaker=_copies_canvasmaker(copies, duplex))
     
     return buffer
 
-def generate_batch_test_pdf(test_template, test_versions):
+class QuestionData(namedtuple('QuestionData', 'question_text answer solution_steps choices answer_letter')):
+    """The fields of a Question that PDFs print; choices is None unless multiple choice."""
+    __slots__ = ()
+
+    def get_choices(self):
+        return self.choices
+
+    def get_answer_letter(self):
+        return self.answer_letter
+
+class VersionData(namedtuple('VersionData', 'title difficulty topics description version_number access_code questions qr_payload qr_matrix')):
+    """The fields of a TestVersion (and its template) that PDFs print, questions in order."""
+    __slots__ = ()
+
+    def get_access_code(self):
+        return self.access_code
+
+    def get_qr_matrix(self, answer_key_url):
+        if answer_key_url == self.qr_payload and self.qr_matrix is not None:
+            return self.qr_matrix
+        return encode_qr_matrix(answer_key_url)
+
+def version_data(test_version, answer_key_url=None):
+    """
+    Copy what render_version_pdf needs out of a loaded TestVersion.
+
+    The copy is plain tuples, so it is cheap to send to process pool
+    workers and needs no database there. The version's template,
+    questions (with choices) and QR code must already be loaded.
+
+    Args:
+        test_version: The TestVersion model object
+        answer_key_url: URL the version's QR code links to, if it has one
+    """
+    template = test_version.template
+    return VersionData(
+        template.title,
+        template.difficulty,
+        template.topics,
+        template.description,
+        test_version.version_number,
+        test_version.get_access_code(),
+        tuple(
+            QuestionData(
+                question.question_text, question.answer, question.solution_steps,
+                question.get_choices(), question.get_answer_letter()
+            )
+            for question in sorted(test_version.questions, key=lambda q: q.order)
+        ),
+        answer_key_url,
+        test_version.get_qr_matrix(answer_key_url) if answer_key_url else None,
+    )
+
+def render_version_pdf(test_version, answer_key_url=None, include_answers=False, answer_sheet=False, student_header=False):
+    """
+    Render a test version (or its answer key) to PDF bytes.
+    
+    Process pool workers are given the version as plain data from
+    version_data, so they need no database.
+    
+    Args:
+        test_version: The TestVersion model object, or its VersionData
+        answer_key_url: URL to the answer key (for QR code generation)
+        include_answers: Whether to render the answer key instead of the test
+        answer_sheet: Whether to append machine-readable answer sheets
+        student_header: Whether to leave a placeholder for a per-student header
+    
+    Returns:
+        bytes: The PDF file contents
+    """
+    if not isinstance(test_version, VersionData):
+        test_version = version_data(test_version, answer_key_url)
+    questions = test_version.questions
+    qr_matrix = None
+    if not include_answers and answer_key_url:
+        qr_matrix = test_version.get_qr_matrix(answer_key_url)
+    
+    buffer = generate_test_pdf(
+        test_version,
+        questions,
+        None if include_answers else answer_key_url,
+        version_number=test_version.version_number,
+        include_answers=include_answers,
+        qr_matrix=qr_matrix,
+        answer_sheet=answer_sheet,
+        student_header=student_header
+    )
+    return buffer.getvalue()
+
+def generate_roster_pdf(test_versions, students, answer_key_urls, duplex=False, optimize=True, progress=None):
+    """
+    Generate one print file with a test for every student on a roster.
+    
+    Each version is laid out once; students' copies place its pages by
+    reference and add only their header.
+    
+    Args:
+        test_versions: TestVersion model objects handed out, with their
+            questions and QR codes loaded
+        students: (index into test_versions, header text) per student, in
+            print order
+        answer_key_urls: Answer key URL of each version
+        duplex: Whether to pad each copy to an even page count for two-sided printing
+        optimize: Whether to compress page content, share repeated blocks and
+            embed subsetted Unicode fonts
+        progress: Optional callable, called as progress(students) after
+            each student's copy is placed
+    
+    Returns:
+        io.BytesIO: A buffer containing the generated PDF
+    """
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=letter,
+        rightMargin=0.5*inch,
+        leftMargin=0.5*inch,
+        topMargin=0.5*inch,
+        bottomMargin=0.5*inch,
+        **document_options(optimize)
+    )
+    
+    content = []
+    for i, (version, url) in enumerate(zip(test_versions, answer_key_urls)):
+        if i:
+            content.append(PageBreak())
+        content.extend(_test_content(
+            version, sorted(version.questions, key=lambda q: q.order), url, version.version_number,
+            False, version.get_qr_matrix(url), optimize, False, False
+        ))
+    
+    def make_canvas(*args, **kwargs):
+        return RosterCanvas(*args, students=students, duplex=duplex, progress=progress, **kwargs)
+    
+    with PDF_BUILD_SECONDS.time(kind='roster'):
+        doc.build(content, canvasmaker=make_canvas)
+    
+    return buffer
+
+def generate_batch_test_pdf(test_template, test_versions, copies=1, duplex=False, optimize=True, progress=None):
     """
     Generate a PDF containing all test versions in a batch.
     
     Args:
         test_template: The TestTemplate model object
         test_versions: List of TestVersion model objects
+        copies: Number of copies of each test version to include
+        duplex: Whether to pad each copy to an even page count for two-sided printing
+        optimize: Whether to compress page content, share repeated blocks and
+            embed subsetted Unicode fonts
+        progress: Optional callable, called as progress(pages) after each
+            laid-out page
     
     Returns:
         io.BytesIO: A buffer containing the generated PDF
@@ -176,11 +726,12 @@ def generate_batch_test_pdf(test_template, test_versions):
         rightMargin=0.5*inch,
         leftMargin=0.5*inch,
         topMargin=0.5*inch,
-        bottomMargin=0.5*inch
+        bottomMargin=0.5*inch,
+        **document_options(optimize)
     )
     
     # Define styles
-    styles = getSampleStyleSheet()
+    styles = get_stylesheet(optimize)
     title_style = styles['Title']
     heading_style = styles['Heading2']
     subheading_style = styles['Heading3']
@@ -253,6 +804,7 @@ def generate_batch_test_pdf(test_template, test_versions):
         answer_key_url = f"/answer-key/{version.uuid}"
         
         # Add the test
+        content.append(SectionMarker())
         content.append(Paragraph(f"{test_template.title} - Version {version.version_number}", title_style))
         content.append(Spacer(1, 0.2*inch))
         
@@ -274,8 +826,9 @@ def generate_batch_test_pdf(test_template, test_versions):
             question_text = f"{j+1}. {question.question_text}"
             content.append(Paragraph(question_text, normal_style))
             
-            # Add blank space for the answer
-            content.append(Paragraph("Answer: _______________________________", normal_style))
+            # List the choices, or add blank space for the answer
+            choices = choice_list(question, normal_style)
+            content.append(choices if choices is not None else answer_line(normal_style, optimize))
             content.append(Spacer(1, 0.2*inch))
         
         # Add QR code
@@ -283,16 +836,19 @@ def generate_batch_test_pdf(test_template, test_versions):
         content.append(Paragraph("Secure Answer Key Access", heading_style))
         content.append(Spacer(1, 0.1*inch))
         
-        # Generate QR code
-        qr_img = generate_qr_code(answer_key_url, as_image=True)
+        # Use the QR code stored at version creation when available
+        if version.qr_code is not None:
+            qr_matrix = version.qr_code.matrix
+        else:
+            qr_matrix = encode_qr_matrix(answer_key_url)
         qr_width = 2 * inch
         
-        # Add the QR code image
-        content.append(Image(qr_img, width=qr_width, height=qr_width))
+        # Add the QR code as vector graphics
+        content.append(QRCodeFlowable(qr_matrix, qr_width))
         
         # Add instructions
         content.append(Spacer(1, 0.1*inch))
-        content.append(Paragraph("Scan the QR code above with a smartphone to access the answer key. A password is required for access.", normal_style))
+        content.append(qr_instructions(normal_style, optimize))
         content.append(Spacer(1, 0.2*inch))
         content.append(Paragraph(f"Test Version ID: {version.get_access_code()}", ParagraphStyle(
             'AccessCode',
@@ -305,7 +861,130 @@ def generate_batch_test_pdf(test_template, test_versions):
         if i < len(test_versions) - 1:
             content.append(PageBreak())
     
+    # Report each finished page to the caller
+    if progress is not None:
+        doc.setProgressCallBack(lambda event, value: progress(value) if event == 'PAGE' else None)
+    
+    # Build the PDF
+    with PDF_BUILD_SECONDS.time(kind='batch'):
+        doc.build(content, canvasmaker=_copies_canvasmaker(copies, duplex))
+    
+    return buffer
+
+def generate_batch_answer_key_pdf(test_template, versions_with_questions, include_solutions=False, questions_per_block=8, optimize=True):
+    """
+    Generate a compact answer key PDF covering all versions of a test.
+    
+    Answers are laid out as a version x question grid, split into blocks of
+    question columns so that long tests still fit on a landscape page.
+    
+    Args:
+        test_template: The TestTemplate model object
+        versions_with_questions: List of (TestVersion, questions) tuples, with
+            questions already sorted by their order field
+        include_solutions: Whether to append the solution steps of every version
+        questions_per_block: Number of question columns per grid block
+        optimize: Whether to compress page content and embed subsetted
+            Unicode fonts
+    
+    Returns:
+        io.BytesIO: A buffer containing the generated PDF
+    """
+    # Create a buffer to store the PDF
+    buffer = io.BytesIO()
+    
+    # Create the PDF document
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=landscape(letter),
+        rightMargin=0.4*inch,
+        leftMargin=0.4*inch,
+        topMargin=0.4*inch,
+        bottomMargin=0.4*inch,
+        **document_options(optimize)
+    )
+    
+    # Define styles
+    styles = get_stylesheet(optimize)
+    title_style = styles['Title']
+    heading_style = styles['Heading2']
+    normal_style = styles['Normal']
+    cell_style = ParagraphStyle(
+        'AnswerCell',
+        parent=normal_style,
+        fontSize=7,
+        leading=8
+    )
+    solution_style = ParagraphStyle(
+        'SolutionStyle',
+        parent=normal_style,
+        fontSize=8,
+        leading=10,
+        leftIndent=12,
+        spaceAfter=4
+    )
+    
+    content = []
+    content.append(Paragraph(f"{escape(test_template.title)} - Answer Keys", title_style))
+    content.append(Paragraph(
+        f"{len(versions_with_questions)} versions, {test_template.num_questions} questions per version. "
+        "Confidential: for teachers only.",
+        normal_style
+    ))
+    content.append(Spacer(1, 0.2*inch))
+    
+    # One grid block per group of question columns
+    num_questions = max((len(questions) for _, questions in versions_with_questions), default=0)
+    grid_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.whitesmoke]),
+    ])
+    usable_width = landscape(letter)[0] - 0.8*inch
+    label_width = 0.9*inch
+    
+    for block_start in range(0, num_questions, questions_per_block):
+        block_end = min(block_start + questions_per_block, num_questions)
+        data = [["Version"] + [f"Q{n}" for n in range(block_start + 1, block_end + 1)]]
+        for version, questions in versions_with_questions:
+            row = [f"V{version.version_number}\n{version.get_access_code()}"]
+            for question in questions[block_start:block_end]:
+                row.append(Paragraph(escape(answer_text(question)), cell_style))
+            data.append(row)
+        
+        column_width = (usable_width - label_width) / questions_per_block
+        table = Table(
+            data,
+            colWidths=[label_width] + [column_width] * (block_end - block_start),
+            repeatRows=1
+        )
+        table.setStyle(grid_style)
+        content.append(table)
+        content.append(Spacer(1, 0.2*inch))
+    
+    # Optionally list the worked solutions, one section per version
+    if include_solutions:
+        for version, questions in versions_with_questions:
+            content.append(PageBreak())
+            content.append(Paragraph(
+                f"Version {version.version_number} ({version.get_access_code()}) - Solutions",
+                heading_style
+            ))
+            for i, question in enumerate(questions):
+                content.append(Paragraph(
+                    f"<b>{i+1}.</b> {escape(question.question_text)} <b>Answer:</b> {escape(answer_text(question))}",
+                    cell_style
+                ))
+                if question.solution_steps:
+                    steps = escape(question.solution_steps).replace('\n', '<br/>')
+                    content.append(Paragraph(steps, solution_style))
+    
     # Build the PDF
-    doc.build(content)
+    with PDF_BUILD_SECONDS.time(kind='batch_answer_keys'):
+        doc.build(content)
     
     return buffer
@@ -0,0 +1,75 @@
+import re
+
+# Per-student headers stamped on rendered test PDFs.
+#
+# A test rendered for stamping draws an empty placeholder form (see
+# StudentHeaderSlot in utils.pdf_generator) at the top of its first page.
+# Stamping appends an incremental update to the PDF that replaces the
+# placeholder with one showing the student's header: the rendered pages are
+# copied byte for byte and nothing is laid out again, so a stamp costs a few
+# hundred bytes and microseconds.
+
+HEADER_FORM = 'StudentHeader'
+
+# Where the header is drawn, in points from the bottom left of the page: in
+# the top margin, above the test title
+HEADER_X = 36
+HEADER_Y = 765
+HEADER_FONT = 'Helvetica'
+HEADER_FONT_SIZE = 10
+
+FORM_REFERENCE = re.compile(rb'/FormXob\.' + HEADER_FORM.encode() + rb' (\d+) 0 R')
+HEADER_FONT_NAME = re.compile(rb'/BaseFont /' + HEADER_FONT.encode() + rb' /Encoding /WinAnsiEncoding /Name /(\w+)')
+DICTIONARY = re.compile(rb'<<\n(.*?)\n>>\nstream\r?\n', re.DOTALL)
+TRAILER = re.compile(rb'trailer\s*<<(.*?)>>\s*startxref\s*(\d+)\s*%%EOF\s*$', re.DOTALL)
+
+class StampError(ValueError):
+    """Raised when a PDF has no header placeholder to stamp."""
+
+def header_stream(text, font_name):
+    """Return the PDF content stream drawing a header line with a WinAnsi font."""
+    encoded = text.encode('cp1252', errors='replace')
+    escaped = encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    return b'BT /%s %d Tf %d %d Td (%s) Tj ET' % (font_name, HEADER_FONT_SIZE, HEADER_X, HEADER_Y, escaped)
+
+def stamp_header(pdf, text):
+    """
+    Return a copy of a rendered test PDF with a header line on its first page.
+
+    Characters outside Windows-1252 print as '?', since the header uses a
+    standard font that is not embedded.
+
+    Args:
+        pdf (bytes): PDF rendered with a student header placeholder
+        text (str): The header, e.g. the student's name and seat
+
+    Raises:
+        StampError: If the PDF has no placeholder
+    """
+    reference = FORM_REFERENCE.search(pdf)
+    font = HEADER_FONT_NAME.search(pdf)
+    trailer = TRAILER.search(pdf, max(0, len(pdf) - 1024))
+    if reference is None or font is None or trailer is None:
+        raise StampError("The PDF was not rendered with a student header placeholder")
+
+    number = int(reference.group(1))
+    start = pdf.index(b'\n%d 0 obj\n' % number) + 1
+    dictionary = DICTIONARY.search(pdf, start).group(1)
+    stream = header_stream(text, font.group(1))
+    # Same form, uncompressed, with the header as its content
+    dictionary = re.sub(rb'/Filter (\[[^\]]*\]|/\w+) ?', b'', dictionary)
+    dictionary = re.sub(rb'/Length \d+', b'/Length %d' % len(stream), dictionary)
+
+    fields = trailer.group(1)
+    keep = b' '.join(
+        match.group(0) for match in re.finditer(rb'/(?:Root|Info) \d+ 0 R|/Size \d+|/ID\s*\[[^\]]*\]', fields)
+    )
+    offset = len(pdf)
+    update = b'%d 0 obj\n<<\n%s\n>>\nstream\n%s\nendstream\nendobj\n' % (number, dictionary, stream)
+    xref = len(pdf) + len(update)
+    return b''.join((
+        pdf,
+        update,
+        b'xref\n0 1\n0000000000 65535 f \n%d 1\n%010d 00000 n \n' % (number, offset),
+        b'trailer\n<<\n%s /Prev %s\n>>\nstartxref\n%d\n%%%%EOF\n' % (keep, trailer.group(2), xref),
+    ))
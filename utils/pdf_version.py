@@ -0,0 +1,3 @@
+# Bump whenever the PDF layout changes so cached artifacts are re-rendered.
+# Kept apart from the renderer so cache lookups do not have to import ReportLab.
+PDF_RENDERER_VERSION = 2
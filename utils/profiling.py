@@ -0,0 +1,163 @@
+import cProfile
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+
+# Sampling interval of the sampling profiler, in seconds
+SAMPLE_INTERVAL = 0.005
+
+_END = object()
+
+def token_matches(candidate, token):
+    """Compare a presented token with the configured one in constant time."""
+    return bool(token) and bool(candidate) and hmac.compare_digest(str(candidate), str(token))
+
+class StackSampler:
+    """
+    Sampling profiler for a single thread.
+
+    A background thread records the target thread's stack every interval;
+    the result is in the collapsed format read by flame graph tools.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware that profiles single requests on demand.
+
+    A request carrying the operator token in the X-Profile header or the
+    _profile query parameter runs under cProfile (or, with mode 'sample',
+    under the sampling profiler), including the streaming of its response
+    body. The stats are saved to the profile directory next to a JSON file
+    describing the request. Requests without the token pass straight
+    through.
+    """
+
+    def __init__(self, wsgi_app, token, directory, keep=50):
+        self.wsgi_app = wsgi_app
+        self.token = token
+        self.directory = directory
+        self.keep = keep
+
+    def __call__(self, environ, start_response):
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        candidate = environ.get('HTTP_X_PROFILE') or query.get('_profile', [None])[0]
+        if not token_matches(candidate, self.token):
+            return self.wsgi_app(environ, start_response)
+
+        mode = environ.get('HTTP_X_PROFILE_MODE') or query.get('_profile_mode', ['cprofile'])[0]
+        return self._profile(environ, start_response, 'sample' if mode == 'sample' else 'cprofile')
+
+    def _profile(self, environ, start_response, mode):
+        started = time.perf_counter()
+        if mode == 'sample':
+            profiler = StackSampler(threading.get_ident())
+            profiler.start()
+            call = lambda func, *args: func(*args)
+        else:
+            profiler = cProfile.Profile()
+            call = profiler.runcall
+
+        body = call(self.wsgi_app, environ, start_response)
+        try:
+            iterator = iter(body)
+            while True:
+                chunk = call(next, iterator, _END)
+                if chunk is _END:
+                    break
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            if mode == 'sample':
+                profiler.stop()
+            self._save(profiler, mode, environ, time.perf_counter() - started)
+
+    def _save(self, profiler, mode, environ, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        if mode == 'sample':
+            profiler.dump(os.path.join(self.directory, f"{name}.folded"))
+        else:
+            profiler.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+
+        info = {
+            'name': name,
+            'mode': mode,
+            'method': environ.get('REQUEST_METHOD'),
+            'path': environ.get('PATH_INFO'),
+            'query': '&'.join(
+                part for part in environ.get('QUERY_STRING', '').split('&')
+                if part and not part.startswith('_profile')
+            ),
+            'duration_ms': round(elapsed * 1000, 1),
+            'pid': os.getpid(),
+            'created': time.time(),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with open(os.path.join(self.directory, f"{name}.json"), 'w') as f:
+            json.dump(info, f)
+
+        self._prune()
+
+    def _prune(self):
+        profiles = list_profiles(self.directory)
+        for info in profiles[self.keep:]:
+            for extension in ('json', 'prof', 'folded'):
+                try:
+                    os.remove(os.path.join(self.directory, f"{info['name']}.{extension}"))
+                except FileNotFoundError:
+                    pass
+
+def list_profiles(directory):
+    """Return the saved profiles' descriptions, newest first."""
+    profiles = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return profiles
+    for filename in names:
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda info: info['created'], reverse=True)
+    return profiles
@@ -1,46 +1,209 @@
 import io
-import qrcode
-from qrcode.image.svg import SvgImage
+import struct
+import zlib
+from functools import lru_cache
 
-def generate_qr_code(data, as_image=False):
+from utils.metrics import QR_ENCODE_SECONDS
+
+# Number of light modules drawn around the matrix (the QR "quiet zone")
+QR_BORDER = 4
+
+# Pixels per module when rendering PNG images
+QR_BOX_SIZE = 10
+
+# Maximum number of distinct payloads kept in the in-process caches
+QR_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def encode_qr_matrix(data, mask_pattern=None):
     """
-    Generate a QR code from the given data.
-    
+    Encode data as a QR code and return its module matrix in packed form.
+
+    The packed form is one byte holding the matrix size followed by the
+    modules as a row-major bit stream (most significant bit first), padded
+    to a whole byte. A version 3 code fits in 140 bytes.
+
     Args:
         data (str): The data to encode in the QR code (typically a URL)
-        as_image (bool): If True, returns a PIL Image object; if False, returns SVG string
-    
+        mask_pattern (int, optional): Mask to apply; by default the mask
+            with the lowest penalty score is chosen
+
     Returns:
-        Either a PIL Image object or SVG string depending on as_image parameter
+        bytes: The packed module matrix
     """
-    # Set QR code parameters
+    import qrcode  # Imported on first use to keep worker start-up fast
+    
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+        border=0,
+        mask_pattern=mask_pattern,
     )
-    
-    # Add data
-    qr.add_data(data)
-    qr.make(fit=True)
-    
+    with QR_ENCODE_SECONDS.time():
+        qr.add_data(data)
+        qr.make(fit=True)
+
+    modules = qr.get_matrix()
+    size = len(modules)
+
+    packed = bytearray([size])
+    byte = 0
+    bit_count = 0
+    for row in modules:
+        for dark in row:
+            byte = (byte << 1) | (1 if dark else 0)
+            bit_count += 1
+            if bit_count == 8:
+                packed.append(byte)
+                byte = 0
+                bit_count = 0
+    if bit_count:
+        packed.append(byte << (8 - bit_count))
+
+    return bytes(packed)
+
+def unpack_qr_matrix(packed):
+    """
+    Expand a packed QR matrix into rows of booleans.
+
+    Args:
+        packed (bytes): A matrix produced by encode_qr_matrix
+
+    Returns:
+        list: List of rows, each a list of booleans (True for dark modules)
+    """
+    size = packed[0]
+    rows = []
+    for y in range(size):
+        row = []
+        for x in range(size):
+            index = y * size + x
+            row.append(bool(packed[1 + index // 8] & (0x80 >> (index % 8))))
+        rows.append(row)
+    return rows
+
+def iter_qr_runs(packed):
+    """
+    Yield the horizontal runs of dark modules in a packed QR matrix.
+
+    Renderers draw one rectangle per run instead of one per module, which
+    keeps SVG paths and PDF content streams small.
+
+    Args:
+        packed (bytes): A matrix produced by encode_qr_matrix
+
+    Yields:
+        tuple: (x, y, length) in module units, without the quiet zone
+    """
+    for y, row in enumerate(unpack_qr_matrix(packed)):
+        x = 0
+        size = len(row)
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                yield start, y, x - start
+            else:
+                x += 1
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_svg(packed):
+    """
+    Render a packed QR matrix as a standalone SVG document.
+
+    Args:
+        packed (bytes): A matrix produced by encode_qr_matrix
+
+    Returns:
+        str: SVG markup
+    """
+    extent = packed[0] + 2 * QR_BORDER
+    path = ''.join(
+        f"M{x + QR_BORDER} {y + QR_BORDER}h{length}v1h-{length}z"
+        for x, y, length in iter_qr_runs(packed)
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+        f'viewBox="0 0 {extent} {extent}" width="{extent}mm" height="{extent}mm" '
+        f'shape-rendering="crispEdges">'
+        f'<rect width="{extent}" height="{extent}" fill="#fff"/>'
+        f'<path d="{path}" fill="#000"/></svg>'
+    )
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_png(packed, box_size=QR_BOX_SIZE):
+    """
+    Render a packed QR matrix as a 1-bit grayscale PNG.
+
+    Args:
+        packed (bytes): A matrix produced by encode_qr_matrix
+        box_size (int): Pixels per module
+
+    Returns:
+        bytes: PNG file contents
+    """
+    modules = unpack_qr_matrix(packed)
+    extent = len(modules) + 2 * QR_BORDER
+    width = extent * box_size
+    light_row = [False] * extent
+
+    raw = bytearray()
+    for y in range(extent):
+        if QR_BORDER <= y < extent - QR_BORDER:
+            row = [False] * QR_BORDER + modules[y - QR_BORDER] + [False] * QR_BORDER
+        else:
+            row = light_row
+
+        # Pack the scaled scanline, 1 = white in a 1-bit grayscale PNG
+        line = bytearray()
+        byte = 0
+        bit_count = 0
+        for dark in row:
+            for _ in range(box_size):
+                byte = (byte << 1) | (0 if dark else 1)
+                bit_count += 1
+                if bit_count == 8:
+                    line.append(byte)
+                    byte = 0
+                    bit_count = 0
+        if bit_count:
+            line.append(byte << (8 - bit_count))
+
+        scanline = b'\x00' + bytes(line)  # Filter type 0 (None)
+        raw.extend(scanline * box_size)
+
+    def chunk(tag, body):
+        return (
+            struct.pack('>I', len(body)) + tag + body
+            + struct.pack('>I', zlib.crc32(tag + body) & 0xFFFFFFFF)
+        )
+
+    header = struct.pack('>IIBBBBB', width, width, 1, 0, 0, 0, 0)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', header)
+        + chunk(b'IDAT', zlib.compress(bytes(raw), 9))
+        + chunk(b'IEND', b'')
+    )
+
+def generate_qr_code(data, as_image=False):
+    """
+    Generate a QR code from the given data.
+
+    Encoding and rendering are cached per payload, so repeated calls for
+    the same URL (page views, PDF downloads) skip the QR encoding work.
+
+    Args:
+        data (str): The data to encode in the QR code (typically a URL)
+        as_image (bool): If True, returns a PNG image buffer; if False, returns SVG string
+
+    Returns:
+        Either an io.BytesIO PNG buffer or SVG string depending on as_image parameter
+    """
+    packed = encode_qr_matrix(data)
+
     if as_image:
-        # Create a PIL image
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Return the image
-        img_buffer = io.BytesIO()
-        img.save(img_buffer)
-        img_buffer.seek(0)
-        return img_buffer
-    else:
-        # Generate SVG
-        img = qr.make_image(image_factory=SvgImage)
-        
-        # Convert to SVG string
-        svg_buffer = io.BytesIO()
-        img.save(svg_buffer)
-        svg_string = svg_buffer.getvalue().decode('utf-8')
-        
-        return svg_string
+        return io.BytesIO(render_qr_png(packed))
+
+    return render_qr_svg(packed)
@@ -0,0 +1,22 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+_pool = None
+
+def get_render_pool(max_workers=None):
+    """
+    Return the process pool used for CPU-heavy rendering.
+
+    The pool is created on first use and shared for the life of the
+    process, so worker start-up is paid once rather than per request.
+
+    Args:
+        max_workers (int, optional): Pool size; defaults to the CPU count
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The shared pool
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+    return _pool
@@ -0,0 +1,222 @@
+import csv
+import heapq
+import io
+import json
+
+# Seating plans: which test version each seat of a room gets.
+#
+# A room is drawn as text, one line per row, front row first, one character
+# per place: '.' and spaces are gaps (aisles, missing seats) and anything
+# else is a seat. Seats are named by row letter and place number, so the
+# third place of the front row is A3 whatever gaps come before it. Seats
+# next to each other in a row, in front, behind or diagonally are
+# neighbours. Rooms that are not grids are given as a JSON adjacency list
+# instead: {"seat": ["neighbour", ...], ...}.
+
+GAPS = '. '
+
+def row_name(row):
+    """Name a row like a spreadsheet column: A ... Z, AA, AB, ..."""
+    name = ''
+    row += 1
+    while row:
+        row, remainder = divmod(row - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+def parse_grid(text, diagonal=True):
+    """
+    Read a room drawn as text.
+
+    Args:
+        text (str): The room, one line per row
+        diagonal (bool): Whether diagonally adjacent seats are neighbours
+
+    Returns:
+        tuple: (seats in row order, seat to set of neighbours, seat to
+            (row, place) position)
+    """
+    positions = {}
+    for row, line in enumerate(line for line in text.splitlines() if line.strip()):
+        for place, char in enumerate(line.rstrip()):
+            if char not in GAPS:
+                positions[f"{row_name(row)}{place + 1}"] = (row, place)
+
+    at = {position: seat for seat, position in positions.items()}
+    steps = [(0, 1), (1, 0)] + ([(1, -1), (1, 1)] if diagonal else [])
+    neighbours = {seat: set() for seat in positions}
+    for seat, (row, place) in positions.items():
+        for row_step, place_step in steps:
+            other = at.get((row + row_step, place + place_step))
+            if other is not None:
+                neighbours[seat].add(other)
+                neighbours[other].add(seat)
+    return list(positions), neighbours, positions
+
+def parse_adjacency(text):
+    """
+    Read a room given as a JSON adjacency list.
+
+    Neighbours are mutual, so a pair only needs to be listed once.
+
+    Returns:
+        tuple: (seats in listed order, seat to set of neighbours, None)
+    """
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("An adjacency list maps each seat to a list of its neighbours")
+    neighbours = {}
+    for seat, others in data.items():
+        neighbours.setdefault(str(seat), set())
+        for other in others:
+            neighbours.setdefault(str(other), set())
+            if str(other) != str(seat):
+                neighbours[str(seat)].add(str(other))
+                neighbours[str(other)].add(str(seat))
+    return list(neighbours), neighbours, None
+
+def parse_roster(text):
+    """
+    Read a class roster.
+
+    Either one student name per line, or a CSV file with a header that has
+    a name column and optionally a seat column.
+
+    Returns:
+        list: (name, seat or None) per student, in roster order
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    header = [column.strip().lower() for column in next(csv.reader([lines[0]]))]
+    if 'name' not in header:
+        return [(line.strip(), None) for line in lines]
+
+    students = []
+    for row in csv.DictReader(io.StringIO('\n'.join(lines))):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        if row['name']:
+            students.append((row['name'], row.get('seat') or None))
+    return students
+
+def seat_students(seats, students):
+    """
+    Give every student a seat.
+
+    Students with a seat on the roster keep it; the others fill the free
+    seats in order.
+
+    Returns:
+        dict: Seat to student name
+
+    Raises:
+        ValueError: If a seat is unknown or taken twice, or the room is too small
+    """
+    known = set(seats)
+    seated = {}
+    for name, seat in students:
+        if seat is None:
+            continue
+        if seat not in known:
+            raise ValueError(f"{name} is seated at {seat}, which is not in the room")
+        if seat in seated:
+            raise ValueError(f"{seated[seat]} and {name} are both seated at {seat}")
+        seated[seat] = name
+
+    free = (seat for seat in seats if seat not in seated)
+    for name, seat in students:
+        if seat is None:
+            seat = next(free, None)
+            if seat is None:
+                raise ValueError(f"The room has {len(seats)} seats for {len(students)} students")
+            seated[seat] = name
+    return seated
+
+def assign_versions(seats, neighbours, num_versions, overlap=None):
+    """
+    Give each seat a test version so that neighbours have different versions.
+
+    Seats are colored in DSATUR order: the seat whose neighbours already
+    have the most different versions goes next. Of the versions no
+    neighbour has, a seat gets one that shares no questions with its
+    neighbours' versions if it can, and otherwise the least used, so the
+    versions are handed out evenly. With too few versions for the room,
+    seats get the version the fewest neighbours have.
+
+    Args:
+        seats (list): Seat names
+        neighbours (dict): Seat to set of neighbouring seats
+        num_versions (int): Number of versions to hand out
+        overlap (list, optional): num_versions x num_versions counts of the
+            questions each pair of versions shares
+
+    Returns:
+        tuple: (seat to version index, list of neighbouring seat pairs that
+            share a version, list of neighbouring seat pairs whose versions
+            share questions)
+    """
+    if num_versions < 1:
+        raise ValueError("There are no versions to hand out")
+    sharing = [
+        {other for other in range(num_versions) if other != version and overlap[version][other]}
+        for version in range(num_versions)
+    ] if overlap else [set() for _ in range(num_versions)]
+
+    versions = {}
+    usage = [0] * num_versions
+    saturation = {seat: set() for seat in seats}
+    heap = [(0, -len(neighbours[seat]), index, seat) for index, seat in enumerate(seats)]
+    heapq.heapify(heap)
+    order = {seat: index for index, seat in enumerate(seats)}
+
+    while heap:
+        negative_saturation, _, _, seat = heapq.heappop(heap)
+        # Entries are pushed again as seats saturate; skip the stale ones
+        if seat in versions or -negative_saturation != len(saturation[seat]):
+            continue
+
+        taken = saturation[seat]
+        by_usage = sorted(range(num_versions), key=usage.__getitem__)
+        free = [version for version in by_usage if version not in taken]
+        if free:
+            version = next((version for version in free if not sharing[version] & taken), free[0])
+        else:
+            nearby = [versions[other] for other in neighbours[seat] if other in versions]
+            version = min(by_usage, key=nearby.count)
+
+        versions[seat] = version
+        usage[version] += 1
+        for other in neighbours[seat]:
+            if other not in versions and version not in saturation[other]:
+                saturation[other].add(version)
+                heapq.heappush(heap, (-len(saturation[other]), -len(neighbours[other]), order[other], other))
+
+    pairs = {tuple(sorted((seat, other), key=order.get)) for seat in seats for other in neighbours[seat]}
+    clashes = sorted((pair for pair in pairs if versions[pair[0]] == versions[pair[1]]), key=lambda pair: order[pair[0]])
+    shared = sorted(
+        (pair for pair in pairs if versions[pair[0]] != versions[pair[1]] and versions[pair[1]] in sharing[versions[pair[0]]]),
+        key=lambda pair: order[pair[0]]
+    )
+    return versions, clashes, shared
+
+def chart(positions, labels):
+    """
+    Draw a seating chart of a grid room.
+
+    Args:
+        positions (dict): Seat to (row, place), from parse_grid
+        labels (dict): Seat to the text shown for it (e.g. its version number)
+
+    Returns:
+        str: One line per row, front row first, with row letters
+    """
+    if not positions:
+        return ''
+    width = max(len(str(label)) for label in labels.values()) if labels else 1
+    rows = max(row for row, _ in positions.values()) + 1
+    places = max(place for _, place in positions.values()) + 1
+    grid = [[' ' * width] * places for _ in range(rows)]
+    for seat, (row, place) in positions.items():
+        grid[row][place] = str(labels.get(seat, '')).rjust(width)
+    name_width = len(row_name(rows - 1))
+    return '\n'.join(f"{row_name(row).rjust(name_width)} | {' '.join(line).rstrip()}" for row, line in enumerate(grid))
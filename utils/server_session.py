@@ -0,0 +1,217 @@
+import os
+import re
+import secrets
+import time
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from sqlalchemy import delete, insert, select, update
+
+from utils.artifact_cache import ArtifactCache
+
+# Session ids are random URL-safe tokens of this many bytes
+SESSION_ID_BYTES = 32
+
+# What a session id looks like; cookies with anything else are ignored
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{20,64}')
+
+class ServerSession(SecureCookieSession):
+    """Session whose data lives in a server-side store; the cookie holds only its id."""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        super().__init__(initial)
+        self.sid = sid or secrets.token_urlsafe(SESSION_ID_BYTES)
+        self.new = new
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """
+        Move the session to a new id, keeping its data.
+
+        Called when the session gains privileges, so an id planted in the
+        browser beforehand (session fixation) is worthless afterwards.
+        """
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(SESSION_ID_BYTES)
+        self.new = True
+        self.modified = True
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Session interface that keeps session data in a server-side store.
+
+    The cookie carries a random session id instead of the signed session
+    data, so its size no longer grows with the session. Sessions expire
+    ttl seconds after their last write; a session still in use is written
+    again once less than half of its lifetime is left. Expired sessions are
+    removed from the store every compact_interval seconds.
+
+    Requests under skip_paths (static files) get an empty session without
+    touching the store.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl, compact_interval=3600, skip_paths=()):
+        self.store = store
+        self.ttl = ttl
+        self.compact_interval = compact_interval
+        self.skip_paths = tuple(skip_paths)
+        self._next_compaction = time.monotonic() + compact_interval
+
+    def open_session(self, app, request):
+        if request.path.startswith(self.skip_paths):
+            return ServerSession(new=True)
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID.fullmatch(sid):
+            record = self.store.load(sid)
+            if record is not None:
+                data, expires_at = record
+                session = ServerSession(self.serializer.loads(data), sid=sid)
+                # Keep sessions in use alive without writing on every request
+                if expires_at - datetime.utcnow() < timedelta(seconds=self.ttl / 2):
+                    session.modified = True
+                return session
+        return ServerSession(new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if session.replaced_sid is not None:
+            self.store.delete(session.replaced_sid)
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly
+                )
+                response.vary.add("Cookie")
+            return
+
+        if session.modified:
+            expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), expires_at)
+            self._maybe_compact()
+
+        # The cookie is only sent when the session is created or gets a new id
+        if session.new or (session.modified and session.permanent):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
+            response.vary.add("Cookie")
+
+    def _maybe_compact(self):
+        now = time.monotonic()
+        if now >= self._next_compaction:
+            self._next_compaction = now + self.compact_interval
+            self.store.compact()
+
+class DatabaseSessionStore:
+    """Session store in a database table with id, data and expires_at columns."""
+
+    def __init__(self, db, model):
+        self.db = db
+        self.table = model.__table__
+
+    def load(self, sid):
+        """Return (data, expires_at) of an unexpired session, or None."""
+        # A separate connection keeps session writes out of the request's transaction
+        with self.db.engine.connect() as connection:
+            row = connection.execute(
+                select(self.table.c.data, self.table.c.expires_at).where(
+                    self.table.c.id == sid, self.table.c.expires_at > datetime.utcnow()
+                )
+            ).first()
+        return tuple(row) if row is not None else None
+
+    def save(self, sid, data, expires_at):
+        with self.db.engine.begin() as connection:
+            updated = connection.execute(
+                update(self.table).where(self.table.c.id == sid).values(data=data, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                connection.execute(insert(self.table).values(id=sid, data=data, expires_at=expires_at))
+
+    def delete(self, sid):
+        with self.db.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.id == sid))
+
+    def compact(self):
+        """Remove expired sessions; returns how many were removed."""
+        with self.db.engine.begin() as connection:
+            return connection.execute(
+                delete(self.table).where(self.table.c.expires_at <= datetime.utcnow())
+            ).rowcount
+
+class FileSessionStore:
+    """Session store with one file per session; a file's mtime records its expiry."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = ArtifactCache(directory)
+
+    def _path(self, sid):
+        # Ids come from cookies; never let one name a path outside the directory
+        if not SESSION_ID.fullmatch(sid):
+            raise ValueError("Invalid session id")
+        return os.path.join(self.directory, f"{sid}.session")
+
+    def load(self, sid):
+        """Return (data, expires_at) of an unexpired session, or None."""
+        path = self._path(sid)
+        try:
+            expires = os.stat(path).st_mtime
+            if expires <= time.time():
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read(), datetime.utcfromtimestamp(expires)
+        except FileNotFoundError:
+            return None
+
+    def save(self, sid, data, expires_at):
+        path = self._path(sid)
+        self.files.put(path, data.encode('utf-8'))
+        expires = (expires_at - datetime(1970, 1, 1)).total_seconds()
+        os.utime(path, (expires, expires))
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def compact(self):
+        """Remove expired sessions; returns how many were removed."""
+        removed = 0
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return removed
+        for entry in entries:
+            if entry.name.endswith('.session') and entry.stat().st_mtime <= now:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
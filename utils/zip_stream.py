@@ -0,0 +1,43 @@
+import time
+import zipfile
+
+class _ChunkWriter:
+    """Write-only file object collecting ZIP output until it is drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """
+    Build a ZIP archive incrementally, yielding bytes as each entry is added.
+
+    The archive is written to a non-seekable sink, so zipfile emits data
+    descriptors and only the entry being added is ever held in memory.
+
+    Args:
+        entries (iterable): (name, bytes) pairs, consumed lazily
+        compression (int): zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+
+    Yields:
+        bytes: Consecutive chunks of the ZIP file
+    """
+    sink = _ChunkWriter()
+    with zipfile.ZipFile(sink, mode='w', compression=compression) as archive:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = compression
+            archive.writestr(info, data)
+            yield sink.drain()
+    yield sink.drain()